@@ -1,9 +1,16 @@
 import time
-import math
 import krpc
 from loguru import logger
 
-from helper import airplane_stage, surface_distance_to_vessel, calc_bearing, clip
+from helper import airplane_stage, calcBearing, surface_distance
+from landing import LandingParameters, landing_control
+from control_buffer import ControlBuffer
+from telemetry import Telemetry
+from scheduler import FixedRate
+from tick_timing import TickTimer
+from recorder import Recorder
+from flight_log import FlightLog
+from handles import handles_for
 
 conn = krpc.connect(name="Aircraft lift off")
 vessel = conn.space_center.active_vessel
@@ -20,6 +27,37 @@ max_horizontal_velocity = 200
 # in m/s^2
 max_horizontal_acceleration = 5
 full_speed_until_distance_from_stop = 8_000
+# Glide path: target altitude is (distance to the stop position - glide_offset) / glide_ratio
+glide_offset = 1_800
+glide_ratio = 10
+# Target pitch is sin(pitch_gain * relative altitude error) * max_pitch_angle
+pitch_gain = 0.5
+# Throttle change per tick while too slow and while too fast
+throttle_up_step = 0.05
+throttle_down_step = 0.10
+# Autopilot, per pitch, roll and yaw axis
+deceleration_time = (5, 5, 5)
+# Try to aim as best as possible
+attenuation_angle = (0.1, 0.1, 0.1)
+# Seconds between the target pitch lines in the log, every tick's are kept in recordings/aircraft_land/log.bin
+log_interval = 1
+# END OF CONFIG
+
+# The controller is shared with landing_sim.py, parameters tuned there can be copied to the config above
+landing = LandingParameters(
+    max_height=max_height,
+    max_pitch_angle=max_pitch_angle,
+    land_horizontal_velocity=land_horizontal_velocity,
+    max_horizontal_velocity=max_horizontal_velocity,
+    full_speed_until_distance_from_stop=full_speed_until_distance_from_stop,
+    glide_offset=glide_offset,
+    glide_ratio=glide_ratio,
+    pitch_gain=pitch_gain,
+    throttle_up_step=throttle_up_step,
+    throttle_down_step=throttle_down_step,
+    deceleration_time=deceleration_time[0],
+    attenuation_angle=attenuation_angle[0],
+)
 
 
 # List should be approached in reverse
@@ -41,18 +79,33 @@ approach_index = len(approach_positions) - 1
 stop_position = (-0.04854783753949805, -74.71340562868204)
 
 
-srf_frame = vessel.orbit.body.reference_frame
+handles = handles_for(conn)
+srf_frame = handles.reference_frame(handles.body(vessel))
+flight = handles.flight(vessel)
+surface_flight = handles.flight(vessel, srf_frame)
+body_radius = handles.constants(handles.body(vessel)).equatorial_radius
+time_interval = 0.1
 
-vessel_vertical_speed = conn.add_stream(getattr, vessel.flight(srf_frame), "vertical_speed")
-vessel_horizontal_speed = conn.add_stream(getattr, vessel.flight(srf_frame), "horizontal_speed")
-vessel_surface_speed = conn.add_stream(getattr, vessel.flight(srf_frame), "speed")
-vessel_latitude = conn.add_stream(getattr, vessel.flight(), "latitude")
-vessel_longitude = conn.add_stream(getattr, vessel.flight(), "longitude")
-vessel_g_force = conn.add_stream(getattr, vessel.flight(), "g_force")
-vessel_surface_altitude = conn.add_stream(getattr, vessel.flight(), "surface_altitude")
-vessel_aerodynamic_force = conn.add_stream(getattr, vessel.flight(), "aerodynamic_force")
-vessel_pitch = conn.add_stream(getattr, vessel.flight(), "pitch")
-vessel_heading = conn.add_stream(getattr, vessel.flight(), "heading")
+# All fields used by the control loop, read together once per tick
+telemetry = Telemetry(
+    conn,
+    {
+        "vertical_speed": (surface_flight, "vertical_speed"),
+        "horizontal_speed": (surface_flight, "horizontal_speed"),
+        "surface_speed": (surface_flight, "speed"),
+        "latitude": (flight, "latitude"),
+        "longitude": (flight, "longitude"),
+        "g_force": (flight, "g_force"),
+        "surface_altitude": (flight, "surface_altitude"),
+        "aerodynamic_force": (flight, "aerodynamic_force"),
+        "pitch": (flight, "pitch"),
+        "heading": (flight, "heading"),
+        "throttle": (vessel.control, "throttle"),
+    },
+    rate=2 / time_interval,
+)
+recorder = Recorder("recordings/aircraft_land", telemetry)
+log = FlightLog("recordings/aircraft_land", every=log_interval)
 
 
 vessel.auto_pilot.engage()
@@ -62,105 +115,91 @@ vessel.auto_pilot.roll_threshold = 5
 # vessel.auto_pilot.roll_threshold = 20
 
 # vessel.auto_pilot.deceleration_time = (30, 30, 10)
-vessel.auto_pilot.deceleration_time = (5, 5, 5)
+vessel.auto_pilot.deceleration_time = deceleration_time
 # vessel.auto_pilot.deceleration_time = (10, 5, 5)
 
-# Try to aim as best as possible
-vessel.auto_pilot.attenuation_angle = (0.1, 0.1, 0.1)
+vessel.auto_pilot.attenuation_angle = attenuation_angle
 
 vessel.auto_pilot.target_roll = 0
 # # vessel.auto_pilot.target_heading = 90
 
+# Control and autopilot writes of a tick, sent together and only if they changed
+commands = ControlBuffer(conn, vessel)
 
-vertical_velocity_old = vessel_vertical_speed()
-vertical_velocity_current = vessel_vertical_speed()
 
-horizontal_velocity_old = vessel_horizontal_speed()
-horizontal_velocity_current = vessel_horizontal_speed()
+t = telemetry.snapshot()
+vertical_velocity_old = t.vertical_speed
+vertical_velocity_current = t.vertical_speed
+
+horizontal_velocity_old = t.horizontal_speed
+horizontal_velocity_current = t.horizontal_speed
+
+vertical_acceleration = 0.0
+horizontal_acceleration = 0.0
 
-target_pitch = vessel_pitch()
-time_interval = 0.1
 touch_down = False
-while 1:
-    time.sleep(time_interval)
+# Ticks every 0.1 s without drift, dt is measured in game time so the accelerations use the real sample spacing
+game_time = conn.add_stream(getattr, conn.space_center, "ut")
+timing = TickTimer("landing", interval=time_interval, conn=conn)
+for tick in timing.track(FixedRate(time_interval, clock=game_time)):
+    t = telemetry.snapshot()
+    if tick.skipped:
+        logger.warning(f"Control loop overran, skipped {tick.skipped} tick(s)")
 
-    brakes = False
     # airplane_stage()
 
     target_position: tuple = approach_positions[approach_index] if approach_index >= 0 else stop_position
-    distance_to_target: float = surface_distance_to_vessel(*target_position)
-    distance_to_stop: float = surface_distance_to_vessel(*stop_position)
-
-    # Vertical acceleration in m/s^2
-    vertical_velocity_old = vertical_velocity_current
-    vertical_velocity_current = vessel_vertical_speed()
-    vertical_acceleration = (vertical_velocity_current - vertical_velocity_old) / time_interval
-
-    # Horizontal acceleration in m/s^2
-    horizontal_velocity_old = horizontal_velocity_current
-    horizontal_velocity_current = vessel_horizontal_speed()
-    horizontal_acceleration = (horizontal_velocity_current - horizontal_velocity_old) / time_interval
-
-    # Velocity and acceleration as fraction compared to target max velocity and acceleration
-    if distance_to_stop < full_speed_until_distance_from_stop:
-        horizontal_velocity_fraction = horizontal_velocity_current / land_horizontal_velocity
-    else:
-        horizontal_velocity_fraction = horizontal_velocity_current / max_horizontal_velocity
-    horizontal_acceleration_fraction = horizontal_acceleration / max_horizontal_acceleration
-    # Increase throttle if horizontal velocity is below landing velocity
-    if horizontal_velocity_fraction < 1:
-        # Max acceleration not yet reached
-        if horizontal_acceleration < 1:
-            if vessel.control.throttle < 1:
-                logger.info(f"Increasing throttle")
-            vessel.control.throttle += 0.05
-        else:
-            pass
-    # Lower throttle if horizontal velocity is above landing velocity
-    else:
-        # Max decceleration not yet reached
-        if horizontal_acceleration > -1:
-            if vessel.control.throttle > 0:
-                logger.info(f"Lowering throttle")
-            vessel.control.throttle -= 0.1
-        else:
-            pass
-
-        if horizontal_velocity_fraction > 1.1:
-            brakes = True
-
-    target_altitude = (distance_to_stop - 1800) / 10
-    target_altitude = clip(0.01, target_altitude, max_height)
-
-    # TODO figure out at what pitch there is very little altitude loss at current velocity
-    replace_me_pitch = 1
-    # TODO also figure out how far the wheels are away from the center of mass
-    replace_me_altitude = 20
-    if target_altitude > replace_me_altitude and not touch_down:
-        frac1 = 1 - vessel_surface_altitude() / target_altitude
-        frac2 = target_altitude / vessel_surface_altitude() - 1
-        frac = frac1 if vessel_surface_altitude() >= target_altitude else frac2
-        angle = 0.5 * clip(-math.pi, frac, math.pi)
-        target_pitch = math.sin(angle) * max_pitch_angle
-
-        target_pitch = clip(-max_pitch_angle, target_pitch, max_pitch_angle)
-        logger.info(
-            f"Target pitch: {target_pitch:.01f}, target height: {target_altitude:.01f}, {angle:.01f} {frac:.01f} {distance_to_stop:.01f}"
+    # From the snapshot's position, so distances and bearing are of the same moment as the speeds and altitude
+    distance_to_target: float = surface_distance(t.latitude, t.longitude, *target_position, body_radius)
+    distance_to_stop: float = surface_distance(t.latitude, t.longitude, *stop_position, body_radius)
+
+    # No game time passed (e.g. paused), keep the previous accelerations
+    if tick.dt > 0:
+        # Vertical acceleration in m/s^2
+        vertical_velocity_old = vertical_velocity_current
+        vertical_velocity_current = t.vertical_speed
+        vertical_acceleration = (vertical_velocity_current - vertical_velocity_old) / tick.dt
+
+        # Horizontal acceleration in m/s^2
+        horizontal_velocity_old = horizontal_velocity_current
+        horizontal_velocity_current = t.horizontal_speed
+        horizontal_acceleration = (horizontal_velocity_current - horizontal_velocity_old) / tick.dt
+
+    # Speed by throttle on a glide path to the stop position, then touch down and brake
+    old_throttle = commands.control.throttle
+    target_pitch, throttle, brakes, touch_down, target_altitude = landing_control(
+        landing,
+        distance_to_stop,
+        t.surface_altitude,
+        horizontal_velocity_current,
+        horizontal_acceleration,
+        old_throttle,
+        touch_down,
+    )
+    target_pitch, throttle, brakes, touch_down = float(target_pitch), float(throttle), bool(brakes), bool(touch_down)
+    # Only a change between the two is logged right away
+    if throttle > old_throttle:
+        log.info("Increasing throttle", key="throttle", every=0)
+    elif throttle < old_throttle and not touch_down:
+        log.info("Lowering throttle", key="throttle", every=0)
+    commands.control.throttle = throttle
+    commands.auto_pilot.target_pitch = target_pitch
+    if not touch_down:
+        log.info(
+            "Target pitch: {:.01f}, target height: {:.01f}, {:.01f}", target_pitch, float(target_altitude), distance_to_stop
         )
-        vessel.auto_pilot.target_pitch = target_pitch
+        recorder.command("target_pitch", target_pitch)
 
         # Calculate heading (bearing) to target coordinate
-        target_heading: float = calc_bearing(*target_position)
-        vessel.auto_pilot.target_heading = target_heading
+        target_heading: float = calcBearing(t.latitude, t.longitude, *target_position)
+        commands.auto_pilot.target_heading = target_heading
+        recorder.command("target_heading", target_heading)
     else:
-        touch_down = True
-        vessel.auto_pilot.target_pitch = replace_me_pitch
-        vessel.auto_pilot.target_heading = 270
-        vessel.control.throttle = 0
-        brakes = True
-
+        commands.auto_pilot.target_heading = 270
 
-    vessel.control.brakes = brakes
+    commands.control.brakes = brakes
+    commands.flush()
+    recorder.command("brakes", brakes)
 
     # If close to waypoint, pick next waypoint
     if distance_to_target < min(2000, 5*max_horizontal_velocity) and target_position != stop_position:
@@ -168,11 +207,16 @@ while 1:
         logger.info(f"Reached a waypoint! Approach index at: {approach_index}")
 
     # If horizontal speed small 1 and low altitude, means we landed probably
-    if vessel_horizontal_speed() < 1 and vessel_surface_altitude() < 100:
+    if t.horizontal_speed < 1 and t.surface_altitude < 100:
         time.sleep(1)
         logger.info(f"Aircraft landed (I hope)!")
         break
 
+game_time.remove()
+log.close()
+logger.info(f"Tick timing:\n{timing.report()}")
+recorder.close()
+telemetry.close()
 # vessel.control.brakes = False
 vessel.control.throttle = 0
 vessel.auto_pilot.disengage()
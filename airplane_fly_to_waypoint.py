@@ -1,10 +1,14 @@
-import time
 import math
 import krpc
 from loguru import logger
 
-from helper import surface_distance_to_vessel, calc_bearing, clip
+from handles import handles_for
+from helper import surface_distance_to_vessel, calc_bearing, clip, stage_if_low_on_fuel, vessel_latitude, vessel_longitude
 from run_science import Science
+from mission import Mission
+from resource_monitor import ResourceMonitor
+from streams import registry_for
+from waypoint_index import WaypointIndex
 
 
 conn = krpc.connect(name="Airplane fly to waypoint")
@@ -26,34 +30,47 @@ target_height = 6_000
 min_height = 1_000
 max_pitch_angle = 30
 run_science = True
+# Stage once the current stage runs out of fuel, e.g. to drop empty tanks
+stage_when_out_of_fuel = True
 
 max_altitude_of_waypoint = 15_000
 # max_altitude_of_waypoint = 150_000
+# Seconds between heading and pitch corrections
+pilot_interval = 1
 
 
-vessel_experiments = conn.add_stream(getattr, vessel.parts, "experiments")
-vessel_surface_altitude = conn.add_stream(getattr, vessel.flight(), "surface_altitude")
+# Only read once per pilot run
+streams = registry_for(conn)
+vessel_experiments = streams.acquire(getattr, vessel.parts, "experiments", rate=2 / pilot_interval)
+handles = handles_for(conn)
+vessel_surface_altitude = streams.acquire(getattr, handles.flight(vessel), "surface_altitude", rate=2 / pilot_interval)
 
-science = Science()
+science = Science(conn, vessel)
+monitor = ResourceMonitor(streams, vessel)
 
-# TODO initially list all the waypoint targets?
+# Waypoints are read once and kept up to date as contracts appear or complete
+waypoint_index = WaypointIndex(conn)
 
 current_target = None
-while 1:
-    time.sleep(1)
+
+
+def watch_staging():
+    stage_if_low_on_fuel(monitor=monitor)
+
+
+def fly() -> bool:
+    global current_target
     # Get contract
     if not current_target:
-        waypoints = conn.space_center.waypoint_manager.waypoints
-        waypoints.sort(key=lambda w: surface_distance_to_vessel(w.latitude, w.longitude))
-        current_target = next(
-            (w for w in waypoints if w.has_contract and w.near_surface and w.surface_altitude < max_altitude_of_waypoint), None
+        # Nearest contract waypoint, the coordinates stay cached on the ranked entry
+        waypoints = waypoint_index.nearest(
+            handles.body(vessel), vessel_latitude(), vessel_longitude(), max_surface_altitude=max_altitude_of_waypoint
         )
-        # current_target = next(
-        #     (w for w in waypoints if w.has_contract and w.near_surface and w.surface_altitude < max_altitude_of_waypoint and w.icon not in {"eva"}), None
-        # )
+        current_target = waypoints[0] if waypoints else None
+        # current_target = next((w for w in waypoints if w.waypoint.icon not in {"eva"}), None)
         if current_target:
             logger.info(
-                f"Found a waypoint target: {current_target.name} with distance {surface_distance_to_vessel(current_target.latitude, current_target.longitude):.01f} in direction {calc_bearing(current_target.latitude, current_target.longitude):.01f} and icon '{current_target.icon}'"
+                f"Found a waypoint target: {current_target.waypoint.name} with distance {current_target.distance:.01f} in direction {current_target.bearing:.01f} and icon '{current_target.waypoint.icon}'"
             )
             vessel.auto_pilot.engage()
             vessel.control.throttle = 1
@@ -68,8 +85,6 @@ while 1:
             vessel.auto_pilot.target_roll = 0
 
     if current_target:
-        science.run()
-
         # vessel_horizontal_speed = flight.horizontal_speed
 
         # Auto correct bearing
@@ -96,14 +111,17 @@ while 1:
                 "thermometer": "sensorThermometer",
                 # "thermometer": "sensorBarometer",
             }
-            search_icon = icons[current_target.icon]
+            icon = current_target.waypoint.icon
+            search_icon = icons[icon]
             experiment = next((e for e in experiments if search_icon in e.part.name), None)
             if experiment:
                 if experiment.has_data and experiment.rerunnable:
                     experiment.reset()
-                    time.sleep(0.1)
-                experiment.run()
-                logger.info(f"Gathering experiment in part {experiment.part.name} {current_target.icon}")
+                    # Run it once the reset went through, without holding up the pilot
+                    mission.call_later(0.1, experiment.run)
+                else:
+                    experiment.run()
+                logger.info(f"Gathering experiment in part {experiment.part.name} {icon}")
                 current_target = None
             # Mark1Cockpit
             # sensorBarometer
@@ -117,4 +135,16 @@ while 1:
         logger.info(f"Exiting program. No more waypoints available")
         # vessel.control.throttle = 0
         vessel.auto_pilot.disengage()
-        break
+        return True
+    return False
+
+
+# The pilot, the science runs and the staging watcher are independent jobs, a slow experiment scan never delays
+# heading corrections
+mission = Mission(conn=conn)
+mission.every("pilot", pilot_interval, fly)
+if run_science:
+    mission.every("science", 1, science.run)
+if stage_when_out_of_fuel:
+    mission.every("staging", 0.5, watch_staging)
+mission.run()
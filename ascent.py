@@ -0,0 +1,68 @@
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+
+class AscentParameters(NamedTuple):
+    # Tunables of the gravity turn ascent, see spacecraft_lift_off.py. Every field may also be a NumPy array with one
+    # value per candidate, which is how ascent_sim.py flies many candidates at once.
+    target_apoapsis_altitude: float = 72_000
+    gravity_turn_start_altitude: float = 3_000
+    gravity_turn_end_altitude: float = 50_000
+    min_altitude_before_program_stops: float = 35_000
+    # Throttle to full until the current stage is out of fuel
+    boost_until_out_of_fuel: bool = True
+    # Above this altitude, once the apoapsis is high enough, the vessel pitches down to the horizon
+    pitch_down_altitude: float = 20_000
+    # Throttle change per control step while facing the target attitude and while not
+    throttle_up_step: float = 0.05
+    throttle_down_step: float = 0.10
+    # Degree tolerance
+    pitch_tolerance: float = 20
+    heading_tolerance: float = 10
+    # Pitch tolerance while pitched down to the horizon with the apoapsis still too low
+    pitched_down_pitch_tolerance: float = 30
+
+
+def ascent_control(
+    p: AscentParameters,
+    surface_altitude,
+    apoapsis_altitude,
+    pitch,
+    heading,
+    target_pitch,
+    target_heading,
+    throttle,
+    apoapsis_reached_once,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # One step of the ascent controller, returns (target pitch, throttle, apoapsis reached once).
+    # Works on scalars from the game and on arrays of candidates alike. The throttle is clamped like the game does.
+    pitch_down = np.asarray(p.boost_until_out_of_fuel) & (
+        (surface_altitude > p.pitch_down_altitude) & (apoapsis_altitude > p.target_apoapsis_altitude)
+        | apoapsis_reached_once
+    )
+    apoapsis_reached_once = apoapsis_reached_once | pitch_down
+    turning = ~pitch_down & (surface_altitude > p.gravity_turn_start_altitude)
+    frac = (surface_altitude - p.gravity_turn_start_altitude) / (p.gravity_turn_end_altitude - p.gravity_turn_start_altitude)
+    target_pitch = np.where(pitch_down, 0.0, np.where(turning, 90 - np.minimum(90, frac * 90), target_pitch))
+    pitch_tolerance = np.where(
+        pitch_down & (apoapsis_altitude < p.target_apoapsis_altitude), p.pitched_down_pitch_tolerance, p.pitch_tolerance
+    )
+
+    # If the vessel is not facing the target pitch and heading: throttle down
+    facing_target = (np.abs(target_pitch - pitch) < pitch_tolerance) & (
+        np.abs(target_heading - heading) < p.heading_tolerance
+    )
+    # Only if pitch is < 90 can the heading be facing the correct way
+    throttle = np.where(
+        ~facing_target & (target_pitch < 90), throttle - p.throttle_down_step, throttle + p.throttle_up_step
+    )
+    return target_pitch, np.clip(throttle, 0.0, 1.0), apoapsis_reached_once
+
+
+def ascent_done(p: AscentParameters, surface_altitude, apoapsis_altitude, fuel):
+    # The apoapsis is reached and, when boosting until the stage is empty, the stage is empty
+    boosting = np.asarray(p.boost_until_out_of_fuel) & (fuel > 0.1)
+    return ~boosting & (p.min_altitude_before_program_stops < surface_altitude) & (
+        p.target_apoapsis_altitude < apoapsis_altitude
+    )
@@ -0,0 +1,241 @@
+"""
+Ascent simulator
+
+python ascent_sim.py --candidates 2000 --workers 4
+python ascent_sim.py --vary gravity_turn_start_altitude=1000:8000 --vary throttle_up_step=0.01:0.2 --top 5
+
+Flies many candidate sets of gravity turn parameters at once with the controller of spacecraft_lift_off.py (see
+ascent.py) in a point-mass model of the launch: gravity, drag, staging and altitude dependent thrust and Isp, on
+Kerbin's equator, heading east. Each candidate is scored by its fuel to orbit, the fuel burnt until the script ends
+plus the fuel to circularize at the apoapsis. The rocket is the one of the stand-in server.
+"""
+
+import argparse
+import math
+import os
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from loguru import logger
+
+from ascent import AscentParameters, ascent_control, ascent_done
+from stand_in_server import (
+    G0,
+    KERBIN_GRAVITATIONAL_PARAMETER,
+    KERBIN_RADIUS,
+    KERBIN_ROTATIONAL_SPEED,
+    RESOURCE_DENSITY,
+    SEA_LEVEL_DENSITY,
+    Simulation,
+)
+from sweep import atmospheric_densities, broadcast, candidate_count, parse_ranges, sample_parameters, simulate_parallel
+
+# Parameters varied by default and their ranges
+DEFAULT_RANGES: Dict[str, Tuple[float, float]] = {
+    "gravity_turn_start_altitude": (500, 10_000),
+    "gravity_turn_end_altitude": (20_000, 70_000),
+    "throttle_up_step": (0.01, 0.2),
+    "throttle_down_step": (0.02, 0.3),
+}
+
+
+class RocketStage(NamedTuple):
+    # Parts dropped together by one decouple, with the engine that burns their fuel
+    dry_mass: float
+    fuel_mass: float
+    max_thrust: float
+    isp_vacuum: float
+    isp_sea_level: float
+    # kg per unit, staging decisions are made on units like in the game
+    fuel_density: float = RESOURCE_DENSITY["LiquidFuel"]
+
+
+class Rocket(NamedTuple):
+    # Stages in the order they fire
+    stages: Tuple[RocketStage, ...]
+    # Mass that is never dropped
+    payload_mass: float
+    # Drag coefficient times reference area in m^2
+    drag_area: float
+    # Largest attitude change of the autopilot per second in degrees
+    rotation_rate: float = 10.0
+
+
+def stand_in_rocket() -> Rocket:
+    # The rocket of the stand-in server's rocket scenario
+    vessel = Simulation("rocket").space_center.active_vessel
+    engine_parts = sorted((p for p in vessel.part_list if p.engine), key=lambda p: -p.stage)
+    stages = []
+    for part in engine_parts:
+        engine = part.engine
+        dropped = [p for p in vessel.part_list if p.decouple_stage == part.decouple_stage]
+        density = RESOURCE_DENSITY[engine.propellant]
+        fuel = sum(p.resource_amounts.get(engine.propellant, (0, 0))[0] for p in dropped) * density
+        dry = sum(p.mass for p in dropped) - fuel
+        stages.append(RocketStage(dry, fuel, engine.max_thrust, engine.isp_vacuum, engine.isp_sea_level, density))
+    dropped_stages = {p.decouple_stage for p in engine_parts}
+    payload = sum(p.mass for p in vessel.part_list if p.decouple_stage not in dropped_stages)
+    return Rocket(tuple(stages), payload, vessel.drag_area, vessel.rotation_rate)
+
+
+def _apoapsis_radius(r: np.ndarray, v_r: np.ndarray, v_t: np.ndarray) -> np.ndarray:
+    mu = KERBIN_GRAVITATIONAL_PARAMETER
+    energy = (v_r ** 2 + v_t ** 2) / 2 - mu / r
+    h = r * v_t
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(energy < 0, -mu / (2 * energy), np.inf)
+        e = np.sqrt(np.maximum(0.0, 1 + 2 * energy * h ** 2 / mu ** 2))
+        return np.where(energy < 0, a * (1 + e), np.inf)
+
+
+def simulate(rocket: Rocket, p: AscentParameters, dt: float = 0.02, max_time: float = 600) -> Dict[str, np.ndarray]:
+    # Flies every candidate in 'p' (fields are scalars or arrays of the same length) until the controller ends the
+    # ascent or 'max_time' seconds pass. The controller runs once per step, like the script once per physics frame.
+    p = broadcast(p)
+    n = candidate_count(p)
+    # One extra empty stage for candidates that dropped all of them
+    stages = list(rocket.stages) + [RocketStage(0.0, 0.0, 0.0, 1.0, 1.0)]
+    dry = np.array([s.dry_mass for s in stages])
+    max_thrust = np.array([s.max_thrust for s in stages])
+    isp_vacuum = np.array([s.isp_vacuum for s in stages])
+    isp_sea_level = np.array([s.isp_sea_level for s in stages])
+    fuel_density = np.array([s.fuel_density for s in stages])
+    last_stage = len(stages) - 1
+    candidates = np.arange(n)
+
+    fuel = np.tile(np.array([s.fuel_mass for s in stages]), (n, 1))
+    stage = np.zeros(n, dtype=np.int64)
+    mass = np.full(n, rocket.payload_mass + dry.sum() + fuel[0].sum())
+    r = np.full(n, float(KERBIN_RADIUS))
+    v_r = np.zeros(n)
+    # On the pad the vessel moves with the rotating surface
+    v_t = np.full(n, KERBIN_ROTATIONAL_SPEED * KERBIN_RADIUS)
+    pitch = np.full(n, 90.0)
+    heading = np.full(n, 90.0)
+    target_pitch = np.full(n, 90.0)
+    # The script throttles up before its first frame
+    throttle = np.ones(n)
+    apoapsis_reached_once = np.zeros(n, dtype=bool)
+    running = np.ones(n, dtype=bool)
+    fuel_used = np.zeros(n)
+    end_time = np.full(n, np.nan)
+    apoapsis_at_end = np.full(n, np.nan)
+
+    for step in range(int(max_time / dt)):
+        if not running.any():
+            break
+        altitude = r - KERBIN_RADIUS
+        apoapsis_altitude = _apoapsis_radius(r, v_r, v_t) - KERBIN_RADIUS
+        stage_fuel = fuel[candidates, stage] / fuel_density[stage]
+
+        # Staging like stage_if_low_on_fuel, while the apoapsis is still too low
+        stage_now = running & (apoapsis_altitude < p.target_apoapsis_altitude) & (stage_fuel < 0.1) & (stage < last_stage)
+        mass -= np.where(stage_now, dry[stage] + fuel[candidates, stage], 0.0)
+        stage = stage + stage_now
+        stage_fuel = fuel[candidates, stage] / fuel_density[stage]
+
+        new_target_pitch, new_throttle, new_reached = ascent_control(
+            p, altitude, apoapsis_altitude, pitch, heading, target_pitch, heading, throttle, apoapsis_reached_once
+        )
+        target_pitch = np.where(running, new_target_pitch, target_pitch)
+        throttle = np.where(running, new_throttle, throttle)
+        apoapsis_reached_once = np.where(running, new_reached, apoapsis_reached_once)
+
+        done = running & ascent_done(p, altitude, apoapsis_altitude, np.where(stage_fuel < 0.1, 0.0, stage_fuel))
+        end_time[done] = step * dt
+        apoapsis_at_end[done] = apoapsis_altitude[done]
+        running &= ~done
+
+        # Attitude
+        max_change = rocket.rotation_rate * dt
+        pitch = np.where(running, pitch + np.clip(target_pitch - pitch, -max_change, max_change), pitch)
+
+        # Engines
+        density = atmospheric_densities(altitude)
+        isp = isp_vacuum[stage] - (isp_vacuum[stage] - isp_sea_level[stage]) * density / SEA_LEVEL_DENSITY
+        thrust = max_thrust[stage] * isp / isp_vacuum[stage] * throttle * running
+        burn = np.minimum(thrust / (isp * G0) * dt, fuel[candidates, stage])
+        thrust = np.where(fuel[candidates, stage] > 0, thrust, 0.0)
+        fuel[candidates, stage] -= burn
+        mass -= burn
+        fuel_used += burn
+
+        # Drag against the surface velocity, gravity and the apparent forces of the rotating local frame
+        v_surface = v_t - KERBIN_ROTATIONAL_SPEED * r
+        speed = np.hypot(v_r, v_surface)
+        drag = 0.5 * density * speed ** 2 * rocket.drag_area / np.maximum(speed, 1e-6)
+        radians = np.radians(pitch)
+        a_r = (thrust * np.sin(radians) - drag * v_r) / mass - KERBIN_GRAVITATIONAL_PARAMETER / r ** 2 + v_t ** 2 / r
+        a_t = (thrust * np.cos(radians) - drag * v_surface) / mass - v_r * v_t / r
+        v_r = np.where(running, v_r + a_r * dt, v_r)
+        v_t = np.where(running, v_t + a_t * dt, v_t)
+        # Resting on the ground
+        v_r = np.where(r + v_r * dt <= KERBIN_RADIUS, np.maximum(0.0, v_r), v_r)
+        r = np.maximum(float(KERBIN_RADIUS), r + v_r * dt * running)
+
+    # Circularize at the apoapsis with what is left, in vacuum. Drag while coasting up is ignored.
+    r_apoapsis = _apoapsis_radius(r, v_r, v_t)
+    with np.errstate(invalid="ignore"):
+        delta_v = np.maximum(0.0, np.sqrt(KERBIN_GRAVITATIONAL_PARAMETER / r_apoapsis) - r * v_t / r_apoapsis)
+    delta_v = np.where(running | ~np.isfinite(r_apoapsis), np.inf, delta_v)
+    circularization = np.zeros(n)
+    for offset in range(last_stage):
+        current = np.minimum(stage + offset, last_stage)
+        exhaust_velocity = isp_vacuum[current] * G0
+        available = fuel[candidates, current]
+        needed = mass * (1 - np.exp(-np.minimum(delta_v, 1e6) / exhaust_velocity))
+        used = np.where(max_thrust[current] > 0, np.minimum(needed, available), 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta_v = np.where(used > 0, np.maximum(0.0, delta_v - exhaust_velocity * np.log(mass / (mass - used))), delta_v)
+        circularization += used
+        # Drop the stage when it burnt out and more is needed
+        mass -= used + np.where(delta_v > 1e-3, dry[current] + available - used, 0.0)
+    reached = ~running & (delta_v <= 1e-3)
+
+    return {
+        "reached_orbit": reached,
+        "fuel_to_orbit": np.where(reached, fuel_used + circularization, np.inf),
+        "ascent_fuel": fuel_used,
+        "circularization_fuel": np.where(reached, circularization, np.inf),
+        "ascent_time": end_time,
+        "apoapsis_altitude": apoapsis_at_end,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize gravity turn parameters in a simulated ascent")
+    parser.add_argument("--candidates", type=int, default=1_000)
+    parser.add_argument(
+        "--vary",
+        metavar="NAME=LOW:HIGH",
+        action="append",
+        default=[],
+        help=f"Parameter range to sample, default: {', '.join(DEFAULT_RANGES)}",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--dt", type=float, default=0.02, help="Time step in seconds")
+    parser.add_argument("--max-time", type=float, default=600, help="Seconds before a candidate counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    ranges = parse_ranges(args.vary) if args.vary else dict(DEFAULT_RANGES)
+
+    rocket = stand_in_rocket()
+    candidates = sample_parameters(args.candidates, ranges, AscentParameters(), seed=args.seed)
+    results = simulate_parallel(simulate, rocket, candidates, args.workers, dt=args.dt, max_time=args.max_time)
+
+    fuel = results["fuel_to_orbit"]
+    logger.info(f"{int(results['reached_orbit'].sum())} of {args.candidates} candidates reach orbit")
+    header = "".join(f"{name:>30}" for name in ranges)
+    print(f"{'rank':>4} {'fuel to orbit kg':>17} {'ascent kg':>10} {'circularize kg':>15} {'apoapsis m':>11}{header}")
+    order = np.argsort(fuel)
+    rows: List[int] = [int(i) for i in order[: args.top]]
+    for rank, i in [(rank + 1, i) for rank, i in enumerate(rows)] + [("base", 0)]:
+        parameters = "".join(f"{getattr(candidates, name)[i]:>30.3f}" for name in ranges)
+        print(
+            f"{rank:>4} {fuel[i]:>17.1f} {results['ascent_fuel'][i]:>10.1f} {results['circularization_fuel'][i]:>15.1f}"
+            f" {results['apoapsis_altitude'][i]:>11.0f}{parameters}"
+        )
+    if math.isfinite(fuel[0]) and math.isfinite(fuel[order[0]]):
+        logger.info(f"Best candidate saves {fuel[0] - fuel[order[0]]:.1f} kg of fuel over the current config")
@@ -0,0 +1,395 @@
+import argparse
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import krpc.schema.KRPC_pb2 as KRPC
+from krpc.decoder import Decoder
+from krpc.encoder import Encoder
+from krpc.types import Types
+from loguru import logger
+
+from protocol import receive_message, send_message
+
+# CONFIG
+# The kRPC server in the game
+server_address = "127.0.0.1"
+server_rpc_port = 50000
+server_stream_port = 50001
+# Where scripts connect to the broker
+listen_address = "127.0.0.1"
+listen_rpc_port = 50010
+listen_stream_port = 50011
+
+_types = Types()
+
+
+class _Subscription:
+    # One stream on the server, shared by every client that added the same call
+    def __init__(self, stream_id: int, key: bytes):
+        self.id = stream_id
+        self.key = key
+        # Clients using the stream and the rate each asked for, 0 is as fast as possible
+        self.clients: Dict["_BrokerClient", float] = {}
+        self.rate = 0.0
+
+
+class _BrokerClient:
+    def __init__(self, rpc_socket: socket.socket, name: str):
+        self.rpc_socket = rpc_socket
+        self.stream_socket: Optional[socket.socket] = None
+        self.identifier = os.urandom(16)
+        self.name = name
+        self.started: Set[int] = set()
+        self.send_lock = threading.Lock()
+
+    def send_update(self, results: List[KRPC.StreamResult]):
+        if self.stream_socket is None:
+            return
+        update = KRPC.StreamUpdate()
+        update.results.extend(results)
+        try:
+            with self.send_lock:
+                send_message(self.stream_socket, update)
+        except OSError:
+            pass
+
+
+class Broker:
+    # Shares one connection to the kRPC server between any number of local scripts.
+    # Scripts connect to the broker with the normal krpc client, it speaks the same protocol:
+    #   conn = krpc.connect(name="Science", rpc_port=50010, stream_port=50011)
+    # Calls are forwarded over the broker's connection. Streams of identical calls are created once on the server
+    # and their updates fanned out to every client using them; a stream is removed from the server when its last
+    # client removes it or disconnects. To run scripts unchanged, move the game's server to other ports and let the
+    # broker listen on 50000 and 50001.
+    def __init__(
+        self,
+        address: str = server_address,
+        rpc_port: int = server_rpc_port,
+        stream_port: int = server_stream_port,
+        listen_address: str = listen_address,
+        listen_rpc_port: int = listen_rpc_port,
+        listen_stream_port: int = listen_stream_port,
+    ):
+        self._lock = threading.Lock()
+        self._rpc_lock = threading.Lock()
+        # Held while a stream is added to or removed from the server. The server gives identical calls the same
+        # stream id, so a RemoveStream still on its way would otherwise delete a stream a client just added again.
+        self._streams_lock = threading.Lock()
+        self._running = threading.Event()
+        self.clients: List[_BrokerClient] = []
+        self._subscriptions: Dict[int, _Subscription] = {}
+        self._by_key: Dict[bytes, _Subscription] = {}
+        # Latest value of every server stream. Updates can arrive before AddStream returned the stream's id, so they
+        # are kept even for streams no client is subscribed to yet.
+        self._latest: Dict[int, KRPC.ProcedureResult] = {}
+
+        self._rpc, response = self._connect(
+            address, rpc_port, KRPC.ConnectionRequest(type=KRPC.ConnectionRequest.RPC, client_name="Broker")
+        )
+        self._stream, _ = self._connect(
+            address,
+            stream_port,
+            KRPC.ConnectionRequest(type=KRPC.ConnectionRequest.STREAM, client_identifier=response.client_identifier),
+        )
+        self._rpc_listener = self._listen(listen_address, listen_rpc_port)
+        self._stream_listener = self._listen(listen_address, listen_stream_port)
+        # Actual ports, when 0 was passed to pick free ones
+        self.rpc_port = self._rpc_listener.getsockname()[1]
+        self.stream_port = self._stream_listener.getsockname()[1]
+
+    @staticmethod
+    def _connect(address: str, port: int, request: KRPC.ConnectionRequest) -> Tuple[socket.socket, KRPC.ConnectionResponse]:
+        sock = socket.create_connection((address, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(sock, request)
+        response = receive_message(sock, KRPC.ConnectionResponse)
+        if response.status != KRPC.ConnectionResponse.OK:
+            raise ConnectionError(f"kRPC server at {address}:{port} refused the connection: {response.message}")
+        return sock, response
+
+    @staticmethod
+    def _listen(address: str, port: int) -> socket.socket:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((address, port))
+        listener.listen()
+        return listener
+
+    def start(self) -> "Broker":
+        self._running.set()
+        for target in (self._accept_rpc, self._accept_stream, self._forward_updates):
+            threading.Thread(target=target, daemon=True).start()
+        logger.info(f"Broker listening on port {self.rpc_port} (streams on {self.stream_port})")
+        return self
+
+    def stop(self):
+        self._running.clear()
+        for sock in (self._rpc_listener, self._stream_listener, self._rpc, self._stream):
+            sock.close()
+        for client in list(self.clients):
+            for sock in (client.rpc_socket, client.stream_socket):
+                if sock is not None:
+                    sock.close()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self._running.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    # Server side
+    def _call(self, calls: List[KRPC.ProcedureCall]) -> List[KRPC.ProcedureResult]:
+        request = KRPC.Request()
+        request.calls.extend(calls)
+        with self._rpc_lock:
+            send_message(self._rpc, request)
+            response = receive_message(self._rpc, KRPC.Response)
+        if response.HasField("error"):
+            return [KRPC.ProcedureResult(error=response.error) for _ in calls]
+        return list(response.results)
+
+    def _krpc_call(self, procedure: str, *arguments: bytes) -> KRPC.ProcedureResult:
+        call = KRPC.ProcedureCall(service="KRPC", procedure=procedure)
+        for position, value in enumerate(arguments):
+            call.arguments.add(position=position, value=value)
+        return self._call([call])[0]
+
+    def _forward_updates(self):
+        try:
+            while self._running.is_set():
+                update = receive_message(self._stream, KRPC.StreamUpdate)
+                fan_out: Dict[_BrokerClient, List[KRPC.StreamResult]] = {}
+                with self._lock:
+                    for result in update.results:
+                        self._latest[result.id] = result.result
+                        subscription = self._subscriptions.get(result.id)
+                        if subscription is None:
+                            continue
+                        for client in subscription.clients:
+                            if result.id in client.started:
+                                fan_out.setdefault(client, []).append(result)
+                for client, results in fan_out.items():
+                    client.send_update(results)
+        except (ConnectionError, OSError):
+            if self._running.is_set():
+                logger.error("Lost the stream connection to the kRPC server")
+
+    # Client side
+    def _accept_rpc(self):
+        while self._running.is_set():
+            try:
+                sock, _ = self._rpc_listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve_client, args=(sock,), daemon=True).start()
+
+    def _accept_stream(self):
+        while self._running.is_set():
+            try:
+                sock, _ = self._stream_listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            request = receive_message(sock, KRPC.ConnectionRequest)
+            with self._lock:
+                client = next((c for c in self.clients if c.identifier == request.client_identifier), None)
+            if request.type != KRPC.ConnectionRequest.STREAM or client is None:
+                send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.WRONG_TYPE, message="Unknown client"))
+                sock.close()
+                continue
+            client.stream_socket = sock
+            send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.OK))
+
+    def _serve_client(self, sock: socket.socket):
+        request = receive_message(sock, KRPC.ConnectionRequest)
+        if request.type != KRPC.ConnectionRequest.RPC:
+            send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.WRONG_TYPE, message="Expected an RPC connection"))
+            sock.close()
+            return
+        client = _BrokerClient(sock, request.client_name)
+        with self._lock:
+            self.clients.append(client)
+        send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.OK, client_identifier=client.identifier))
+        logger.info(f"Client connected: '{client.name}'")
+        try:
+            while True:
+                request = receive_message(sock, KRPC.Request)
+                response = KRPC.Response()
+                response.results.extend(self._execute(client, list(request.calls)))
+                send_message(sock, response)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self.clients.remove(client)
+                subscriptions = [s for s in self._subscriptions.values() if client in s.clients]
+            for subscription in subscriptions:
+                self._unsubscribe(client, subscription)
+            if client.stream_socket is not None:
+                client.stream_socket.close()
+            logger.info(f"Client disconnected: '{client.name}'")
+
+    def _execute(self, client: _BrokerClient, calls: List[KRPC.ProcedureCall]) -> List[KRPC.ProcedureResult]:
+        # Stream procedures are handled here, runs of other calls are forwarded to the server in one request
+        handlers = {
+            "AddStream": self._add_stream,
+            "StartStream": self._start_stream,
+            "SetStreamRate": self._set_stream_rate,
+            "RemoveStream": self._remove_stream,
+            "AddEvent": self._add_event,
+            "GetClientID": lambda client, call: KRPC.ProcedureResult(value=Encoder.encode(client.identifier, _types.bytes_type)),
+            "GetClientName": lambda client, call: KRPC.ProcedureResult(value=Encoder.encode(client.name, _types.string_type)),
+        }
+        results: List[KRPC.ProcedureResult] = []
+        forward: List[KRPC.ProcedureCall] = []
+        for call in calls:
+            handler = handlers.get(call.procedure) if call.service == "KRPC" else None
+            if handler is None:
+                forward.append(call)
+                continue
+            if forward:
+                results.extend(self._call(forward))
+                forward = []
+            try:
+                results.append(handler(client, call))
+            except Exception as e:
+                results.append(KRPC.ProcedureResult(error=KRPC.Error(description=f"{type(e).__name__}: {e}")))
+        if forward:
+            results.extend(self._call(forward))
+        return results
+
+    @staticmethod
+    def _argument(call: KRPC.ProcedureCall, position: int) -> Optional[bytes]:
+        return next((argument.value for argument in call.arguments if argument.position == position), None)
+
+    def _subscription(self, call: KRPC.ProcedureCall) -> _Subscription:
+        stream_id = Decoder.decode(None, self._argument(call, 0), _types.uint64_type)
+        with self._lock:
+            subscription = self._subscriptions.get(stream_id)
+        if subscription is None:
+            raise ValueError(f"No stream with id {stream_id}")
+        return subscription
+
+    def _add_stream(self, client: _BrokerClient, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        key = self._argument(call, 0)
+        start = self._argument(call, 1)
+        start = True if start is None else Decoder.decode(None, start, _types.bool_type)
+        with self._streams_lock:
+            with self._lock:
+                subscription = self._by_key.get(key)
+            if subscription is None:
+                # Always started on the server, clients that did not start it yet just get no updates
+                result = self._krpc_call("AddStream", key, Encoder.encode(True, _types.bool_type))
+                if result.HasField("error"):
+                    return result
+                stream_id = KRPC.Stream.FromString(result.value).id
+                with self._lock:
+                    subscription = self._subscriptions.get(stream_id) or _Subscription(stream_id, key)
+                    self._subscriptions[stream_id] = subscription
+                    self._by_key[key] = subscription
+            # Subscribed before the lock is released, so the subscription cannot be removed in between
+            with self._lock:
+                subscription.clients.setdefault(client, 0.0)
+        # The new client has not asked for a rate yet, so the stream may have to run faster
+        self._update_rate(subscription)
+        if start:
+            self._start(client, subscription)
+        return KRPC.ProcedureResult(value=KRPC.Stream(id=subscription.id).SerializeToString())
+
+    def _add_event(self, client: _BrokerClient, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        # Every event gets its own stream on the server, so events are not shared
+        result = self._call([call])[0]
+        if not result.HasField("error"):
+            event = KRPC.Event.FromString(result.value)
+            subscription = _Subscription(event.stream.id, b"event %d" % event.stream.id)
+            with self._lock:
+                self._subscriptions[subscription.id] = subscription
+                self._by_key[subscription.key] = subscription
+            self._subscribe(client, subscription, False)
+        return result
+
+    def _subscribe(self, client: _BrokerClient, subscription: _Subscription, start: bool):
+        with self._lock:
+            subscription.clients.setdefault(client, 0.0)
+        self._update_rate(subscription)
+        if start:
+            self._start(client, subscription)
+
+    def _start(self, client: _BrokerClient, subscription: _Subscription):
+        with self._lock:
+            client.started.add(subscription.id)
+            latest = self._latest.get(subscription.id)
+        # The server only sends values when they change, so a client joining a running stream gets the latest one
+        if latest is not None:
+            client.send_update([KRPC.StreamResult(id=subscription.id, result=latest)])
+
+    def _start_stream(self, client: _BrokerClient, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        self._start(client, self._subscription(call))
+        return KRPC.ProcedureResult()
+
+    def _set_stream_rate(self, client: _BrokerClient, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        # A shared stream runs at the highest rate any of its clients asked for
+        subscription = self._subscription(call)
+        with self._lock:
+            subscription.clients[client] = Decoder.decode(None, self._argument(call, 1), _types.float_type)
+        self._update_rate(subscription)
+        return KRPC.ProcedureResult()
+
+    def _update_rate(self, subscription: _Subscription):
+        with self._lock:
+            rates = list(subscription.clients.values())
+            rate = 0.0 if not rates or 0.0 in rates else max(rates)
+            if rate == subscription.rate:
+                return
+            subscription.rate = rate
+        self._krpc_call(
+            "SetStreamRate", Encoder.encode(subscription.id, _types.uint64_type), Encoder.encode(rate, _types.float_type)
+        )
+
+    def _remove_stream(self, client: _BrokerClient, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        self._unsubscribe(client, self._subscription(call))
+        return KRPC.ProcedureResult()
+
+    def _unsubscribe(self, client: _BrokerClient, subscription: _Subscription):
+        with self._streams_lock:
+            with self._lock:
+                subscription.clients.pop(client, None)
+                client.started.discard(subscription.id)
+                last = not subscription.clients
+                if last:
+                    self._subscriptions.pop(subscription.id, None)
+                    self._by_key.pop(subscription.key, None)
+            if last:
+                self._krpc_call("RemoveStream", Encoder.encode(subscription.id, _types.uint64_type))
+                # Dropped once the server stopped sending updates, so a later stream with the same id starts clean
+                with self._lock:
+                    self._latest.pop(subscription.id, None)
+        if not last:
+            self._update_rate(subscription)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share one kRPC server connection between local scripts")
+    parser.add_argument("--address", default=server_address, help="Address of the kRPC server")
+    parser.add_argument("--rpc-port", type=int, default=server_rpc_port)
+    parser.add_argument("--stream-port", type=int, default=server_stream_port)
+    parser.add_argument("--listen-rpc-port", type=int, default=listen_rpc_port)
+    parser.add_argument("--listen-stream-port", type=int, default=listen_stream_port)
+    args = parser.parse_args()
+
+    Broker(
+        args.address,
+        args.rpc_port,
+        args.stream_port,
+        listen_rpc_port=args.listen_rpc_port,
+        listen_stream_port=args.listen_stream_port,
+    ).serve_forever()
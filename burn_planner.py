@@ -0,0 +1,99 @@
+import math
+from typing import List, NamedTuple, Tuple
+
+from helper import batch_get
+
+G0 = 9.80665
+
+
+class StagePerformance(NamedTuple):
+    # What one stage can do in vacuum, from the moment it is the current stage until its fuel is burnt
+    stage: int
+    start_mass: float
+    end_mass: float
+    thrust: float
+    isp: float
+
+    @property
+    def delta_v(self) -> float:
+        if self.thrust <= 0 or self.end_mass >= self.start_mass:
+            return 0.0
+        return self.isp * G0 * math.log(self.start_mass / self.end_mass)
+
+    @property
+    def flow_rate(self) -> float:
+        # kg per second at full throttle
+        return self.thrust / (self.isp * G0) if self.thrust > 0 else 0.0
+
+
+class StageBurn(NamedTuple):
+    stage: int
+    delta_v: float
+    burn_time: float
+
+
+class BurnPlan(NamedTuple):
+    delta_v: float
+    burn_time: float
+    # Start the burn this many seconds before the node, so half the delta-v is applied before it and half after
+    start_offset: float
+    stages: Tuple[StageBurn, ...]
+    # Delta-v the stages cannot deliver, 0 if there is enough fuel
+    missing_delta_v: float
+
+
+def stage_table(vessel, client) -> List[StagePerformance]:
+    # Mass, thrust and Isp of the current stage and every stage after it, read with two requests.
+    # Like stage_if_low_on_fuel, a stage burns the fuel of the parts its next decouple drops. Staging takes no time.
+    parts = vessel.parts.all
+    values = batch_get(
+        ((part, name) for part in parts for name in ("stage", "decouple_stage", "mass", "dry_mass", "engine")), client
+    )
+    rows = [values[i : i + 5] for i in range(0, len(values), 5)]
+    engines = [row[4] for row in rows if row[4] is not None]
+    engine_values = batch_get(
+        ((engine, name) for engine in engines for name in ("max_vacuum_thrust", "vacuum_specific_impulse")), client
+    )
+    performance = {id(engine): engine_values[2 * i : 2 * i + 2] for i, engine in enumerate(engines)}
+
+    current_stage = vessel.control.current_stage
+    table = []
+    for stage in range(current_stage, -1, -1):
+        # Parts still attached while this stage is the current one
+        attached = [row for row in rows if row[1] < stage]
+        start_mass = sum(row[2] for row in attached)
+        fuel = sum(row[2] - row[3] for row in attached if row[1] == stage - 1)
+        burning = [performance[id(row[4])] for row in attached if row[4] is not None and row[0] >= stage]
+        thrust = sum(t for t, _ in burning)
+        isp = thrust / sum(t / i for t, i in burning if i > 0) if thrust > 0 else 0.0
+        table.append(StagePerformance(stage, start_mass, start_mass - fuel, thrust, isp))
+    return table
+
+
+def _burn(stages: List[StagePerformance], delta_v: float) -> Tuple[List[StageBurn], float]:
+    # Burns through the stages in order, returns the burn per stage and the delta-v that is left over
+    burns = []
+    for stage in stages:
+        if delta_v <= 0:
+            break
+        if stage.delta_v <= 0:
+            continue
+        stage_delta_v = min(delta_v, stage.delta_v)
+        end_mass = stage.start_mass / math.exp(stage_delta_v / (stage.isp * G0))
+        burns.append(StageBurn(stage.stage, stage_delta_v, (stage.start_mass - end_mass) / stage.flow_rate))
+        delta_v -= stage_delta_v
+    return burns, max(0.0, delta_v)
+
+
+def plan_burn(stages: List[StagePerformance], delta_v: float) -> BurnPlan:
+    # Full throttle burn of 'delta_v' over as many stages as it takes.
+    # The vessel gets lighter during the burn, so the first half of the delta-v takes longer than the second.
+    burns, missing = _burn(stages, delta_v)
+    first_half, _ = _burn(stages, delta_v / 2)
+    return BurnPlan(
+        delta_v,
+        sum(burn.burn_time for burn in burns),
+        sum(burn.burn_time for burn in first_half),
+        tuple(burns),
+        missing,
+    )
@@ -0,0 +1,91 @@
+from typing import Dict, Optional, Tuple
+
+from helper import batch_set
+
+# Ranges the game clamps control inputs to, increments are clamped locally the same way
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "throttle": (0.0, 1.0),
+    "pitch": (-1.0, 1.0),
+    "yaw": (-1.0, 1.0),
+    "roll": (-1.0, 1.0),
+    "forward": (-1.0, 1.0),
+    "up": (-1.0, 1.0),
+    "right": (-1.0, 1.0),
+    "wheel_throttle": (-1.0, 1.0),
+    "wheel_steering": (-1.0, 1.0),
+}
+
+
+class Shadow:
+    # Local copy of the settings of a remote object (vessel.control, vessel.auto_pilot).
+    # A setting is read from the server the first time it is used, after that reads come from the copy and writes
+    # only change the copy until the buffer is flushed. Method calls (engage(), activate_next_stage(), ...) go
+    # straight to the server.
+    def __init__(self, obj, limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "_limits", limits or {})
+        object.__setattr__(self, "_values", {})
+        # Values as last read from or written to the server
+        object.__setattr__(self, "_sent", {})
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._values:
+            return self._values[name]
+        value = getattr(self._obj, name)
+        if callable(value):
+            return value
+        self._values[name] = self._sent[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        if name in self._limits:
+            low, high = self._limits[name]
+            value = min(max(value, low), high)
+        self._values[name] = value
+
+    def changes(self) -> Dict[str, object]:
+        return {name: value for name, value in self._values.items() if name not in self._sent or self._sent[name] != value}
+
+    def sent(self, values: Dict[str, object]):
+        self._sent.update(values)
+
+    def refresh(self, *names: str):
+        # Forget the local copy of 'names' (all settings if none are given), e.g. after the player or another
+        # script changed them. Unflushed writes to them are dropped.
+        for name in names or list(self._values):
+            self._values.pop(name, None)
+            self._sent.pop(name, None)
+
+
+class ControlBuffer:
+    # Collects the control and autopilot writes of one control loop tick and sends the ones that changed the value
+    # in a single request. Increments like 'throttle += 0.05' are applied to the local copy, so they cost no round
+    # trip, and are clamped to the range the game allows.
+    # Usage:
+    #   commands = ControlBuffer(conn, vessel)
+    #   for t in telemetry.frames():
+    #       commands.control.throttle += 0.05
+    #       commands.auto_pilot.target_pitch = target_pitch
+    #       commands.flush()
+    def __init__(self, conn, vessel):
+        self.conn = conn
+        self.control = Shadow(vessel.control, LIMITS)
+        self.auto_pilot = Shadow(vessel.auto_pilot)
+        # Number of values sent to the server
+        self.writes = 0
+
+    def flush(self) -> int:
+        # Sends every changed value, returns how many were sent
+        changes = {shadow: shadow.changes() for shadow in (self.control, self.auto_pilot)}
+        batch_set(
+            ((shadow._obj, name, value) for shadow, values in changes.items() for name, value in values.items()),
+            client=self.conn,
+        )
+        count = 0
+        for shadow, values in changes.items():
+            shadow.sent(values)
+            count += len(values)
+        self.writes += count
+        return count
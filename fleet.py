@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Type
+
+import krpc
+from loguru import logger
+
+from ascent import AscentParameters, ascent_control, ascent_done
+from burn_planner import plan_burn, stage_table
+from control_buffer import ControlBuffer
+from handles import handles_for
+from helper import stage_if_low_on_fuel
+from resource_monitor import ResourceMonitor
+from run_science import Science
+from streams import registry_for
+from telemetry import Telemetry
+from tick_timing import TickTimer
+
+
+class VesselController(ABC):
+    # One automated task (lift-off, science, maneuver, ...) bound to one vessel, driven by a Fleet.
+    # start() runs once, step() every 'interval' seconds until it returns True, close() once at the end, also when
+    # the controller failed or the fleet was stopped. All three run on the vessel's own worker thread, never at the
+    # same time.
+    # Controllers must not warp time or switch the active vessel, both change the game for every other vessel.
+    interval: float = 0.1
+
+    def __init__(self, conn, vessel):
+        self.conn = conn
+        self.vessel = vessel
+        self.streams = registry_for(conn)
+        # Only for logging
+        self.vessel_name: str = vessel.name
+
+    def start(self):
+        pass
+
+    @abstractmethod
+    def step(self) -> Optional[bool]:
+        pass
+
+    def close(self):
+        pass
+
+
+class LiftOff(VesselController):
+    # The gravity turn ascent of spacecraft_lift_off.py, ends once the target apoapsis is reached
+    interval = 0.05
+
+    def __init__(self, conn, vessel, ascent: AscentParameters = AscentParameters()):
+        super().__init__(conn, vessel)
+        self.ascent = ascent
+        self.telemetry: Optional[Telemetry] = None
+        self.commands: Optional[ControlBuffer] = None
+        self.monitor: Optional[ResourceMonitor] = None
+        self.apoapsis_reached_once = False
+
+    def start(self):
+        vessel = self.vessel
+        auto_pilot = vessel.auto_pilot
+        auto_pilot.target_pitch = 90
+        auto_pilot.target_heading = 90
+        auto_pilot.roll_threshold = 5
+        auto_pilot.target_roll = 0
+        auto_pilot.engage()
+
+        handles = handles_for(self.conn)
+        flight = handles.flight(vessel)
+        self.telemetry = Telemetry(
+            self.conn,
+            {
+                "surface_altitude": (flight, "surface_altitude"),
+                "apoapsis_altitude": (handles.orbit(vessel), "apoapsis_altitude"),
+                "pitch": (flight, "pitch"),
+                "heading": (flight, "heading"),
+            },
+            rate=2 / self.interval,
+        )
+        self.commands = ControlBuffer(self.conn, vessel)
+        self.monitor = ResourceMonitor(self.streams, vessel)
+        if self.telemetry.snapshot().surface_altitude < 1_000:
+            self.commands.control.throttle = 1
+            self.commands.flush()
+
+    def step(self) -> Optional[bool]:
+        p = self.ascent
+        t = self.telemetry.snapshot()
+        if t.apoapsis_altitude < p.target_apoapsis_altitude:
+            stage_if_low_on_fuel(monitor=self.monitor)
+
+        commands = self.commands
+        target_pitch, throttle, self.apoapsis_reached_once = ascent_control(
+            p,
+            t.surface_altitude,
+            t.apoapsis_altitude,
+            t.pitch,
+            t.heading,
+            commands.auto_pilot.target_pitch,
+            commands.auto_pilot.target_heading,
+            commands.control.throttle,
+            self.apoapsis_reached_once,
+        )
+        commands.control.throttle = float(throttle)
+        commands.auto_pilot.target_pitch = float(target_pitch)
+        commands.flush()
+
+        if ascent_done(p, t.surface_altitude, t.apoapsis_altitude, stage_if_low_on_fuel(False, monitor=self.monitor)):
+            logger.info(
+                f"{self.vessel_name}: apoapsis of {t.apoapsis_altitude:.01f} and min altitude of {t.surface_altitude:.01f} reached"
+            )
+            return True
+
+    def close(self):
+        for resource in (self.telemetry, self.monitor):
+            if resource is not None:
+                resource.close()
+        if self.commands is not None:
+            self.vessel.control.throttle = 0
+            self.vessel.auto_pilot.disengage()
+            self.vessel.control.sas = True
+
+
+class RunScience(VesselController):
+    # Science of run_science.py, never ends on its own
+    interval = 1
+
+    def __init__(self, conn, vessel):
+        super().__init__(conn, vessel)
+        self.science: Optional[Science] = None
+
+    def start(self):
+        self.science = Science(self.conn, self.vessel)
+
+    def step(self) -> Optional[bool]:
+        self.science.run()
+
+    def close(self):
+        if self.science is not None:
+            self.science.close()
+
+
+class ExecuteManeuver(VesselController):
+    # Burn of the vessel's next maneuver node like spacecraft_execute_maneuver.py, but without warping to it.
+    # Ends when the node is done, or right away if there is none or the vessel is not facing the node at burn start.
+    interval = 0.05
+
+    def __init__(
+        self,
+        conn,
+        vessel,
+        burn_till_remaining_delta_v: float = 20,
+        tolerance: Tuple[float, float, float] = (0.05, 0.05, 0.05),
+    ):
+        super().__init__(conn, vessel)
+        self.burn_till_remaining_delta_v = burn_till_remaining_delta_v
+        self.tolerance = tolerance
+        self.node = None
+        self.plan = None
+        self._streams = []
+        self.commands: Optional[ControlBuffer] = None
+        self.monitor: Optional[ResourceMonitor] = None
+        self.burn_start: Optional[float] = None
+        self.last_remaining_delta_v = float("inf")
+        self.fine_tuning = False
+        # Seconds after the burn start during which remaining delta v may still go up
+        self.tolerance_time = 1
+
+    def start(self):
+        vessel = self.vessel
+        nodes = vessel.control.nodes
+        if not nodes:
+            logger.info(f"{self.vessel_name}: no maneuver node found")
+            return
+        n = self.node = nodes[0]
+        handles = handles_for(self.conn)
+        node_frame = handles.reference_frame(n)
+        vessel.auto_pilot.reference_frame = node_frame
+        vessel.auto_pilot.target_direction = (0, 1, 0)
+        vessel.auto_pilot.engage()
+
+        self.plan = plan_burn(stage_table(vessel, self.conn), n.delta_v)
+        logger.info(
+            f"{self.vessel_name}: burning {self.plan.delta_v:.1f} m/s for {self.plan.burn_time:.1f} s, starting {self.plan.start_offset:.1f} s before the node"
+        )
+        if self.plan.missing_delta_v > 0:
+            logger.warning(f"{self.vessel_name}: {self.plan.missing_delta_v:.1f} m/s of delta v will be missing")
+
+        rate = 2 / self.interval
+        self.time_to = self.streams.acquire(getattr, n, "time_to", rate=rate)
+        self.direction = self.streams.acquire(getattr, handles.flight(vessel, node_frame), "direction", rate=rate)
+        self.remaining_delta_v = self.streams.acquire(getattr, n, "remaining_delta_v", rate=rate)
+        self._streams = [self.time_to, self.direction, self.remaining_delta_v]
+        self.commands = ControlBuffer(self.conn, vessel)
+        self.monitor = ResourceMonitor(self.streams, vessel)
+
+    def step(self) -> Optional[bool]:
+        if self.node is None:
+            return True
+
+        if self.burn_start is None:
+            if self.time_to() - self.plan.start_offset > 0:
+                return
+            d = self.direction()
+            if not all(abs(d[i] - a) < self.tolerance[i] for i, a in enumerate((0, 1, 0))):
+                logger.info(f"{self.vessel_name}: not facing the node at burn start. Direction: {d}")
+                return True
+            logger.info(f"{self.vessel_name}: starting maneuver burn")
+            self.burn_start = time.perf_counter()
+
+        remaining_delta_v = self.remaining_delta_v()
+        control = self.commands.control
+        if (
+            remaining_delta_v > self.last_remaining_delta_v
+            and time.perf_counter() - self.burn_start > self.tolerance_time
+        ):
+            logger.warning(f"{self.vessel_name}: remaining burn delta v went up to {remaining_delta_v}, ending burn")
+            self.node.remove()
+            return True
+        elif remaining_delta_v > self.burn_till_remaining_delta_v:
+            control.throttle = 1
+        elif remaining_delta_v > 0.0001:
+            control.throttle = remaining_delta_v / self.burn_till_remaining_delta_v
+            if not self.fine_tuning:
+                logger.info(f"{self.vessel_name}: maneuver almost done, fine tuning")
+                self.fine_tuning = True
+        else:
+            logger.info(f"{self.vessel_name}: maneuver completed, remaining delta v: {remaining_delta_v}")
+            self.node.remove()
+            return True
+        self.commands.flush()
+        stage_if_low_on_fuel(monitor=self.monitor)
+        self.last_remaining_delta_v = remaining_delta_v
+
+    def close(self):
+        for stream in self._streams:
+            stream.release()
+        if self.monitor is not None:
+            self.monitor.close()
+        if self.commands is not None:
+            self.vessel.control.throttle = 0
+            self.vessel.auto_pilot.disengage()
+
+
+class _Lane:
+    # A controller and the thread it runs on, so a slow step only ever delays its own vessel
+    def __init__(self, name: str, controller: VesselController):
+        self.name = name
+        self.controller = controller
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        # Overruns of the interval and the rate each controller keeps, summarized once a minute
+        self.timer = TickTimer(name, controller.interval, controller.conn, report_interval=60)
+
+    def step(self) -> Optional[bool]:
+        with self.timer.tick():
+            return self.controller.step()
+
+
+class Fleet:
+    # Runs controllers for any number of vessels concurrently over one connection.
+    # Like Mission, the schedule lives on one asyncio event loop and the blocking kRPC work runs on threads, but every
+    # bound controller gets a thread of its own: a vessel whose step is slow (an experiment scan, a burn plan) misses
+    # its own deadlines, never another vessel's. Each controller keeps its own interval and skips the ticks it missed
+    # instead of running them back to back, and a controller that raises is closed and logged while the rest fly on.
+    # kRPC answers the calls of one connection one at a time, so the controllers read through streams and write once
+    # per tick through a ControlBuffer, which keeps every tick to at most a request or two.
+    # Usage:
+    #   fleet = Fleet(conn)
+    #   fleet.bind(relay_1, LiftOff)
+    #   fleet.bind(relay_1, RunScience)
+    #   fleet.bind(relay_2, ExecuteManeuver, burn_till_remaining_delta_v=10)
+    #   fleet.run()
+    # run() returns once every controller has ended, or after stop().
+    def __init__(self, conn):
+        self.conn = conn
+        self.lanes: List[_Lane] = []
+        self._stopped = threading.Event()
+
+    def bind(self, vessel, controller_class: Type[VesselController], name: Optional[str] = None, **options):
+        # Creates the controller for 'vessel', 'options' are passed on to it. Returns the controller.
+        controller = controller_class(self.conn, vessel, **options)
+        self.lanes.append(_Lane(name or f"{controller_class.__name__}({controller.vessel_name})", controller))
+        return controller
+
+    def stop(self):
+        # Safe to call from any thread, controllers end after their current step
+        self._stopped.set()
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            for lane in self.lanes:
+                # Waits for close() of every controller
+                lane.executor.shutdown(wait=True)
+            for lane in self.lanes:
+                logger.info(f"Tick timing:\n{lane.timer.report()}")
+
+    async def _main(self):
+        await asyncio.gather(*(self._drive(lane) for lane in self.lanes))
+
+    async def _drive(self, lane: _Lane):
+        loop = asyncio.get_running_loop()
+        controller = lane.controller
+        interval = controller.interval
+        try:
+            await loop.run_in_executor(lane.executor, controller.start)
+            next_run = loop.time()
+            while not self._stopped.is_set():
+                if await loop.run_in_executor(lane.executor, lane.step):
+                    break
+                next_run = max(next_run + interval, loop.time())
+                await asyncio.sleep(next_run - loop.time())
+        except Exception:
+            logger.exception(f"{lane.name} failed, the other controllers keep running")
+        finally:
+            # Queued behind a step that may still be running after a cancel
+            lane.executor.submit(controller.close)
+
+
+CONTROLLERS: Dict[str, Type[VesselController]] = {
+    "lift_off": LiftOff,
+    "science": RunScience,
+    "maneuver": ExecuteManeuver,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run controllers for several vessels over one connection")
+    parser.add_argument(
+        "bindings",
+        nargs="+",
+        metavar="VESSEL=CONTROLLER",
+        help=f"Vessel name, or 'active' for the active vessel, and one of: {', '.join(CONTROLLERS)}",
+    )
+    args = parser.parse_args()
+
+    conn = krpc.connect(name="Fleet")
+    vessels = {vessel.name: vessel for vessel in conn.space_center.vessels}
+    fleet = Fleet(conn)
+    for binding in args.bindings:
+        vessel_name, _, controller_name = binding.rpartition("=")
+        if controller_name not in CONTROLLERS:
+            parser.error(f"Unknown controller '{controller_name}', choose from: {', '.join(CONTROLLERS)}")
+        if vessel_name == "active":
+            vessel = conn.space_center.active_vessel
+        elif vessel_name in vessels:
+            vessel = vessels[vessel_name]
+        else:
+            parser.error(f"No vessel named '{vessel_name}', vessels are: {', '.join(vessels)}")
+        fleet.bind(vessel, CONTROLLERS[controller_name])
+
+    logger.info(f"Running {len(fleet.lanes)} controller(s)...")
+    try:
+        fleet.run()
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    logger.info("END OF PROGRAM")
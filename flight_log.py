@@ -0,0 +1,205 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from functools import partialmethod
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from recorder import RingBuffer, write_json
+
+# Arguments of a message kept in the binary log, further ones are only in the text log
+MAX_VALUES = 6
+# Distinct string arguments kept in the binary log, once there are this many new ones are stored as NaN
+MAX_STRINGS = 1_024
+
+LOG_DTYPE = np.dtype(
+    [
+        ("time", "f8"),
+        ("message", "i4"),
+        ("level", "i1"),
+        # Whether the call went to the text log or was held back
+        ("emitted", "?"),
+        # Bit i set: values[i] is an index into the strings of the meta file
+        ("strings", "u1"),
+        ("values", "f8", (MAX_VALUES,)),
+    ]
+)
+
+
+class _Limit:
+    # Rate limiting state of one key
+    __slots__ = ("last_emit", "message", "args", "held", "latest")
+
+    def __init__(self):
+        self.last_emit = -math.inf
+        # Message and arguments of the last emitted call
+        self.message: Optional[str] = None
+        self.args: tuple = ()
+        # Calls held back since then, and the (level, message, arguments) of the latest one
+        self.held = 0
+        self.latest: Optional[Tuple[str, str, tuple]] = None
+
+
+class FlightLog:
+    # Logging for control loops. A message is a format string and its arguments, it is only formatted when it is
+    # emitted, so a call that is held back costs a dictionary lookup and a clock read. Calls are held back when:
+    # - 'every': the message was emitted less than this many seconds ago
+    # - 'repeat': it has the same arguments as the last emitted one, which was less than this many seconds ago
+    # The next emitted call says how many were held back. Messages passed the same 'key' share their limits, e.g.
+    # "Increasing throttle" and "Lowering throttle" so only a change between the two is logged.
+    # With 'path', every call, held back or not, is also written to a binary ring buffer in that directory, so high
+    # rate diagnostics can stay on without filling the text log. Read it with: python flight_log.py <path>
+    # Usage:
+    #   log = FlightLog("recordings/lift_off")
+    #   for t in telemetry.frames(max_rate=100):
+    #       log.info("Target pitch {:.1f} at altitude {:.0f}", target_pitch, t.surface_altitude, every=1)
+    #   log.close()
+    def __init__(self, path: Optional[str] = None, every: float = 0.0, repeat: float = 10.0, capacity: int = 2 ** 16):
+        self.every = every
+        self.repeat = repeat
+        self._lock = threading.Lock()
+        self._limits: Dict[str, _Limit] = {}
+        self._buffer: Optional[RingBuffer] = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._buffer = RingBuffer(os.path.join(path, "log.bin"), LOG_DTYPE, capacity)
+            self._meta_path = os.path.join(path, "log.json")
+            self._meta = {"messages": [], "levels": [], "strings": []}
+            self._ids: Dict[str, Dict[str, int]] = {name: {} for name in self._meta}
+            write_json(self._meta_path, self._meta)
+
+    def log(
+        self,
+        level: str,
+        message: str,
+        *args,
+        key: Optional[str] = None,
+        every: Optional[float] = None,
+        repeat: Optional[float] = None,
+    ):
+        now = time.perf_counter()
+        with self._lock:
+            limit = self._limits.get(key or message)
+            if limit is None:
+                limit = self._limits[key or message] = _Limit()
+            since = now - limit.last_emit
+            emit = since >= (self.every if every is None else every) and (
+                message != limit.message or args != limit.args or since >= (self.repeat if repeat is None else repeat)
+            )
+            if self._buffer is not None:
+                self._write(level, message, args, emit)
+            if not emit:
+                limit.held += 1
+                limit.latest = (level, message, args)
+                return
+            held, limit.held = limit.held, 0
+            limit.last_emit, limit.message, limit.args = now, message, args
+        self._emit(level, message, args, held)
+
+    debug = partialmethod(log, "DEBUG")
+    info = partialmethod(log, "INFO")
+    warning = partialmethod(log, "WARNING")
+
+    @staticmethod
+    def _emit(level: str, message: str, args: tuple, held: int):
+        text = message.format(*args) if args else message
+        if held:
+            text += f" ({held} held back before)"
+        # Attribute the line to the caller of log() or close()
+        logger.opt(depth=2).log(level, text)
+
+    def _id(self, table: str, value: str) -> Optional[int]:
+        # Index of 'value' in a table of the meta file, adding it if needed. Called with the lock held.
+        ids = self._ids[table]
+        index = ids.get(value)
+        if index is None and (table != "strings" or len(ids) < MAX_STRINGS):
+            index = ids[value] = len(ids)
+            self._meta[table].append(value)
+            write_json(self._meta_path, self._meta)
+        return index
+
+    def _write(self, level: str, message: str, args: tuple, emitted: bool):
+        values = [math.nan] * MAX_VALUES
+        strings = 0
+        for i, value in enumerate(args[:MAX_VALUES]):
+            if isinstance(value, str):
+                index = self._id("strings", value)
+                if index is not None:
+                    values[i] = index
+                    strings |= 1 << i
+            elif isinstance(value, (int, float, np.number)):
+                values[i] = value
+        self._buffer.append(
+            (time.time(), self._id("messages", message), self._id("levels", level), emitted, strings, values)
+        )
+
+    def close(self):
+        # Emit the latest call of every key that has calls held back, so the text log ends with the latest values
+        with self._lock:
+            for limit in self._limits.values():
+                if limit.held:
+                    level, message, args = limit.latest
+                    self._emit(level, message, args, limit.held - 1)
+                    limit.held = 0
+        if self._buffer is not None:
+            self._buffer.flush()
+
+
+class LogRecord(NamedTuple):
+    time: float
+    level: str
+    emitted: bool
+    text: str
+
+
+class FlightLogReader:
+    # Reads the binary log of a FlightLog, also while it is being written
+    # Usage:
+    #   for record in FlightLogReader("recordings/lift_off").records(last=100):
+    #       print(record.text)
+    def __init__(self, path: str):
+        self.path = path
+        self.buffer = RingBuffer(os.path.join(path, "log.bin"), LOG_DTYPE, readonly=True)
+
+    def records(self, last: Optional[int] = None) -> Iterator[LogRecord]:
+        # The calls still in the ring buffer, oldest first. The meta file is read after the rows so it has every
+        # message and string the rows refer to.
+        rows = self.buffer.read(last)
+        with open(os.path.join(self.path, "log.json")) as f:
+            meta = json.load(f)
+        for row in rows:
+            args = []
+            for i, value in enumerate(row["values"]):
+                if row["strings"] & (1 << i):
+                    args.append(meta["strings"][int(value)])
+                elif math.isnan(value):
+                    args.append(None)
+                else:
+                    # Integers were stored as floats, give them back as ints so formats like {:d} still work
+                    args.append(int(value) if value.is_integer() else float(value))
+            message = meta["messages"][row["message"]]
+            try:
+                text = message.format(*args)
+            except (ValueError, TypeError, IndexError):
+                text = f"{message} {args}"
+            yield LogRecord(float(row["time"]), meta["levels"][row["level"]], bool(row["emitted"]), text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the binary log written by a FlightLog")
+    parser.add_argument("path", help="Directory the FlightLog was given")
+    parser.add_argument("--last", type=int, default=None, help="Only the last N calls")
+    parser.add_argument("--emitted", action="store_true", help="Only the calls that also went to the text log")
+    args = parser.parse_args()
+
+    for record in FlightLogReader(args.path).records(args.last):
+        if args.emitted and not record.emitted:
+            continue
+        stamp = time.strftime("%H:%M:%S", time.localtime(record.time)) + f".{int(record.time % 1 * 1000):03d}"
+        marker = " " if record.emitted else "."
+        print(f"{stamp} {marker} {record.level:<8} {record.text}")
@@ -0,0 +1,175 @@
+import threading
+import weakref
+from typing import Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from streams import StreamHandle, object_key, registry_for
+
+
+class BodyConstants(NamedTuple):
+    name: str
+    # in m
+    equatorial_radius: float
+    # in m^3/s^2
+    gravitational_parameter: float
+    # in m/s^2
+    surface_gravity: float
+    # in m/s at the equator
+    rotational_speed: float
+    # in m
+    sphere_of_influence: float
+    has_atmosphere: bool
+    # in m
+    atmosphere_depth: float
+
+
+class HandleCache:
+    # Remote objects and values that do not change, so scripts and helpers stop paying a round trip each time they
+    # ask for them: every vessel.flight(frame) call returns a new proxy of the same server object, and a body's
+    # radius never changes. Entries are kept per owning object:
+    # - of a vessel: its flight objects by reference frame, its orbit, its body and its reference frames. The body
+    #   is dropped when the vessel leaves the sphere of influence, which a stream of the orbit's body reports.
+    #   invalidate(vessel) drops them all, active_vessel() does so for the previous vessel on a vessel switch.
+    # - of anything else, e.g. a body or a maneuver node: its reference frames, they never change
+    # - of a body: its BodyConstants, read once
+    # Usage:
+    #   handles = handles_for(conn)
+    #   flight = handles.flight(vessel, handles.reference_frame(handles.body(vessel)))
+    #   radius = handles.constants(handles.body(vessel)).equatorial_radius
+    def __init__(self, conn):
+        self.conn = conn
+        self.streams = registry_for(conn)
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Dict[Hashable, object]] = {}
+        self._constants: Dict[Hashable, BodyConstants] = {}
+        # Stream of each vessel's body and its callback, to tell when the vessel leaves the sphere of influence
+        self._bodies: Dict[Hashable, Tuple[StreamHandle, Callable]] = {}
+        self._active: Optional[StreamHandle] = None
+        self._active_key: Optional[Hashable] = None
+
+    def _get(self, owner, key: Hashable, read):
+        # The cached entry 'key' of 'owner', read() outside the lock if there is none
+        owner_key = object_key(owner)
+        with self._lock:
+            entries = self._entries.get(owner_key)
+            if entries is not None and key in entries:
+                return entries[key]
+        value = read()
+        with self._lock:
+            self._entries.setdefault(owner_key, {})[key] = value
+        return value
+
+    def flight(self, vessel, reference_frame=None):
+        # vessel.flight(reference_frame)
+        key = ("flight", None if reference_frame is None else object_key(reference_frame))
+        return self._get(vessel, key, lambda: vessel.flight(reference_frame))
+
+    def orbit(self, vessel):
+        return self._get(vessel, "orbit", lambda: vessel.orbit)
+
+    def body(self, vessel):
+        # The body whose sphere of influence the vessel is in
+        return self._get(vessel, "body", lambda: self._watch_body(vessel))
+
+    def reference_frame(self, obj, name: str = "reference_frame"):
+        # A reference frame of a vessel, body, node, ..., e.g. reference_frame(body, "non_rotating_reference_frame")
+        return self._get(obj, name, lambda: getattr(obj, name))
+
+    def constants(self, body) -> BodyConstants:
+        key = object_key(body)
+        with self._lock:
+            constants = self._constants.get(key)
+        if constants is None:
+            constants = BodyConstants(*(getattr(body, name) for name in BodyConstants._fields))
+            with self._lock:
+                self._constants[key] = constants
+        return constants
+
+    def _watch_body(self, vessel):
+        vessel_key = object_key(vessel)
+        with self._lock:
+            watch = self._bodies.get(vessel_key)
+        if watch is None:
+            stream = self.streams.acquire(getattr, self.orbit(vessel), "body", rate=1)
+            callback = lambda body: self._on_body(vessel_key, body)
+            stream.stream.add_callback(callback)
+            with self._lock:
+                watch = self._bodies.setdefault(vessel_key, (stream, callback))
+            if watch[0] is not stream:
+                self._unwatch((stream, callback))
+        return watch[0]()
+
+    def _on_body(self, vessel_key: Hashable, body):
+        # Called from the stream thread
+        with self._lock:
+            entries = self._entries.get(vessel_key)
+            if entries is not None and "body" in entries and object_key(entries["body"]) != object_key(body):
+                del entries["body"]
+                logger.info("A vessel left the sphere of influence of its body, its body is read again")
+
+    def active_vessel(self):
+        # The active vessel, from a stream. When it changes, the entries of the previous one are dropped.
+        with self._lock:
+            active = self._active
+        if active is None:
+            # Acquired without the lock, adding a stream waits for the stream thread, which calls _on_body
+            stream = self.streams.acquire(getattr, self.conn.space_center, "active_vessel", rate=1)
+            with self._lock:
+                if self._active is None:
+                    self._active = stream
+                active = self._active
+            if active is not stream:
+                stream.release()
+        # Read and compared under the lock, so threads see the vessels in the order the stream had them
+        with self._lock:
+            vessel = active()
+            key = object_key(vessel)
+            previous, self._active_key = self._active_key, key
+        # Only the thread that saw the switch drops the entries
+        if previous is not None and previous != key:
+            self._invalidate(previous)
+        return vessel
+
+    def invalidate(self, vessel=None):
+        # Drop the entries of 'vessel', or of every object. Body constants stay, they never change.
+        if vessel is not None:
+            self._invalidate(object_key(vessel))
+            return
+        with self._lock:
+            keys = list(self._entries) + list(self._bodies)
+        for key in keys:
+            self._invalidate(key)
+
+    def _invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            watch = self._bodies.pop(key, None)
+        if watch is not None:
+            self._unwatch(watch)
+
+    @staticmethod
+    def _unwatch(watch: Tuple[StreamHandle, Callable]):
+        stream, callback = watch
+        stream.stream.remove_callback(callback)
+        stream.release()
+
+    def close(self):
+        self.invalidate()
+        with self._lock:
+            active, self._active = self._active, None
+        if active is not None:
+            active.release()
+
+
+_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def handles_for(conn) -> HandleCache:
+    # The handle cache of a connection, shared by everything using it
+    with _caches_lock:
+        cache = _caches.get(conn)
+        if cache is None:
+            cache = _caches[conn] = HandleCache(conn)
+        return cache
@@ -1,37 +1,125 @@
 import time
 import math
+import threading
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
 import krpc
+import krpc.schema.KRPC_pb2 as KRPC
+import numpy as np
+from krpc.decoder import Decoder
+from krpc.encoder import Encoder
 from loguru import logger
 
-conn = krpc.connect(name="Helper")
+from handles import BodyConstants, HandleCache, handles_for
+from resource_monitor import ResourceMonitor
+from streams import LazyStream, StreamRegistry, object_key, registry_for
+from tick_timing import instrument
+
+_connect_lock = threading.Lock()
+_conn = None
+_vessel = None
+_streams: Optional[StreamRegistry] = None
+_switch_lock = threading.Lock()
+
+
+def connection():
+    # The helper's connection, opened on first use so importing helper costs nothing
+    global _conn, _vessel, _streams
+    with _connect_lock:
+        if _conn is None:
+            # Instrumented so loops timed with a TickTimer count the helper's RPCs as RPC time, not compute
+            _conn = instrument(krpc.connect(name="Helper"))
+            _vessel = _conn.space_center.active_vessel
+            _streams = registry_for(_conn)
+    return _conn
+
+
+def active_vessel():
+    # The game's active vessel. After a vessel switch the helper's streams and resource monitor follow the new one.
+    global _vessel, _monitor
+    vessel = handles().active_vessel()
+    with _switch_lock:
+        if object_key(vessel) == object_key(_vessel):
+            return _vessel
+        _vessel = vessel
+        for stream in _vessel_streams:
+            stream.release()
+        with _monitor_lock:
+            monitor, _monitor = _monitor, None
+    if monitor is not None:
+        monitor.close()
+    logger.info(f"The active vessel changed to {vessel.name}")
+    return vessel
+
+
+def _current_vessel():
+    # The vessel the helper's streams are acquired with. Not active_vessel(), a vessel switch found there releases
+    # those streams, including the one being acquired.
+    connection()
+    return _vessel
+
+
+def stream_registry() -> StreamRegistry:
+    connection()
+    return _streams
+
+
+def handles() -> HandleCache:
+    return handles_for(connection())
+
 
-vessel = conn.space_center.active_vessel
+def body_constants() -> BodyConstants:
+    # Constants of the body the active vessel is at, read once per body
+    cache = handles()
+    return cache.constants(cache.body(active_vessel()))
 
-vessel_current_stage = conn.add_stream(getattr, vessel.control, "current_stage")
 
+def _stream(target: Callable[[], object], attribute: str) -> LazyStream:
+    # Stream of an attribute of the object 'target' returns, created when it is first read
+    return LazyStream(lambda: stream_registry().acquire(getattr, target(), attribute))
 
-def stage_if_low_on_fuel(do_stage=True) -> float:
-    stage = vessel_current_stage()
-    resources = vessel.resources_in_decouple_stage(stage - 1)
-    solid_fuel_amount: float = resources.amount("SolidFuel")
-    liquid_fuel_amount: float = resources.amount("LiquidFuel")
 
-    # logger.info(f"Current stage vs next sage: Solid fuel {solid_fuel_amount:.01f} / {next_stage_solid_fuel_amount:.01f}, liquid fuel {liquid_fuel_amount:.01f} / {next_stage_liquid_fuel_amount:.01f}")
+vessel_current_stage = _stream(lambda: _current_vessel().control, "current_stage")
 
-    if solid_fuel_amount < 0.1 and liquid_fuel_amount < 0.1:
-        if do_stage:
+_monitor_lock = threading.Lock()
+_monitor: Optional[ResourceMonitor] = None
+
+
+def resource_monitor() -> ResourceMonitor:
+    global _monitor
+    vessel = active_vessel()
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = ResourceMonitor(stream_registry(), vessel)
+    return _monitor
+
+
+def stage_if_low_on_fuel(do_stage=True, lead_time: float = 0.0, monitor: Optional[ResourceMonitor] = None) -> float:
+    # Stages once the current stage is out of fuel, or 'lead_time' seconds of game time before it will be.
+    # Returns the fuel left in the stage, 0 if it is (about to be) empty.
+    # Watches the active vessel unless the 'monitor' of another vessel is given.
+    if monitor is None:
+        monitor = resource_monitor()
+    status = monitor.status()
+    solid_fuel_amount = status.amounts["SolidFuel"]
+    liquid_fuel_amount = status.amounts["LiquidFuel"]
+
+    if status.fuel < 0.1 or status.time_to_empty <= lead_time:
+        if do_stage and monitor.should_stage(status, lead_time):
             logger.info(
-                f"Staging because solid fuel is at {solid_fuel_amount} and liquid fuel at {liquid_fuel_amount}! Current stage is {stage}"
+                f"Staging because solid fuel is at {solid_fuel_amount} and liquid fuel at {liquid_fuel_amount}! Current stage is {status.stage}"
             )
-            vessel.control.activate_next_stage()
+            monitor.vessel.control.activate_next_stage()
+            monitor.staged()
         return 0
-    return max(solid_fuel_amount, liquid_fuel_amount)
+    return status.fuel
 
 
-vessel_thrust = conn.add_stream(getattr, vessel, "thrust")
+vessel_thrust = _stream(_current_vessel, "thrust")
 
 
 def airplane_stage():
+    vessel = active_vessel()
     thrust = vessel_thrust()
     if thrust < 0.1:
         logger.info(f"Staging airplane!")
@@ -40,7 +128,7 @@ def airplane_stage():
 
 def calcDistance(lat1, lon1, lat2, lon2, bodyRadius=1):
     if bodyRadius == 1:
-        bodyRadius = vessel.orbit.body.equatorial_radius
+        bodyRadius = body_constants().equatorial_radius
     # convert input degrees to radians
     lat1 = math.radians(lat1)
     lon1 = math.radians(lon1)
@@ -74,11 +162,15 @@ def calcBearing(lat1, lon1, lat2, lon2, d=-1):
     return brng
 
 
-vessel_latitude = conn.add_stream(getattr, vessel.flight(), "latitude")
-vessel_longitude = conn.add_stream(getattr, vessel.flight(), "longitude")
+vessel_latitude = _stream(lambda: handles().flight(_current_vessel()), "latitude")
+vessel_longitude = _stream(lambda: handles().flight(_current_vessel()), "longitude")
+
+# Streams of the active vessel, acquired again after a vessel switch
+_vessel_streams = (vessel_current_stage, vessel_thrust, vessel_latitude, vessel_longitude)
 
 
 def calc_bearing(latitude: float, longitude: float):
+    active_vessel()
     f_longitude = vessel_longitude()
     f_latitude = vessel_latitude()
     lat1 = math.radians(f_latitude)
@@ -92,15 +184,16 @@ def calc_bearing(latitude: float, longitude: float):
 
 
 def surface_distance_to_vessel(latitude: float, longitude: float) -> float:
-    # Kerbin radius in meters
-    R = 600_000
-    flight = vessel.flight()
-    f_longitude = vessel_longitude()
-    f_latitude = vessel_latitude()
-    lon1 = math.radians(f_longitude)
-    lat1 = math.radians(f_latitude)
-    lon2 = math.radians(longitude)
-    lat2 = math.radians(latitude)
+    R = body_constants().equatorial_radius
+    return surface_distance(vessel_latitude(), vessel_longitude(), latitude, longitude, R)
+
+
+def surface_distance(latitude1: float, longitude1: float, latitude2: float, longitude2: float, R: float) -> float:
+    # Haversine distance in meters between two positions on a body of radius R
+    lon1 = math.radians(longitude1)
+    lat1 = math.radians(latitude1)
+    lon2 = math.radians(longitude2)
+    lat2 = math.radians(latitude2)
     dlon = lon2 - lon1
     dlat = lat2 - lat1
     a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
@@ -109,6 +202,167 @@ def surface_distance_to_vessel(latitude: float, longitude: float) -> float:
     return distance
 
 
+def batch_get(properties: Iterable[Tuple[object, str]], client=None) -> list:
+    # Read many remote properties with a single request instead of one round trip each, e.g.
+    #   batch_get([(w, "latitude") for w in waypoints])
+    # The objects must belong to 'client', by default the helper's connection.
+    client = client or connection()
+    properties = list(properties)
+    if not properties:
+        return []
+    results = _send_batch(client, [client.get_call(getattr, obj, name) for obj, name in properties])
+    return [
+        Decoder.decode(client, result.value, client._get_return_type(getattr, obj, name))
+        for (obj, name), result in zip(properties, results)
+    ]
+
+
+def batch_set(assignments: Iterable[Tuple[object, str, object]], client=None):
+    # Write many remote properties with a single request, e.g.
+    #   batch_set([(control, "throttle", 1.0), (auto_pilot, "target_pitch", 45.0)])
+    # The objects must belong to 'client', by default the helper's connection.
+    client = client or connection()
+    calls = []
+    for obj, name, value in assignments:
+        # The setter takes the same arguments as the getter plus the new value
+        call = client.get_call(getattr, obj, name)
+        call.procedure = call.procedure.replace("_get_", "_set_", 1)
+        argument = call.arguments.add()
+        argument.position = len(call.arguments) - 1
+        argument.value = Encoder.encode(value, client._get_return_type(getattr, obj, name))
+        calls.append(call)
+    if calls:
+        _send_batch(client, calls)
+
+
+def batch_call(methods: Iterable[Callable], client=None):
+    # Call many remote methods without arguments with a single request, e.g.
+    #   batch_call([experiment.transmit for experiment in experiments])
+    # The server makes every call, the error of the first one that failed is raised afterwards.
+    # The methods must belong to 'client', by default the helper's connection.
+    client = client or connection()
+    calls = [client.get_call(method) for method in methods]
+    if calls:
+        _send_batch(client, calls)
+
+
+def _send_batch(client, calls: List[KRPC.ProcedureCall]) -> list:
+    request = KRPC.Request()
+    request.calls.extend(calls)
+    with client._rpc_connection_lock:
+        client._rpc_connection.send_message(request)
+        response = client._rpc_connection.receive_message(KRPC.Response)
+    if response.HasField("error"):
+        raise client._build_error(response.error)
+    for result in response.results:
+        if result.HasField("error"):
+            raise client._build_error(result.error)
+    return list(response.results)
+
+
+def surface_distances(latitude: float, longitude: float, latitudes, longitudes, radius: float) -> np.ndarray:
+    # Haversine distance in meters from one position to many on a body of 'radius', same formula as surface_distance
+    lat1 = np.radians(latitude)
+    lon1 = np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    lon2 = np.radians(np.asarray(longitudes, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return radius * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def bearings(latitude: float, longitude: float, latitudes, longitudes) -> np.ndarray:
+    # Initial bearing in degrees (0 north, 90 east) from one position to many, same formula as calc_bearing
+    lat1 = np.radians(latitude)
+    lon1 = np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    lon2 = np.radians(np.asarray(longitudes, dtype=float))
+    y = np.sin(lon2 - lon1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+class RankedWaypoint(NamedTuple):
+    waypoint: object
+    latitude: float
+    longitude: float
+    surface_altitude: float
+    distance: float
+    bearing: float
+
+
+WAYPOINT_FIELDS = ("body", "latitude", "longitude", "surface_altitude", "has_contract", "near_surface")
+
+
+def read_waypoints(waypoints: list, client=None) -> List[tuple]:
+    # The WAYPOINT_FIELDS of each waypoint, read with a single request
+    values = batch_get(((w, name) for w in waypoints for name in WAYPOINT_FIELDS), client=client)
+    n = len(WAYPOINT_FIELDS)
+    return [tuple(values[i * n : (i + 1) * n]) for i in range(len(waypoints))]
+
+
+def waypoint_mask(
+    surface_altitudes,
+    has_contracts,
+    near_surfaces,
+    max_surface_altitude: float = math.inf,
+    has_contract: bool = True,
+    near_surface: bool = True,
+) -> np.ndarray:
+    # Which waypoints match the filters, from arrays of their values or the values of a single waypoint
+    mask = np.asarray(surface_altitudes, dtype=float) < max_surface_altitude
+    if has_contract:
+        mask &= np.asarray(has_contracts, dtype=bool)
+    if near_surface:
+        mask &= np.asarray(near_surfaces, dtype=bool)
+    return mask
+
+
+def rank_by_distance(
+    waypoints: list, latitude: float, longitude: float, latitudes, longitudes, surface_altitudes, radius: float
+) -> List[RankedWaypoint]:
+    # The waypoints with their distance and bearing from the position, nearest first, in one vectorized pass
+    distances = surface_distances(latitude, longitude, latitudes, longitudes, radius)
+    headings = bearings(latitude, longitude, latitudes, longitudes)
+    order = np.argsort(distances, kind="stable")
+    return [
+        RankedWaypoint(
+            waypoints[i],
+            float(latitudes[i]),
+            float(longitudes[i]),
+            float(surface_altitudes[i]),
+            float(distances[i]),
+            float(headings[i]),
+        )
+        for i in order
+    ]
+
+
+def rank_waypoints(
+    body=None, max_surface_altitude: float = math.inf, has_contract: bool = True, near_surface: bool = True
+) -> List[RankedWaypoint]:
+    # All waypoints on 'body', by default the active vessel's, matching the filters, nearest to the vessel first.
+    # Reads every waypoint in one request, instead of several RPCs per waypoint per comparison. WaypointIndex keeps
+    # the waypoints between queries and only reads new ones.
+    cache = handles()
+    if body is None:
+        body = cache.body(active_vessel())
+    waypoints = connection().space_center.waypoint_manager.waypoints
+    rows = read_waypoints(waypoints)
+    on_body = [i for i, row in enumerate(rows) if object_key(row[0]) == object_key(body)]
+    columns = np.array([rows[i][1:] for i in on_body], dtype=float).reshape(len(on_body), len(WAYPOINT_FIELDS) - 1).T
+    latitudes, longitudes, altitudes, contracts, surface = columns
+    indices = np.flatnonzero(waypoint_mask(altitudes, contracts, surface, max_surface_altitude, has_contract, near_surface))
+    return rank_by_distance(
+        [waypoints[on_body[i]] for i in indices],
+        vessel_latitude(),
+        vessel_longitude(),
+        latitudes[indices],
+        longitudes[indices],
+        altitudes[indices],
+        cache.constants(body).equatorial_radius,
+    )
+
+
 def clip(minn: float, value: float, maxx: float) -> float:
     return max(minn, min(value, maxx))
 
@@ -0,0 +1,78 @@
+import math
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+
+class LandingParameters(NamedTuple):
+    # Tunables of the landing approach, see aircraft_land.py. Every field may also be a NumPy array with one value
+    # per candidate, which is how landing_sim.py flies many candidates at once.
+    # Max height before approaching the landing strip
+    max_height: float = 2_000
+    max_pitch_angle: float = 30
+    # in m/s
+    land_horizontal_velocity: float = 50
+    # Velocity before approaching landing strip
+    max_horizontal_velocity: float = 200
+    full_speed_until_distance_from_stop: float = 8_000
+    # Glide path: the target altitude is (distance to the stop position - glide_offset) / glide_ratio
+    glide_offset: float = 1_800
+    glide_ratio: float = 10
+    # Target pitch is sin(pitch_gain * relative altitude error) * max_pitch_angle
+    pitch_gain: float = 0.5
+    # Once the target altitude is below this, the plane holds touch_down_pitch, cuts the throttle and brakes
+    touch_down_altitude: float = 20
+    touch_down_pitch: float = 1
+    # Throttle change per tick while too slow and while too fast
+    throttle_up_step: float = 0.05
+    throttle_down_step: float = 0.10
+    # The throttle only goes up while accelerating less and only down while decelerating less than this, in m/s^2
+    throttle_up_max_acceleration: float = 1
+    throttle_down_max_deceleration: float = 1
+    # Brake above this fraction of the target velocity
+    brake_velocity_fraction: float = 1.1
+    # Autopilot settings of the pitch axis, the first entries of its deceleration_time and attenuation_angle
+    deceleration_time: float = 5
+    attenuation_angle: float = 0.1
+
+
+def landing_control(
+    p: LandingParameters,
+    distance_to_stop,
+    surface_altitude,
+    horizontal_speed,
+    horizontal_acceleration,
+    throttle,
+    touch_down,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # One tick of the landing controller, returns (target pitch, throttle, brakes, touch down, target altitude).
+    # Works on scalars from the game and on arrays of candidates alike. The throttle is clamped like the game does.
+    # The heading is not part of it, it only depends on the approach positions.
+    near_stop = distance_to_stop < p.full_speed_until_distance_from_stop
+    horizontal_velocity_fraction = horizontal_speed / np.where(
+        near_stop, p.land_horizontal_velocity, p.max_horizontal_velocity
+    )
+    # Increase throttle if horizontal velocity is below the target velocity and lower it if above
+    too_slow = horizontal_velocity_fraction < 1
+    throttle = np.where(
+        too_slow,
+        np.where(horizontal_acceleration < p.throttle_up_max_acceleration, throttle + p.throttle_up_step, throttle),
+        np.where(horizontal_acceleration > -p.throttle_down_max_deceleration, throttle - p.throttle_down_step, throttle),
+    )
+    brakes = ~too_slow & (horizontal_velocity_fraction > p.brake_velocity_fraction)
+
+    target_altitude = np.clip((distance_to_stop - p.glide_offset) / p.glide_ratio, 0.01, p.max_height)
+    flying = (target_altitude > p.touch_down_altitude) & ~np.asarray(touch_down)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(
+            surface_altitude >= target_altitude,
+            1 - surface_altitude / target_altitude,
+            target_altitude / surface_altitude - 1,
+        )
+    angle = p.pitch_gain * np.clip(frac, -math.pi, math.pi)
+    flying_pitch = np.clip(np.sin(angle) * p.max_pitch_angle, -p.max_pitch_angle, p.max_pitch_angle)
+
+    target_pitch = np.where(flying, flying_pitch, p.touch_down_pitch)
+    throttle = np.where(flying, np.clip(throttle, 0.0, 1.0), 0.0)
+    brakes = brakes | ~flying
+    return target_pitch, throttle, brakes, ~flying, target_altitude
@@ -0,0 +1,280 @@
+"""
+Landing simulator
+
+python landing_sim.py --candidates 2000 --workers 4
+python landing_sim.py --grid 4 --vary deceleration_time=1:20 --vary attenuation_angle=0.05:2 --top 5
+
+Flies many candidate sets of landing parameters at once with the controller of aircraft_land.py (see landing.py) in a
+3-DOF model of the final approach: distance along the runway's center line, altitude and pitch. The plane has
+thrust, drag, gravity and the stand-in server's lift, which turns the velocity towards the nose, and the autopilot
+turns the nose with the deceleration time and attenuation angle of the candidate, limited by the airframe's angular
+acceleration and rotation rate. That attitude response approximates kRPC's controller, it is good for ranking
+settings rather than predicting them exactly. There is no sideways motion, so the heading and roll_threshold are not
+part of the model.
+Each candidate is scored by how far from the stop position it comes to rest, its sink rate at touchdown and the time
+it takes to land. Candidates that touch down harder than the airframe takes, or do not come to rest, fail.
+"""
+
+import argparse
+import math
+import os
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+from loguru import logger
+
+from landing import LandingParameters, landing_control
+from stand_in_server import (
+    KERBIN_GRAVITATIONAL_PARAMETER,
+    KERBIN_RADIUS,
+    SEA_LEVEL_DENSITY,
+    Simulation,
+)
+from sweep import atmospheric_densities, broadcast, candidate_count, grid_parameters, parse_ranges, sample_parameters, simulate_parallel
+
+# Parameters varied by default and their ranges
+DEFAULT_RANGES = {
+    "deceleration_time": (1, 30),
+    "attenuation_angle": (0.05, 5),
+    "glide_offset": (500, 4_000),
+    "glide_ratio": (5, 20),
+    "pitch_gain": (0.1, 1.5),
+    "throttle_up_step": (0.01, 0.2),
+    "throttle_down_step": (0.02, 0.3),
+}
+
+# Score per meter from the stop position, per m/s of sink rate at touchdown and per second to land, lower is better
+SCORE_WEIGHTS: Dict[str, float] = {
+    "stop_error": 1 / 100,
+    "sink_rate": 1.0,
+    "time_to_land": 1 / 60,
+}
+
+
+class Airframe(NamedTuple):
+    mass: float
+    # Sea level thrust, jet engines lose thrust with air density
+    max_thrust: float
+    # Drag coefficient times reference area in m^2
+    drag_area: float
+    # How fast lift turns the velocity towards the nose, per kg/m^3 of air and m/s of speed
+    lift_coefficient: float
+    # Fastest pitch rotation in degrees per second
+    rotation_rate: float
+    # Pitch acceleration the control surfaces manage in degrees per second^2
+    angular_acceleration: float = 20.0
+    thrust_density_exponent: float = 0.7
+    # Largest pitch while rolling on the runway
+    max_ground_pitch: float = 15.0
+    # Deceleration on the runway in m/s^2, rolling and braking
+    rolling_friction: float = 0.2
+    brake_friction: float = 5.0
+    # Touching down faster than this in m/s breaks the landing gear
+    max_sink_rate: float = 5.0
+
+
+class Approach(NamedTuple):
+    # Where aircraft_land.py takes over, on the runway's center line heading for the stop position
+    distance: float = 15_000
+    altitude: float = 1_500
+    speed: float = 200
+    throttle: float = 0.5
+    pitch: float = 0.0
+
+
+def stand_in_aircraft() -> Airframe:
+    # The plane of the stand-in server's aircraft scenario
+    vessel = Simulation("aircraft").space_center.active_vessel
+    max_thrust = sum(part.engine.max_thrust for part in vessel.part_list if part.engine)
+    return Airframe(vessel.mass, max_thrust, vessel.drag_area, vessel.lift_coefficient, vessel.rotation_rate)
+
+
+def _target_rate(p: LandingParameters, error: np.ndarray, max_rate: float) -> np.ndarray:
+    # Pitch rate in degrees per second the autopilot asks for: fast enough to close the error within the
+    # deceleration time, faded out around the attenuation angle so it does not overshoot
+    magnitude = np.abs(error)
+    rate = np.minimum(max_rate, 2 * magnitude / p.deceleration_time)
+    with np.errstate(over="ignore"):
+        attenuation = 1 / (1 + np.exp(-4 * (magnitude - p.attenuation_angle) / p.attenuation_angle))
+    return np.sign(error) * rate * attenuation
+
+
+def simulate(
+    airframe: Airframe,
+    p: LandingParameters,
+    approach: Approach = Approach(),
+    dt: float = 0.02,
+    control_interval: float = 0.1,
+    max_time: float = 600,
+) -> Dict[str, np.ndarray]:
+    # Flies every candidate in 'p' (fields are scalars or arrays of the same length) from 'approach' until it comes
+    # to rest or 'max_time' seconds pass. The controller runs every 'control_interval' seconds like the script.
+    p = broadcast(p)
+    n = candidate_count(p)
+    control_steps = max(1, round(control_interval / dt))
+
+    # Signed distance to the stop position, negative once past it
+    x = np.full(n, float(approach.distance))
+    altitude = np.full(n, float(approach.altitude))
+    # Ground speed towards the stop position and vertical speed
+    u = np.full(n, float(approach.speed))
+    w = np.zeros(n)
+    pitch = np.full(n, float(approach.pitch))
+    pitch_rate = np.zeros(n)
+    throttle = np.full(n, float(approach.throttle))
+    target_pitch = pitch.copy()
+    brakes = np.zeros(n, dtype=bool)
+    touch_down = np.zeros(n, dtype=bool)
+    speed_at_last_tick = u.copy()
+
+    running = np.ones(n, dtype=bool)
+    touched = np.zeros(n, dtype=bool)
+    touchdown_distance = np.full(n, np.nan)
+    sink_rate = np.full(n, np.nan)
+    time_to_land = np.full(n, np.nan)
+    stop_error = np.full(n, np.nan)
+
+    for step in range(int(max_time / dt)):
+        if not running.any():
+            break
+
+        if step % control_steps == 0:
+            horizontal_speed = np.abs(u)
+            horizontal_acceleration = (horizontal_speed - speed_at_last_tick) / (control_steps * dt)
+            speed_at_last_tick = horizontal_speed
+            new_target_pitch, new_throttle, new_brakes, new_touch_down, _ = landing_control(
+                p, np.abs(x), altitude, horizontal_speed, horizontal_acceleration, throttle, touch_down
+            )
+            target_pitch = np.where(running, new_target_pitch, target_pitch)
+            throttle = np.where(running, new_throttle, throttle)
+            brakes = np.where(running, new_brakes, brakes)
+            touch_down = np.where(running, new_touch_down, touch_down)
+
+        # Attitude
+        target = _target_rate(p, target_pitch - pitch, airframe.rotation_rate)
+        max_change = airframe.angular_acceleration * dt
+        pitch_rate = pitch_rate + np.clip(target - pitch_rate, -max_change, max_change)
+        pitch = pitch + pitch_rate * dt * running
+        on_ground = altitude <= 0.01
+        clamped = np.clip(pitch, 0.0, airframe.max_ground_pitch)
+        pitch_rate = np.where(on_ground & (clamped != pitch), 0.0, pitch_rate)
+        pitch = np.where(on_ground, clamped, pitch)
+
+        # Thrust, drag, gravity and the apparent force of flying around the body
+        density = atmospheric_densities(altitude)
+        thrust = airframe.max_thrust * (density / SEA_LEVEL_DENSITY) ** airframe.thrust_density_exponent * throttle
+        speed = np.hypot(u, w)
+        drag = 0.5 * density * speed * airframe.drag_area / airframe.mass
+        radius = KERBIN_RADIUS + altitude
+        radians = np.radians(pitch)
+        a_u = thrust * np.cos(radians) / airframe.mass - drag * u
+        a_w = thrust * np.sin(radians) / airframe.mass - drag * w - KERBIN_GRAVITATIONAL_PARAMETER / radius ** 2 + u ** 2 / radius
+        u = np.where(running, u + a_u * dt, u)
+        w = np.where(running, w + a_w * dt, w)
+
+        # Lift turns the velocity towards the nose without changing its magnitude
+        flight_path = np.arctan2(w, u)
+        turn = radians - flight_path
+        max_turn = airframe.lift_coefficient * density * speed * dt
+        lifting = running & (speed > 1)
+        flight_path = flight_path + np.where(lifting, np.clip(turn, -max_turn, max_turn), 0.0)
+        new_speed = np.hypot(u, w)
+        u = np.where(lifting, new_speed * np.cos(flight_path), u)
+        w = np.where(lifting, new_speed * np.sin(flight_path), w)
+
+        # Ground contact
+        contact = running & (altitude + w * dt <= 0)
+        first_touch = contact & ~touched
+        sink_rate = np.where(first_touch, np.maximum(0.0, -w), sink_rate)
+        touchdown_distance = np.where(first_touch, x, touchdown_distance)
+        touched |= contact
+        w = np.where(contact, np.maximum(0.0, w), w)
+        friction = np.where(brakes, airframe.brake_friction, airframe.rolling_friction) * dt
+        u = np.where(contact, np.sign(u) * np.maximum(0.0, np.abs(u) - friction), u)
+
+        altitude = np.maximum(0.0, altitude + w * dt * running)
+        x = x - u * dt * running
+
+        # Came to rest on the ground
+        landed = running & touched & (altitude <= 0.01) & (np.hypot(u, w) < 1)
+        time_to_land[landed] = (step + 1) * dt
+        stop_error[landed] = x[landed]
+        running &= ~landed
+
+    crashed = sink_rate > airframe.max_sink_rate
+    landed = ~running & ~crashed
+    score = (
+        SCORE_WEIGHTS["stop_error"] * np.abs(stop_error)
+        + SCORE_WEIGHTS["sink_rate"] * sink_rate
+        + SCORE_WEIGHTS["time_to_land"] * time_to_land
+    )
+    return {
+        "landed": landed,
+        "crashed": crashed,
+        "score": np.where(landed, score, np.inf),
+        "stop_error": stop_error,
+        "touchdown_distance": touchdown_distance,
+        "sink_rate": sink_rate,
+        "time_to_land": time_to_land,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the landing parameters of aircraft_land.py in a simulated approach")
+    parser.add_argument("--candidates", type=int, default=1_000, help="Random candidates, unless --grid is given")
+    parser.add_argument("--grid", type=int, metavar="POINTS", help="Search a grid of POINTS values per parameter instead")
+    parser.add_argument(
+        "--vary",
+        metavar="NAME=LOW:HIGH",
+        action="append",
+        default=[],
+        help=f"Parameter range to search, default: {', '.join(DEFAULT_RANGES)}",
+    )
+    parser.add_argument(
+        "--airframe",
+        metavar="NAME=VALUE",
+        action="append",
+        default=[],
+        help=f"Override a value of the stand-in aircraft: {', '.join(Airframe._fields)}",
+    )
+    parser.add_argument("--distance", type=float, default=Approach().distance, help="Start distance to the stop in m")
+    parser.add_argument("--altitude", type=float, default=Approach().altitude, help="Start altitude in m")
+    parser.add_argument("--speed", type=float, default=Approach().speed, help="Start speed in m/s")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--dt", type=float, default=0.02, help="Time step in seconds")
+    parser.add_argument("--max-time", type=float, default=600, help="Seconds before a candidate counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    ranges = parse_ranges(args.vary) if args.vary else dict(DEFAULT_RANGES)
+    airframe = stand_in_aircraft()._replace(
+        **{name: float(value) for name, value in (assignment.split("=", 1) for assignment in args.airframe)}
+    )
+    approach = Approach(args.distance, args.altitude, args.speed)
+    if args.grid:
+        candidates = grid_parameters(ranges, args.grid, LandingParameters())
+    else:
+        candidates = sample_parameters(args.candidates, ranges, LandingParameters(), seed=args.seed)
+    count = candidate_count(candidates)
+    logger.info(f"Flying {count} candidates")
+    results = simulate_parallel(
+        simulate, airframe, candidates, args.workers, approach=approach, dt=args.dt, max_time=args.max_time
+    )
+
+    score = results["score"]
+    logger.info(
+        f"{int(results['landed'].sum())} of {count} candidates land, {int(results['crashed'].sum())} touch down too hard"
+    )
+    header = "".join(f"{name:>22}" for name in ranges)
+    print(f"{'rank':>4} {'score':>8} {'stop error m':>13} {'touchdown m':>12} {'sink m/s':>9} {'time s':>7}{header}")
+    order = np.argsort(score)
+    rows: List[int] = [int(i) for i in order[: args.top]]
+    for rank, i in [(rank + 1, i) for rank, i in enumerate(rows)] + [("base", 0)]:
+        parameters = "".join(f"{getattr(candidates, name)[i]:>22.3f}" for name in ranges)
+        print(
+            f"{rank:>4} {score[i]:>8.2f} {results['stop_error'][i]:>13.0f} {results['touchdown_distance'][i]:>12.0f}"
+            f" {results['sink_rate'][i]:>9.2f} {results['time_to_land'][i]:>7.1f}{parameters}"
+        )
+    if math.isfinite(score[0]) and math.isfinite(score[order[0]]):
+        logger.info(f"Best candidate scores {score[0] - score[order[0]]:.2f} better than the current config")
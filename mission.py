@@ -0,0 +1,93 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from tick_timing import TickTimer
+
+
+class Mission:
+    # Runs independent jobs (flight controller, science, staging, ...) concurrently on one asyncio event loop.
+    # kRPC calls block, so every job body runs on a bounded thread pool. Each job has at most one call in flight, so
+    # with at least as many workers as jobs a slow job (e.g. an experiment scan) never delays another one.
+    # Usage:
+    #   mission = Mission()
+    #   mission.every("pilot", 1, fly)
+    #   mission.every("science", 1, science.run)
+    #   mission.every("staging", 0.5, stage_if_low_on_fuel)
+    #   mission.run()
+    # A job body returning True ends the mission.
+    # The runs of every() jobs are timed, pass the jobs' connection as 'conn' to tell their RPC time apart.
+    def __init__(self, max_workers: int = 4, conn=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mission")
+        self.conn = conn
+        self.timers: Dict[str, TickTimer] = {}
+        self._jobs: List[Tuple[str, Callable[[], Awaitable]]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    async def call(self, fn: Callable, *args):
+        # Run a blocking function on the thread pool
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def add(self, name: str, job: Callable[[], Awaitable]):
+        # Add a coroutine function as a job
+        self._jobs.append((name, job))
+
+    def every(self, name: str, interval: float, fn: Callable[[], Optional[bool]]):
+        # Run a blocking function every 'interval' seconds. If a run takes longer than the interval, the next one
+        # starts right away instead of trying to catch up on the missed ones.
+        timer = self.timers[name] = TickTimer(f"job '{name}'", interval, self.conn, report_interval=60)
+
+        def timed():
+            with timer.tick():
+                return fn()
+
+        async def job():
+            loop = asyncio.get_running_loop()
+            next_run = loop.time()
+            while True:
+                if await self.call(timed):
+                    self.stop()
+                    return
+                next_run = max(next_run + interval, loop.time())
+                await asyncio.sleep(next_run - loop.time())
+
+        self.add(name, job)
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        # Run a blocking function after 'delay' seconds without holding up the caller. Safe to call from job bodies.
+        async def delayed():
+            await asyncio.sleep(delay)
+            await self.call(fn, *args)
+
+        self._loop.call_soon_threadsafe(lambda: self._loop.create_task(delayed()))
+
+    def stop(self):
+        # Safe to call from any thread
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            self.executor.shutdown(wait=True)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        # Tasks only have names from Python 3.8 on, so the job names are kept next to them
+        names = {asyncio.create_task(job()): name for name, job in self._jobs}
+        tasks = list(names)
+        stop = asyncio.create_task(self._stopped.wait())
+        done, _ = await asyncio.wait(tasks + [stop], return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks + [stop]:
+            task.cancel()
+        await asyncio.gather(*tasks, stop, return_exceptions=True)
+        for task in done:
+            if task is not stop and not task.cancelled() and task.exception() is not None:
+                logger.error(f"Job '{names[task]}' failed")
+                raise task.exception()
@@ -0,0 +1,30 @@
+import socket
+
+from krpc.decoder import Decoder
+from krpc.encoder import Encoder
+
+# Message framing of the kRPC protocol: every message is a protobuf message prefixed with its size as a varint.
+# Shared by the stand-in server and the broker.
+
+
+def receive_message(sock: socket.socket, typ: type):
+    size, shift = 0, 0
+    while True:
+        byte = sock.recv(1)
+        if not byte:
+            raise ConnectionError("Connection closed")
+        size |= (byte[0] & 0x7F) << shift
+        shift += 7
+        if not byte[0] & 0x80:
+            break
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return Decoder.decode_message(data, typ)
+
+
+def send_message(sock: socket.socket, message):
+    sock.sendall(Encoder.encode_message_with_size(message))
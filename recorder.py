@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from telemetry import Telemetry, TelemetrySnapshot
+
+# Rows are stored after a header block, whose first 8 bytes hold the number of rows ever written
+HEADER_SIZE = 64
+
+COMMAND_DTYPE = np.dtype([("time", "f8"), ("command", "i4"), ("value", "f8")])
+
+
+def telemetry_dtype(columns: List[str]) -> np.dtype:
+    return np.dtype([("time", "f8"), ("frame", "i8")] + [(column, "f8") for column in columns])
+
+
+class RingBuffer:
+    # Fixed dtype rows in a memory-mapped file, the oldest rows are overwritten once 'capacity' is reached.
+    # Another process can open the same file read only and read the rows while they are written.
+    def __init__(self, path: str, dtype: np.dtype, capacity: Optional[int] = None, readonly: bool = False):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        if readonly:
+            capacity = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+            mode = "r"
+        else:
+            mode = "w+"
+        self.capacity = capacity
+        # Map the rows first, creating the file at its full size
+        self._rows = np.memmap(path, dtype=self.dtype, mode=mode, offset=HEADER_SIZE, shape=(capacity,))
+        self._count = np.memmap(path, dtype=np.int64, mode="r" if readonly else "r+", shape=(1,))
+
+    def __len__(self):
+        return min(int(self._count[0]), self.capacity)
+
+    def append(self, row: tuple):
+        # Single writer: the row is written before the count is bumped, so readers never see a half written row
+        count = int(self._count[0])
+        self._rows[count % self.capacity] = row
+        self._count[0] = count + 1
+
+    def read(self, last: Optional[int] = None) -> np.ndarray:
+        # Copy of the rows in the order they were written, or of the 'last' ones
+        count = int(self._count[0])
+        start = max(0, count - self.capacity)
+        if last is not None:
+            start = max(start, count - last)
+        indices = np.arange(start, count) % self.capacity
+        rows = self._rows[indices]
+        # Drop rows the writer wrapped around and overwrote while they were copied, including the one it may be
+        # writing right now
+        overwritten = int(self._count[0]) + 1 - self.capacity - start
+        return rows[max(0, overwritten):]
+
+    def flush(self):
+        self._rows.flush()
+        self._count.flush()
+
+
+def _meta_path(path: str) -> str:
+    return os.path.join(path, "meta.json")
+
+
+def write_json(file: str, data: dict):
+    # Replace atomically so a reader never loads a partial file
+    temp = file + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp, file)
+
+
+class Recorder:
+    # Records every telemetry snapshot and the control commands the script issues into ring buffers on disk.
+    # Recording happens in the stream update thread and costs one row write per snapshot, so it keeps up with the
+    # full loop rate. Numbers and booleans are stored as float64, vectors as one column per component
+    # (e.g. 'aerodynamic_force.0'), other values are left out.
+    # Usage:
+    #   recorder = Recorder("recordings/lift_off", telemetry)
+    #   vessel.auto_pilot.target_pitch = target_pitch
+    #   recorder.command("target_pitch", target_pitch)
+    # While flying, from another process: python recorder.py recordings/lift_off
+    def __init__(self, path: str, telemetry: Telemetry, capacity: int = 2 ** 16, command_capacity: int = 2 ** 14):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.telemetry = telemetry
+        self._lock = threading.Lock()
+
+        snapshot = telemetry.snapshot()
+        self._fields: List[Tuple[str, int]] = []
+        columns = []
+        for name, value in snapshot.as_dict().items():
+            if isinstance(value, (bool, int, float)):
+                self._fields.append((name, 0))
+                columns.append(name)
+            elif isinstance(value, tuple) and all(isinstance(v, (bool, int, float)) for v in value):
+                self._fields.append((name, len(value)))
+                columns.extend(f"{name}.{i}" for i in range(len(value)))
+
+        self.telemetry_buffer = RingBuffer(os.path.join(path, "telemetry.bin"), telemetry_dtype(columns), capacity)
+        self.command_buffer = RingBuffer(os.path.join(path, "commands.bin"), COMMAND_DTYPE, command_capacity)
+        self._commands: Dict[str, int] = {}
+        self._meta = {
+            "telemetry": {"columns": columns, "capacity": capacity},
+            "commands": {"names": [], "capacity": command_capacity},
+        }
+        write_json(_meta_path(path), self._meta)
+
+        self.record(snapshot)
+        telemetry.add_listener(self.record)
+
+    def record(self, snapshot: TelemetrySnapshot):
+        row = [time.time(), snapshot.frame]
+        for name, size in self._fields:
+            value = getattr(snapshot, name)
+            if size:
+                row.extend(value)
+            else:
+                row.append(value)
+        self.telemetry_buffer.append(tuple(row))
+
+    def command(self, name: str, value: float):
+        # Safe to call from any thread
+        with self._lock:
+            command = self._commands.get(name)
+            if command is None:
+                command = self._commands[name] = len(self._commands)
+                self._meta["commands"]["names"].append(name)
+                write_json(_meta_path(self.path), self._meta)
+            self.command_buffer.append((time.time(), command, float(value)))
+
+    def export(self, file: str):
+        RecordingReader(self.path).export(file)
+
+    def close(self):
+        self.telemetry.remove_listener(self.record)
+        self.telemetry_buffer.flush()
+        self.command_buffer.flush()
+
+
+class RecordingReader:
+    # Reads a recording, also while the Recorder is still writing to it from another process
+    def __init__(self, path: str):
+        self.path = path
+        with open(_meta_path(path)) as f:
+            columns = json.load(f)["telemetry"]["columns"]
+        self.telemetry_buffer = RingBuffer(os.path.join(path, "telemetry.bin"), telemetry_dtype(columns), readonly=True)
+        self.command_buffer = RingBuffer(os.path.join(path, "commands.bin"), COMMAND_DTYPE, readonly=True)
+
+    def telemetry(self, last: Optional[int] = None) -> np.ndarray:
+        return self.telemetry_buffer.read(last)
+
+    def commands(self, last: Optional[int] = None) -> List[Tuple[float, str, float]]:
+        # (time, command name, value), command names can be added while recording so they are loaded on each read
+        with open(_meta_path(self.path)) as f:
+            names = json.load(f)["commands"]["names"]
+        return [(float(t), names[c], float(v)) for t, c, v in self.command_buffer.read(last)]
+
+    def export(self, file: str):
+        # Write one compressed column per field, e.g. np.load(file)["telemetry.pitch"]
+        rows = self.telemetry()
+        columns = {f"telemetry.{name}": rows[name] for name in rows.dtype.names}
+        commands = self.commands()
+        columns["commands.time"] = np.array([c[0] for c in commands], dtype=np.float64)
+        columns["commands.name"] = np.array([c[1] for c in commands], dtype=str)
+        columns["commands.value"] = np.array([c[2] for c in commands], dtype=np.float64)
+        np.savez_compressed(file, **columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or export a flight recording")
+    parser.add_argument("path", help="Recording directory")
+    parser.add_argument("--last", type=int, default=10, help="Number of rows to show")
+    parser.add_argument("--export", metavar="FILE", help="Export the recording to a compressed .npz file")
+    args = parser.parse_args()
+
+    reader = RecordingReader(args.path)
+    if args.export:
+        reader.export(args.export)
+        print(f"Exported {len(reader.telemetry_buffer)} telemetry rows to {args.export}")
+    else:
+        rows = reader.telemetry(args.last)
+        print("  ".join(rows.dtype.names))
+        for row in rows:
+            print("  ".join(f"{value:.3f}" for value in row.tolist()))
+        for t, name, value in reader.commands(args.last):
+            print(f"{t:.3f}  {name} = {value:.3f}")
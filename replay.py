@@ -0,0 +1,375 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import runpy
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import krpc
+from loguru import logger
+
+import control_buffer
+import flight_log
+import recorder
+import telemetry
+from control_buffer import ControlBuffer
+from recorder import RecordingReader
+from telemetry import Telemetry
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+class Command(NamedTuple):
+    # Recording row that was current when the command was issued
+    frame: int
+    path: str
+    value: object
+
+
+# Values for reads that are neither recorded nor written by the controller, matched against the end of the path.
+# Override or extend them with Replay(defaults=...) or --set on the command line.
+DEFAULTS: Dict[str, object] = {
+    "control.current_stage": 1,
+    "amount('SolidFuel')": 0.0,
+    "amount('LiquidFuel')": 1_000.0,
+    "amount('ElectricCharge')": 100.0,
+    "max('ElectricCharge')": 100.0,
+    "thrust": 1.0,
+    "available_thrust": 1.0,
+    "specific_impulse": 300.0,
+    "mass": 1.0,
+    "delta_v": 0.0,
+    "time_to": 0.0,
+    "direction": (0.0, 1.0, 0.0),
+    "equatorial_radius": 600_000.0,
+    "latitude": 0.0,
+    "longitude": 0.0,
+}
+
+# Ranges the game clamps written values to
+LIMITS = {"control.throttle": (0.0, 1.0)}
+
+# Method calls that only read state, every other call is captured as a command
+QUERY_METHODS = {"flight", "resources_in_decouple_stage", "amount", "max", "has_resource"}
+
+
+class ReplayObject:
+    # Stands in for any remote object. Reads resolve to the value the controller last wrote, the recorded telemetry
+    # column of the same name, a default, or another ReplayObject so chains like vessel.flight().pitch work.
+    # Writes and method calls are captured as commands.
+    def __init__(self, replay: "Replay", path: str):
+        object.__setattr__(self, "_replay", replay)
+        object.__setattr__(self, "_path", path)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self._replay.read(f"{self._path}.{name}", name)
+
+    def __setattr__(self, name, value):
+        self._replay.write(f"{self._path}.{name}", value)
+
+    def __call__(self, *args):
+        arguments = ", ".join(repr(a) for a in args if not isinstance(a, ReplayObject))
+        path = f"{self._path}({arguments})"
+        if self._path.rsplit(".", 1)[-1] not in QUERY_METHODS:
+            self._replay.write(path, None)
+        return self._replay.read(path, None)
+
+    def __getitem__(self, index):
+        return ReplayObject(self._replay, f"{self._path}[{index}]")
+
+    def __iter__(self):
+        return iter(())
+
+    def __bool__(self):
+        return True
+
+    def __eq__(self, other):
+        # Objects read through the same path stand for the same remote object, like proxies with the same object id
+        return isinstance(other, ReplayObject) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __repr__(self):
+        return f"<replay {self._path}>"
+
+
+class ReplayStream:
+    def __init__(self, read: Callable[[], object]):
+        self._read = read
+
+    def __call__(self):
+        return self._read()
+
+    def add_callback(self, callback):
+        pass
+
+    def remove_callback(self, callback):
+        pass
+
+    def start(self, wait=True):
+        pass
+
+    def remove(self):
+        pass
+
+
+class ReplayConnection:
+    # The part of the krpc client the scripts use, returned by krpc.connect while replaying
+    def __init__(self, replay: "Replay"):
+        self.space_center = ReplayObject(replay, "space_center")
+
+    def add_stream(self, func, *args):
+        return ReplayStream(lambda: func(*args))
+
+    def add_stream_update_callback(self, callback):
+        pass
+
+    def remove_stream_update_callback(self, callback):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayTelemetry(Telemetry):
+    # Publishes the recorded rows as snapshots. A wait for a new frame moves the replay on to the next row instead
+    # of blocking, so controllers run as fast as the CPU allows.
+    replay: "Replay" = None
+
+    def __init__(self, conn, fields, rate=None):
+        self.conn = conn
+        self.fields = fields
+        self.rate = rate
+        self._snapshot_class = type("TelemetrySnapshot", (telemetry.TelemetrySnapshot,), {"__slots__": tuple(fields)})
+        self._closed = False
+        self._listeners = []
+        self._cache = (None, None)
+
+    def snapshot(self):
+        replay = self.replay
+        row, snapshot = self._cache
+        if row != replay.row:
+            values = {}
+            for name, (obj, attribute) in self.fields.items():
+                value = replay.column(name)
+                values[name] = getattr(obj, attribute) if value is None else value
+            snapshot = self._snapshot_class(replay.row, values)
+            self._cache = (replay.row, snapshot)
+        return snapshot
+
+    def wait(self, after_frame, timeout=None):
+        if self.replay.row <= after_frame:
+            self.replay.next_row()
+        return self.snapshot()
+
+    def set_rate(self, rate):
+        self.rate = rate
+
+    def close(self):
+        self._closed = True
+
+
+class ReplayControlBuffer(ControlBuffer):
+    # Writes the changed values one by one, so they are captured as commands like direct writes
+    def flush(self):
+        count = 0
+        for shadow in (self.control, self.auto_pilot):
+            values = shadow.changes()
+            for name, value in values.items():
+                setattr(shadow._obj, name, value)
+            shadow.sent(values)
+            count += len(values)
+        self.writes += count
+        return count
+
+
+class NullRecorder:
+    # Keeps scripts from recording over the recording that is being replayed
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def command(self, name, value):
+        pass
+
+    def close(self):
+        pass
+
+
+class TextFlightLog(flight_log.FlightLog):
+    # Keeps scripts from writing their binary log over the one of the flight that is being replayed
+    def __init__(self, path=None, **kwargs):
+        super().__init__(None, **kwargs)
+
+
+class Replay:
+    # Runs a controller script against a recorded flight (see recorder.py) and captures the commands it issues.
+    # krpc.connect, Telemetry and the time functions are replaced while the script runs: the clock only moves when
+    # the script sleeps or waits for telemetry, which makes runs deterministic and independent of CPU speed.
+    # Only works for single threaded scripts.
+    # Usage:
+    #   commands = Replay("recordings/spacecraft_lift_off").run("spacecraft_lift_off.py")
+    def __init__(self, recording: str, defaults: Optional[Dict[str, object]] = None):
+        self.rows = RecordingReader(recording).telemetry()
+        if not len(self.rows):
+            raise ValueError(f"Recording '{recording}' has no telemetry")
+        self.columns = set(self.rows.dtype.names)
+        self.defaults = dict(DEFAULTS, **(defaults or {}))
+        self.defaults["space_center.ut"] = lambda: self.clock
+        self.row = 0
+        self.clock = float(self.rows["time"][0])
+        self.written: Dict[str, object] = {}
+        self.commands: List[Command] = []
+
+    def column(self, name: str):
+        if name in self.columns:
+            return self.rows[name][self.row].item()
+        if f"{name}.0" in self.columns:
+            size = sum(1 for column in self.columns if column.startswith(f"{name}."))
+            return tuple(self.rows[f"{name}.{i}"][self.row].item() for i in range(size))
+        return None
+
+    def read(self, path: str, name: Optional[str]):
+        if path in self.written:
+            return self.written[path]
+        if name is not None:
+            value = self.column(name)
+            if value is not None:
+                return value
+        for suffix, value in self.defaults.items():
+            if path.endswith(suffix):
+                return value() if callable(value) else value
+        return ReplayObject(self, path)
+
+    def write(self, path: str, value):
+        for suffix, (low, high) in LIMITS.items():
+            if path.endswith(suffix):
+                value = min(max(value, low), high)
+        self.commands.append(Command(self.row, path, value))
+        if value is not None:
+            self.written[path] = value
+
+    def next_row(self):
+        if self.row + 1 >= len(self.rows):
+            raise ReplayFinished
+        self.row += 1
+        self.clock = max(self.clock, float(self.rows["time"][self.row]))
+
+    def sleep(self, seconds: float):
+        self.clock += max(0.0, seconds)
+        times = self.rows["time"]
+        while self.row + 1 < len(times) and times[self.row + 1] <= self.clock:
+            self.row += 1
+        if self.clock > times[-1]:
+            raise ReplayFinished
+
+    def run(self, script: str) -> List[Command]:
+        patches = [
+            (krpc, "connect", lambda *args, **kwargs: ReplayConnection(self)),
+            (telemetry, "Telemetry", ReplayTelemetry),
+            (recorder, "Recorder", NullRecorder),
+            (flight_log, "FlightLog", TextFlightLog),
+            (control_buffer, "ControlBuffer", ReplayControlBuffer),
+            (time, "sleep", self.sleep),
+            (time, "time", lambda: self.clock),
+            (time, "perf_counter", lambda: self.clock),
+            (time, "monotonic", lambda: self.clock),
+            (time, "perf_counter_ns", lambda: int(self.clock * 1e9)),
+        ]
+        originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+        modules = set(sys.modules)
+        ReplayTelemetry.replay = self
+        for module, name, value in patches:
+            setattr(module, name, value)
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except (ReplayFinished, SystemExit):
+            pass
+        finally:
+            for module, name, value in originals:
+                setattr(module, name, value)
+            # The script's own modules (helper, ...) hold replay objects, import them fresh next time
+            directory = os.path.dirname(os.path.abspath(script))
+            for name in set(sys.modules) - modules:
+                if os.path.dirname(os.path.abspath(getattr(sys.modules[name], "__file__", None) or "")) == directory:
+                    del sys.modules[name]
+        return self.commands
+
+
+def save_commands(commands: List[Command], file: str):
+    with open(file, "w") as f:
+        for command in commands:
+            f.write(json.dumps({"frame": command.frame, "path": command.path, "value": command.value}) + "\n")
+
+
+def load_commands(file: str) -> List[Command]:
+    with open(file) as f:
+        return [Command(c["frame"], c["path"], c["value"]) for c in map(json.loads, f)]
+
+
+def compare_commands(old: List[Command], new: List[Command], tolerance: float = 1e-9) -> Optional[int]:
+    # Index of the first command that differs, None if both runs issued the same commands
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a.frame != b.frame or a.path != b.path:
+            return i
+        if isinstance(a.value, float) and isinstance(b.value, (int, float)):
+            if abs(a.value - b.value) > tolerance:
+                return i
+        elif a.value != b.value:
+            return i
+    return None if len(old) == len(new) else min(len(old), len(new))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a controller script against a recorded flight")
+    parser.add_argument("script", help="Controller script, e.g. spacecraft_lift_off.py")
+    parser.add_argument("recording", help="Recording directory, e.g. recordings/spacecraft_lift_off")
+    parser.add_argument("--save", metavar="FILE", help="Save the issued commands as JSON lines")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the issued commands with a saved run")
+    parser.add_argument("--set", metavar="PATH=VALUE", action="append", default=[], help="Default for a read")
+    parser.add_argument("--profile", action="store_true", help="Show where the controller spends its time")
+    parser.add_argument("--verbose", action="store_true", help="Show the script's log output")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+    defaults = {}
+    for assignment in args.set:
+        path, value = assignment.split("=", 1)
+        defaults[path] = json.loads(value)
+
+    replay = Replay(args.recording, defaults)
+    start = time.perf_counter()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    commands = replay.run(args.script)
+    if profiler:
+        profiler.disable()
+    duration = time.perf_counter() - start
+    print(f"Replayed {replay.row + 1} of {len(replay.rows)} frames in {duration:.3f} s, {len(commands)} commands")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+    if args.save:
+        save_commands(commands, args.save)
+    if args.compare:
+        old = load_commands(args.compare)
+        # Values go through JSON when saved, compare the same way
+        new = [Command(c.frame, c.path, json.loads(json.dumps(c.value))) for c in commands]
+        index = compare_commands(old, new)
+        if index is None:
+            print(f"Same {len(new)} commands as {args.compare}")
+        else:
+            print(f"Commands differ from {args.compare} at command {index}:")
+            print(f"  before: {old[index] if index < len(old) else '-'}")
+            print(f"  now:    {new[index] if index < len(new) else '-'}")
+            sys.exit(1)
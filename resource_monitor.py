@@ -0,0 +1,95 @@
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+from streams import StreamHandle, StreamRegistry
+
+
+class StageResources(NamedTuple):
+    # Resources that are dropped by the next decouple, i.e. what the current stage burns
+    stage: int
+    amounts: Dict[str, float]
+    # Largest amount of the monitored fuels, the stage is empty once it is below 0.1
+    fuel: float
+    # Fuel burnt per second of game time, averaged over the monitor's window
+    burn_rate: float
+    # Seconds of game time until the fuel runs out at the current burn rate, inf if none is burnt
+    time_to_empty: float
+
+
+class ResourceMonitor:
+    # Streams the fuel of the current stage, so staging decisions are reads of local values instead of three RPCs.
+    # The resources handle and its amount streams are only rebuilt when the current stage changes.
+    # Usage:
+    #   monitor = ResourceMonitor(registry, vessel)
+    #   status = monitor.status()
+    #   if status.time_to_empty < 0.5:
+    #       vessel.control.activate_next_stage()
+    #       monitor.staged()
+    def __init__(
+        self, registry: StreamRegistry, vessel, fuels: Tuple[str, ...] = ("SolidFuel", "LiquidFuel"), window: float = 1.0
+    ):
+        self.registry = registry
+        self.vessel = vessel
+        self.fuels = fuels
+        # Seconds of game time the burn rate is averaged over
+        self.window = window
+        self._lock = threading.Lock()
+        self._current_stage = registry.acquire(getattr, vessel.control, "current_stage")
+        self._ut = registry.acquire(getattr, registry.conn.space_center, "ut")
+        self._stage: Optional[int] = None
+        # Resources handles by decouple stage, stages only ever count down so each is fetched once
+        self._resources: Dict[int, object] = {}
+        self._amounts: Dict[str, StreamHandle] = {}
+        # (game time, fuel) samples within the window
+        self._samples: Deque[Tuple[float, float]] = deque()
+        self._staged_from: Optional[int] = None
+
+    def _rebuild(self, stage: int):
+        for handle in self._amounts.values():
+            handle.release()
+        decouple_stage = stage - 1
+        if decouple_stage not in self._resources:
+            self._resources[decouple_stage] = self.vessel.resources_in_decouple_stage(decouple_stage)
+        resources = self._resources[decouple_stage]
+        self._amounts = {name: self.registry.acquire(resources.amount, name) for name in self.fuels}
+        self._samples.clear()
+        self._stage = stage
+
+    def status(self) -> StageResources:
+        with self._lock:
+            stage = self._current_stage()
+            if stage != self._stage:
+                self._rebuild(stage)
+            amounts = {name: handle() for name, handle in self._amounts.items()}
+            fuel = max(amounts.values())
+
+            ut = self._ut()
+            samples = self._samples
+            if not samples or ut > samples[-1][0]:
+                samples.append((ut, fuel))
+            while len(samples) > 2 and ut - samples[1][0] >= self.window:
+                samples.popleft()
+            (t0, fuel0), (t1, fuel1) = samples[0], samples[-1]
+            burn_rate = max(0.0, (fuel0 - fuel1) / (t1 - t0)) if t1 > t0 else 0.0
+            time_to_empty = fuel / burn_rate if burn_rate > 0 else math.inf
+            return StageResources(stage, amounts, fuel, burn_rate, time_to_empty)
+
+    def staged(self):
+        # Call after activating the next stage. The current stage stream lags behind the staging, until it has caught
+        # up should_stage() is False, so the same empty stage is not staged twice.
+        with self._lock:
+            self._staged_from = self._stage
+
+    def should_stage(self, status: StageResources, lead_time: float = 0.0) -> bool:
+        # The stage is empty, or will be within 'lead_time' seconds at the current burn rate
+        if status.stage == self._staged_from:
+            return False
+        return status.fuel < 0.1 or status.time_to_empty <= lead_time
+
+    def close(self):
+        with self._lock:
+            for handle in [self._current_stage, self._ut, *self._amounts.values()]:
+                handle.release()
+            self._amounts = {}
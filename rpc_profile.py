@@ -0,0 +1,225 @@
+"""
+RPC profiler
+
+python rpc_profile.py aircraft_land.py
+python rpc_profile.py run_science.py --top 30
+
+Runs a script and counts and times every RPC it makes, by procedure, by the line that made it and by the loop it
+was made in. Loop iterations are counted from Telemetry.frames(), FixedRate, Mission.every() jobs and time.sleep()
+calls, so 'while 1: time.sleep(0.1)' loops are picked up as well. The report is printed when the script ends or is
+interrupted with Ctrl+C.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import krpc
+import krpc.schema.KRPC_pb2 as KRPC
+
+import control_buffer
+import helper
+import tick_timing
+
+_KRPC_DIRECTORY = os.path.dirname(os.path.abspath(krpc.__file__))
+# Loops wrapped in TickTimer.track() are reported at the line of the loop, not in tick_timing.py, and batched
+# writes of a ControlBuffer at the line that flushed it
+_SKIPPED_FILES = (
+    os.path.abspath(__file__),
+    os.path.abspath(tick_timing.__file__),
+    os.path.abspath(control_buffer.__file__),
+)
+# The batch functions of the helper send requests for their callers, which are reported instead
+_SKIPPED_FUNCTIONS = {
+    (os.path.abspath(helper.__file__), name) for name in ("batch_get", "batch_set", "batch_call", "_send_batch")
+}
+
+
+def _caller(depth: int = 2) -> str:
+    # 'file:line (function)' of the innermost frame that is not in the krpc client (including the service methods it
+    # generates at runtime, which have no file), this module, tick_timing, control_buffer or a batch function
+    frame = sys._getframe(depth)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith("<"):
+            filename = os.path.abspath(filename)
+        if (
+            not filename.startswith((_KRPC_DIRECTORY, "<"))
+            and filename not in _SKIPPED_FILES
+            and (filename, frame.f_code.co_name) not in _SKIPPED_FUNCTIONS
+        ):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "?"
+
+
+class RPCProfiler:
+    # Counts and times the RPCs of instrumented connections.
+    # Usage:
+    #   profiler = RPCProfiler()
+    #   profiler.instrument(conn)
+    #   while 1:
+    #       profiler.tick("control loop")
+    #       ...
+    #   print(profiler.report())
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.start = time.perf_counter()
+        # (loop, procedure, location) -> [calls, seconds]
+        self.calls: Dict[Tuple[str, str, str], List[float]] = {}
+        self.ticks: Counter = Counter()
+
+    def instrument(self, conn):
+        # Wraps the connection's RPC socket, so batched requests and stream setup are counted too
+        rpc = conn._rpc_connection
+        send_message, receive_message = rpc.send_message, rpc.receive_message
+        # Requests and responses alternate under the client's lock, so one pending request per connection is enough
+        pending = []
+
+        def send(message):
+            if isinstance(message, KRPC.Request):
+                procedures = [f"{call.service}.{call.procedure}" for call in message.calls]
+                pending.append((procedures, _caller(), self.loop, time.perf_counter()))
+            return send_message(message)
+
+        def receive(message_type):
+            message = receive_message(message_type)
+            if pending and message_type is KRPC.Response:
+                procedures, location, loop, start = pending.pop()
+                self._record(loop, procedures, location, time.perf_counter() - start)
+            return message
+
+        rpc.send_message = send
+        rpc.receive_message = receive
+        return conn
+
+    def _record(self, loop: str, procedures: List[str], location: str, seconds: float):
+        with self._lock:
+            for procedure in procedures:
+                entry = self.calls.setdefault((loop, procedure, location), [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds / len(procedures)
+
+    @property
+    def loop(self) -> str:
+        # The loop the current thread is in, RPCs outside of any loop are reported as 'outside loops'
+        return getattr(self._local, "loop", "outside loops")
+
+    def tick(self, loop: Optional[str] = None):
+        # Start the next iteration of a loop, by default named after the calling line
+        loop = loop or _caller()
+        self._local.loop = loop
+        with self._lock:
+            self.ticks[loop] += 1
+
+    def leave(self):
+        self._local.loop = "outside loops"
+
+    def report(self, top: int = 20) -> str:
+        with self._lock:
+            calls = dict(self.calls)
+            ticks = Counter(self.ticks)
+        elapsed = time.perf_counter() - self.start
+        total_calls = sum(c for c, _ in calls.values())
+        total_seconds = sum(s for _, s in calls.values())
+        lines = [f"{total_calls} RPCs in {elapsed:.1f} s, {total_seconds * 1000:.0f} ms waiting for the server", ""]
+
+        per_loop: Dict[str, List[float]] = {}
+        for (loop, _, _), (count, seconds) in calls.items():
+            entry = per_loop.setdefault(loop, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+        # RPCs outside of any loop have no ticks, only their totals are shown
+        lines.append(f"{'ticks':>8} {'calls/tick':>10} {'ms/tick':>8} {'calls':>8} {'total ms':>9}  loop")
+        for loop, (count, seconds) in sorted(per_loop.items(), key=lambda item: -item[1][1]):
+            n = ticks.get(loop, 0)
+            lines.append(f"{n or '':>8} {_per_tick(count, seconds, n)} {count:>8} {seconds * 1000:>9.1f}  {loop}")
+        lines.append("")
+
+        lines.append(f"{'calls':>8} {'calls/tick':>10} {'ms/tick':>8} {'total ms':>9} {'mean us':>8}  procedure at line, in loop")
+        ranked = sorted(calls.items(), key=lambda item: -item[1][1])
+        for (loop, procedure, location), (count, seconds) in ranked[:top]:
+            lines.append(
+                f"{count:>8} {_per_tick(count, seconds, ticks.get(loop, 0))} {seconds * 1000:>9.1f} {seconds * 1e6 / count:>8.0f}"
+                f"  {procedure} at {location}, in {loop}"
+            )
+        return "\n".join(lines)
+
+
+def _per_tick(count: int, seconds: float, ticks: int) -> str:
+    # The calls/tick and ms/tick columns, blank for RPCs outside of any loop
+    if not ticks:
+        return f"{'':>10} {'':>8}"
+    return f"{count / ticks:>10.1f} {seconds * 1000 / ticks:>8.2f}"
+
+
+def _profile_loops(profiler: RPCProfiler):
+    # Count loop iterations of the loop primitives the scripts use
+    import mission
+    import scheduler
+    import telemetry
+
+    def loop_iterator(function):
+        def wrapper(*args, **kwargs):
+            loop = _caller()
+            try:
+                for item in function(*args, **kwargs):
+                    profiler.tick(loop)
+                    yield item
+            finally:
+                profiler.leave()
+
+        return wrapper
+
+    telemetry.Telemetry.frames = loop_iterator(telemetry.Telemetry.frames)
+    scheduler.FixedRate.__iter__ = loop_iterator(scheduler.FixedRate.__iter__)
+
+    every = mission.Mission.every
+
+    def mission_every(self, name, interval, fn):
+        def job():
+            profiler.tick(f"job '{name}'")
+            try:
+                return fn()
+            finally:
+                profiler.leave()
+
+        return every(self, name, interval, job)
+
+    mission.Mission.every = mission_every
+
+    sleep = time.sleep
+
+    def profiled_sleep(seconds):
+        # Sleeps inside the loop primitives are already counted by them
+        if os.path.basename(sys._getframe(1).f_code.co_filename) not in ("telemetry.py", "scheduler.py"):
+            profiler.tick(f"sleep at {_caller()}")
+        sleep(seconds)
+
+    time.sleep = profiled_sleep
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count and time the RPCs a script makes")
+    parser.add_argument("script", help="Script to run, e.g. aircraft_land.py")
+    parser.add_argument("--top", type=int, default=20, help="Number of hot paths to show")
+    args, script_args = parser.parse_known_args()
+
+    profiler = RPCProfiler()
+    connect = krpc.connect
+    krpc.connect = lambda *a, **kw: profiler.instrument(connect(*a, **kw))
+    _profile_loops(profiler)
+
+    sys.argv = [args.script] + script_args
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(profiler.report(args.top))
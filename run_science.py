@@ -1,108 +1,330 @@
 import krpc
+import threading
 import time
+from krpc.error import RPCError
 from loguru import logger
-from typing import Set
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-conn = krpc.connect(name="Run science experiments to gather science")
-vessel = conn.space_center.active_vessel
+from flight_log import FlightLog
+from helper import batch_call, batch_get
+from science_planner import RESET, RUN, ExperimentState, ScienceParameters, SciencePlanner
+from streams import StreamRegistry, registry_for
 
-# Create connection streams, about 20 times faster than just calling them directly
-vessel_experiments = conn.add_stream(getattr, vessel.parts, "experiments")
 
+class CachedSubject:
+    def __init__(
+        self,
+        streams: StreamRegistry,
+        subject,
+        rate: Optional[float] = None,
+        on_change: Optional[Callable[[int], None]] = None,
+    ):
+        self.subject = subject
+        self.key: int = subject._object_id
+        # Static, read once
+        self.science_cap: float = subject.science_cap
+        self._title: Optional[str] = None
+        # Volatile, streamed
+        self.scientific_value = streams.acquire(getattr, subject, "scientific_value", rate=rate)
+        self._callback = None
+        if on_change is not None:
+            self._callback = lambda value: on_change(self.key)
+            self.scientific_value.stream.add_callback(self._callback)
 
-class Science:
-    def __init__(self):
-        # How much science at least should be gathered if the experiment is run
-        self.min_science: float = 0.01
-        # self.min_science: float = 5
-        # How much percentage value the experiment has, e.g. if the experiment was already run 3 times, its probably gonna be under 0.1
-        self.min_scientific_value: float = 0.01
-        # Only automatically run experiments that can be rerun
-        self.run_non_rerunnable_science = False
-        # TODO Automatically transmit if we have enough electric charge to transmit data ?
-        self.transmit_science = True
-        self.min_transmit_science: float = 0.1
+    @property
+    def title(self) -> str:
+        # Only needed for logging, so only fetched when it is
+        if self._title is None:
+            self._title = self.subject.title
+        return self._title
+
+    def remove(self):
+        if self._callback is not None:
+            self.scientific_value.stream.remove_callback(self._callback)
+        self.scientific_value.release()
+
+
+class CachedExperiment:
+    # 'on_change' is called with the experiment's object id from the stream thread whenever one of its streamed
+    # values changes
+    def __init__(self, streams: StreamRegistry, experiment, on_change: Optional[Callable[[int], None]] = None):
+        self.experiment = experiment
+        self.key: int = experiment._object_id
+        # Static, read once
+        part = experiment.part
+        self.part_id: int = part._object_id
+        self.part_name: str = part.name
+        self.rerunnable: bool = experiment.rerunnable
+        # Volatile, streamed. Other jobs (e.g. the waypoint pilot) run and reset experiments too, so these are kept
+        # current. They rarely change and the server only sends changes, so they cost next to nothing.
+        self.has_data = streams.acquire(getattr, experiment, "has_data")
+        self.available = streams.acquire(getattr, experiment, "available")
+        self.inoperable = streams.acquire(getattr, experiment, "inoperable")
+        self.science_subject = streams.acquire(getattr, experiment, "science_subject")
+        # Collected data never changes, so its values are read once per data object
+        self._data: Dict[int, Tuple[float, float, float]] = {}
+        self._callback = None
+        if on_change is not None:
+            self._callback = lambda value: on_change(self.key)
+            for stream in self._streams():
+                stream.stream.add_callback(self._callback)
+
+    def _streams(self):
+        return self.has_data, self.available, self.inoperable, self.science_subject
+
+    def remove(self):
+        for stream in self._streams():
+            if self._callback is not None:
+                stream.stream.remove_callback(self._callback)
+            stream.release()
+
+
+class ExperimentCache:
+    # Keeps the facts Science.run needs about each experiment, so a pass over the experiments costs no round trips
+    # unless an experiment is acted on. Entries are rebuilt when the vessel stages and added or dropped when the
+    # list of experiments changes. 'rate' is how often the subjects' values are needed in Hz.
+    # 'on_change' and 'on_subject_change' are called with the object id of an experiment or subject when its
+    # streamed values change, and of an experiment when its entry is created.
+    def __init__(
+        self,
+        streams: StreamRegistry,
+        vessel,
+        rate: Optional[float] = None,
+        on_change: Optional[Callable[[int], None]] = None,
+        on_subject_change: Optional[Callable[[int], None]] = None,
+    ):
+        self.streams = streams
+        self.rate = rate
+        self.on_change = on_change
+        self.on_subject_change = on_subject_change
+        self.vessel_experiments = streams.acquire(getattr, vessel.parts, "experiments")
+        self.vessel_current_stage = streams.acquire(getattr, vessel.control, "current_stage")
+        self._experiments: Dict[int, CachedExperiment] = {}
+        self._subjects: Dict[int, CachedSubject] = {}
+        self._stage: Optional[int] = None
 
+    def experiments(self) -> List[CachedExperiment]:
+        stage = self.vessel_current_stage()
+        if stage != self._stage:
+            self.invalidate()
+            self._stage = stage
+        experiments = self.vessel_experiments()
+        ids = [experiment._object_id for experiment in experiments]
+        for object_id in set(self._experiments) - set(ids):
+            self._experiments.pop(object_id).remove()
+        for object_id, experiment in zip(ids, experiments):
+            if object_id not in self._experiments:
+                self._experiments[object_id] = CachedExperiment(self.streams, experiment, self.on_change)
+                if self.on_change is not None:
+                    self.on_change(object_id)
+        return [self._experiments[object_id] for object_id in ids]
+
+    def subject(self, subject) -> Optional[CachedSubject]:
+        if subject is None:
+            return None
+        if subject._object_id not in self._subjects:
+            self._subjects[subject._object_id] = CachedSubject(self.streams, subject, self.rate, self.on_subject_change)
+        return self._subjects[subject._object_id]
+
+    def release_subject(self, key: int):
+        # Remove the streams of a subject no experiment is in anymore, e.g. one of a biome the vessel left
+        subject = self._subjects.pop(key, None)
+        if subject is not None:
+            subject.remove()
+
+    def data(self, experiments: List[CachedExperiment]) -> Dict[int, Tuple[Tuple[float, float, float], ...]]:
+        # (science value, data amount, transmit value) of the data stored in each experiment, by experiment object
+        # id. Two requests however many experiments there are: one for the lists and one for the new data's values.
+        conn = self.streams.conn
+        lists = batch_get(((cached.experiment, "data") for cached in experiments), client=conn)
+        new = [d for cached, data in zip(experiments, lists) for d in data if d._object_id not in cached._data]
+        fields = ("science_value", "data_amount", "transmit_value")
+        values = batch_get(((d, name) for d in new for name in fields), client=conn)
+        read = {d._object_id: tuple(values[i * len(fields) : (i + 1) * len(fields)]) for i, d in enumerate(new)}
+        result = {}
+        for cached, data in zip(experiments, lists):
+            cached._data = {d._object_id: cached._data.get(d._object_id) or read[d._object_id] for d in data}
+            result[cached.key] = tuple(cached._data.values())
+        return result
+
+    def invalidate(self):
+        for entry in list(self._experiments.values()) + list(self._subjects.values()):
+            entry.remove()
+        self._experiments.clear()
+        self._subjects.clear()
+
+    def close(self):
+        self.invalidate()
+        self.vessel_experiments.release()
+        self.vessel_current_stage.release()
+
+
+class Science:
+    # Runs, resets and transmits the experiments of 'vessel'. Call run() often, it only acts every run_interval seconds.
+    # Experiments are scored by SciencePlanner. Their streams report changes, and only the experiments that changed
+    # are scored again, so a pass where nothing changed makes no RPCs. The actions of a pass go out in one request.
+    # Usage:
+    #   science = Science(conn, vessel)
+    #   while 1:
+    #       science.run()
+    #       time.sleep(0.1)
+    def __init__(self, conn, vessel, parameters: ScienceParameters = ScienceParameters()):
+        self.conn = conn
+        self.parameters = parameters
         # TODO If there is a scientist within the crew, it can reset non-rerunnable experiments
         self.has_scientist_in_crew = False
 
-        self.run_interval = 5
+        self.run_interval = 1
         self.last_run = time.time()
 
+        # Create connection streams, about 20 times faster than just calling them directly.
+        # They are only read once per run, so they need not update much more often than that.
+        self.rate = 2 / self.run_interval
+        # An experiment that was acted on is left alone this long, so its streams can catch up with the action
+        self.settle_time = 2 / self.rate
+
+        self.planner = SciencePlanner(parameters)
+        self._lock = threading.Lock()
+        # Experiments to score again, and for those acted on, when that may happen
+        self._changed: Set[int] = set()
+        self._settled_at: Dict[int, float] = {}
+        # Subject each experiment was scored with
+        self._subject_of: Dict[int, Optional[CachedSubject]] = {}
+        self.log = FlightLog(every=30)
+
+        streams = registry_for(conn)
+        self.cache = ExperimentCache(streams, vessel, self.rate, self._on_change, self._on_subject_change)
+        resources = vessel.resources
+        self.electric_charge = streams.acquire(resources.amount, "ElectricCharge")
+        self.electric_charge_max = streams.acquire(resources.max, "ElectricCharge")
+        self.demand = streams.demand(
+            self.rate,
+            self.cache.vessel_experiments,
+            self.cache.vessel_current_stage,
+            self.electric_charge,
+            self.electric_charge_max,
+        )
+
+    def _on_change(self, key: int):
+        # Called from the stream thread
+        with self._lock:
+            self._changed.add(key)
+
+    def _on_subject_change(self, subject_key: int):
+        # Called from the stream thread
+        with self._lock:
+            self._changed.update(
+                key for key, subject in self._subject_of.items() if subject is not None and subject.key == subject_key
+            )
+
+    def _rescore(self, now: float) -> Dict[int, CachedExperiment]:
+        # Score the experiments that changed since the last pass again, returns every experiment by object id
+        experiments = {cached.key: cached for cached in self.cache.experiments()}
+        # Subjects experiments were in before, released below if none is in them anymore
+        previous: Set[int] = set()
+        with self._lock:
+            for key in set(self._subject_of) - set(experiments):
+                subject = self._subject_of.pop(key)
+                if subject is not None:
+                    previous.add(subject.key)
+                self.planner.remove(key)
+            changed = [
+                experiments[key] for key in self._changed if key in experiments and self._settled_at.get(key, 0) <= now
+            ]
+            self._changed = {key for key in self._changed if key in experiments} - {cached.key for cached in changed}
+        if not changed:
+            self._release_subjects(previous)
+            return experiments
+
+        data = self.cache.data([cached for cached in changed if cached.has_data()])
+        for cached in changed:
+            self._settled_at.pop(cached.key, None)
+            subject = self.cache.subject(cached.science_subject())
+            scientific_value = science = 0.0
+            if subject is not None:
+                # A value between 0 and 1
+                scientific_value = subject.scientific_value()
+                # Science that can be obtained if ran
+                science = scientific_value * subject.science_cap
+            with self._lock:
+                before = self._subject_of.get(cached.key)
+                if before is not None and before is not subject:
+                    previous.add(before.key)
+                self._subject_of[cached.key] = subject
+            state = ExperimentState(
+                part_name=cached.part_name,
+                rerunnable=cached.rerunnable,
+                usable=cached.available() and not cached.inoperable(),
+                science=science,
+                scientific_value=scientific_value,
+                has_data=cached.key in data,
+                data=data.get(cached.key, ()),
+            )
+            self.planner.update(cached.key, state)
+        self._release_subjects(previous)
+        return experiments
+
+    def _release_subjects(self, keys: Set[int]):
+        with self._lock:
+            keys = keys - {subject.key for subject in self._subject_of.values() if subject is not None}
+        for key in keys:
+            self.cache.release_subject(key)
+
     def run(self):
         if time.time() - self.last_run < self.run_interval:
             return
-        self.last_run = time.time()
+        now = self.last_run = time.time()
 
-        names_run: Set[str] = set()
-        experiments = vessel_experiments()
-        for i, experiment in enumerate(experiments):
-            name: str = experiment.part.name
-            if experiment.inoperable or not experiment.available:
-                continue
-            if name in names_run:
-                continue
-
-            scientific_value = science = 0
-            if experiment.science_subject is not None:
-                # A value between 0 and 1
-                scientific_value: float = experiment.science_subject.scientific_value
-                # How much science can be gathered total?
-                science_cap: float = experiment.science_subject.science_cap
-                # Science that can be obtained if ran
-                science: float = scientific_value * science_cap
-
-            # Currently stored science
-            current_science_value: float = 0 if not experiment.has_data or not experiment.data else experiment.data[
-                0
-            ].science_value
-
-            if (
-                not experiment.has_data
-                and current_science_value == 0
-                and (self.run_non_rerunnable_science or experiment.rerunnable)
-            ):
-                if science >= self.min_science and scientific_value > self.min_scientific_value:
-                    logger.info(
-                        f"{i}: Running experiment on part: {experiment.part.name} to obtain {science:.2f} science ({scientific_value:.2f} scientific value), experiment: {experiment.science_subject.title}"
-                    )
-                    experiment.run()
-                    names_run.add(name)
-
-            elif experiment.has_data and experiment.rerunnable and current_science_value < science:
-                if science >= self.min_science and scientific_value > self.min_scientific_value:
-                    experiment.reset()
-                    # time.sleep(0.1)
-                    logger.info(
-                        f"{i}: Resetting experiment on part: {experiment.part.name} to obtain {science:.2f} science ({scientific_value:.2f} scientific value) and discarding old value of {current_science_value:.2f} science"
-                    )
-                    # experiment.run()
-                    names_run.add(name)
-
-            # for experiment in experiments:
-            elif experiment.has_data and experiment.data and self.transmit_science:
-                data = experiment.data[0]
-                transmit_science = data.data_amount * data.transmit_value
-                if transmit_science > self.min_transmit_science and vessel.resources.amount(
-                    "ElectricCharge"
-                ) * 0.99 > vessel.resources.max("ElectricCharge"):
-                    logger.info(
-                        f"Transmitting science on part {experiment.part.name} for transmit science total of {transmit_science:.02f}"
-                    )
-                    # TODO only transmit if electric charge is >99%, or check if we have enough electric charge to transmit
-                    experiment.transmit()
-                    # Wait some time before running more experiments
-                    # self.last_run = time.time() + 20
-                    return
+        experiments = self._rescore(now)
+        batch = self.planner.plan(self.electric_charge(), self.electric_charge_max(), now)
+        for opportunity in batch:
+            if opportunity.action == RUN:
+                logger.info(
+                    f"Running experiment on part: {opportunity.part_name} to obtain {opportunity.science:.2f} science, experiment: {self._subject_of[opportunity.key].title}"
+                )
+            elif opportunity.action == RESET:
+                logger.info(
+                    f"Resetting experiment on part: {opportunity.part_name} to obtain {opportunity.science:.2f} more science"
+                )
+            else:
+                logger.info(
+                    f"Transmitting science on part {opportunity.part_name} for transmit science total of {opportunity.science:.02f}"
+                )
+            self._settled_at[opportunity.key] = now + self.settle_time
+        with self._lock:
+            self._changed.update(opportunity.key for opportunity in batch)
+        try:
+            batch_call([getattr(experiments[o.key].experiment, o.action) for o in batch], client=self.conn)
+        except RPCError as e:
+            logger.warning(f"Not every science action succeeded: {e}")
+
+        waiting = self.planner.waiting
+        if waiting is not None:
+            self.log.info(
+                "Waiting for electric charge to transmit {:.02f} science on part {}, needs {:.0f}",
+                waiting.science,
+                waiting.part_name,
+                waiting.cost,
+                key="waiting",
+            )
+
+    def close(self):
+        self.demand.end()
+        self.cache.close()
+        self.electric_charge.release()
+        self.electric_charge_max.release()
 
 
 if __name__ == "__main__":
+    conn = krpc.connect(name="Run science experiments to gather science")
+    vessel = conn.space_center.active_vessel
+
     # while vessel.situation.name in {"pre_launch"}:
     #     time.sleep(0.1)
 
     logger.info(f"Gathering science...")
 
-    science = Science()
+    science = Science(conn, vessel)
     while 1:
         time.sleep(0.1)
         science.run()
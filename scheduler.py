@@ -0,0 +1,53 @@
+import time
+from typing import Callable, Iterator, NamedTuple
+
+
+class Tick(NamedTuple):
+    # Number of the tick, counting the skipped ones, so index * interval is the scheduled time since the start
+    index: int
+    # Clock reading at the start of the tick
+    time: float
+    # Clock time since the previous tick, use it for derivatives instead of the nominal interval
+    dt: float
+    # Deadlines missed right before this tick because the previous one overran
+    skipped: int
+
+
+class FixedRate:
+    # Runs a loop at a fixed rate against absolute deadlines, so time spent in the loop body and sleep inaccuracy
+    # never add up to a drift. If the body overruns one or more periods, the missed ticks are skipped instead of
+    # run back to back to catch up.
+    # The deadlines are kept on the monotonic clock, the dt reported to the loop is measured with 'clock', e.g. the
+    # game's UT stream, so derivatives stay right under time warp or when the game stutters.
+    # Usage:
+    #   for tick in FixedRate(0.1, clock=conn.add_stream(getattr, conn.space_center, "ut")):
+    #       acceleration = (speed() - old_speed) / tick.dt
+    def __init__(self, interval: float, clock: Callable[[], float] = time.perf_counter):
+        self.interval = interval
+        self.clock = clock
+        self.ticks = 0
+        self.skipped = 0
+
+    def __iter__(self) -> Iterator[Tick]:
+        start = time.perf_counter()
+        previous = self.clock()
+        index = 0
+        skipped = 0
+        while True:
+            index += 1
+            delay = start + index * self.interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            now = self.clock()
+            self.ticks += 1
+            yield Tick(index, now, now - previous, skipped)
+            previous = now
+
+            # Skip the deadlines that already passed while the body ran
+            late = time.perf_counter() - (start + index * self.interval)
+            skipped = int(late // self.interval)
+            if skipped > 0:
+                index += skipped
+                self.skipped += skipped
+            else:
+                skipped = 0
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+RUN = "run"
+RESET = "reset"
+TRANSMIT = "transmit"
+
+
+class ScienceParameters(NamedTuple):
+    # How much science at least should be gathered if the experiment is run
+    min_science: float = 0.01
+    # How much percentage value the experiment has, e.g. if the experiment was already run 3 times, its probably gonna be under 0.1
+    min_scientific_value: float = 0.01
+    # Only automatically run experiments that can be rerun
+    run_non_rerunnable_science: bool = False
+    transmit_science: bool = True
+    # Science at least gained by transmitting the data of an experiment
+    min_transmit_science: float = 0.1
+    # Electric charge per Mit of transmitted data and Mit sent per second. A Communotron 16 uses 3 per Mit at about
+    # 3.3 Mit/s, the stand-in server charges 6.
+    transmit_cost: float = 6.0
+    transmit_rate: float = 3.3
+    # Fraction of the electric charge capacity that transmissions leave alone
+    reserve_electric_charge: float = 0.2
+
+
+class ExperimentState(NamedTuple):
+    part_name: str
+    rerunnable: bool
+    # Available and not inoperable
+    usable: bool
+    # Science running the experiment would give now, scientific value * science cap of its current subject
+    science: float
+    scientific_value: float
+    has_data: bool
+    # (science value, data amount, transmit value) of each stored data
+    data: Tuple[Tuple[float, float, float], ...] = ()
+
+
+class Opportunity(NamedTuple):
+    key: int
+    part_name: str
+    action: str
+    # Science the action gains
+    science: float
+    # Electric charge it costs
+    cost: float
+    # What it is ranked by, the science plus what it makes possible afterwards
+    value: float
+
+
+def score_experiment(p: ScienceParameters, key: int, s: ExperimentState) -> Optional[Opportunity]:
+    # The best action on one experiment, None if there is nothing worth doing
+    if not s.usable:
+        return None
+    worth_running = s.science >= p.min_science and s.scientific_value > p.min_scientific_value
+    if not s.has_data:
+        if worth_running and (p.run_non_rerunnable_science or s.rerunnable):
+            return Opportunity(key, s.part_name, RUN, s.science, 0.0, s.science)
+        return None
+
+    if p.transmit_science and s.data:
+        science = sum(value * transmit_value for value, _, transmit_value in s.data)
+        if science > p.min_transmit_science:
+            # Sending the data frees a rerunnable experiment to gather what the subject has left
+            rerun = max(0.0, s.science - science) if s.rerunnable and worth_running else 0.0
+            cost = sum(amount for _, amount, _ in s.data) * p.transmit_cost
+            return Opportunity(key, s.part_name, TRANSMIT, science, cost, science + rerun)
+
+    stored = sum(value for value, _, _ in s.data)
+    if s.rerunnable and worth_running and stored < s.science:
+        # Discards the stored data so the experiment can be run for more
+        return Opportunity(key, s.part_name, RESET, s.science - stored, 0.0, s.science - stored)
+    return None
+
+
+class SciencePlanner:
+    # Keeps the best action of every experiment in a priority queue. update() scores one experiment again, so a
+    # caller only passes the experiments that changed. plan() takes the actions to do now off the queue:
+    # - runs and resets, they cost nothing, the most science first and one per part name
+    # - then transmissions in order of value per electric charge, as long as the predicted electric charge covers
+    #   them. The electric charge still to be drawn by transmissions the antenna has not finished is predicted
+    #   from their data amounts, since the game only draws it while sending.
+    # Usage:
+    #   planner = SciencePlanner(ScienceParameters())
+    #   planner.update(experiment_id, ExperimentState(...))
+    #   for opportunity in planner.plan(electric_charge, electric_charge_max, time.time()):
+    #       ...
+    def __init__(self, p: ScienceParameters = ScienceParameters()):
+        self.p = p
+        # (priority, order, opportunity), entries that are no longer current are dropped when popped
+        self._queue: List[Tuple[Tuple[int, float], int, Opportunity]] = []
+        self._current: Dict[int, Opportunity] = {}
+        self._order = itertools.count()
+        # When the antenna is done sending everything transmitted so far
+        self.transmitting_until = 0.0
+        # The transmission the last plan() had to leave for lack of electric charge
+        self.waiting: Optional[Opportunity] = None
+
+    def __len__(self):
+        return len(self._current)
+
+    def update(self, key: int, state: ExperimentState):
+        opportunity = score_experiment(self.p, key, state)
+        if opportunity is None:
+            self._current.pop(key, None)
+        elif opportunity != self._current.get(key):
+            self._current[key] = opportunity
+            self._push(opportunity)
+
+    def remove(self, key: int):
+        self._current.pop(key, None)
+
+    def _push(self, opportunity: Opportunity):
+        if opportunity.cost > 0:
+            priority = (1, -opportunity.value / opportunity.cost)
+        else:
+            priority = (0, -opportunity.value)
+        heapq.heappush(self._queue, (priority, next(self._order), opportunity))
+
+    def pending_charge(self, now: float) -> float:
+        # Electric charge transmissions in progress will still draw
+        return max(0.0, self.transmitting_until - now) * self.p.transmit_rate * self.p.transmit_cost
+
+    def budget(self, electric_charge: float, electric_charge_max: float, now: float) -> float:
+        return electric_charge - self.pending_charge(now) - self.p.reserve_electric_charge * electric_charge_max
+
+    def plan(self, electric_charge: float, electric_charge_max: float, now: float) -> List[Opportunity]:
+        # The actions to take now. They leave the queue, update() puts the experiments back once they changed.
+        budget = self.budget(electric_charge, electric_charge_max, now)
+        batch: List[Opportunity] = []
+        skipped = []
+        names = set()
+        self.waiting = None
+        while self._queue:
+            entry = self._queue[0]
+            opportunity = entry[2]
+            if self._current.get(opportunity.key) != opportunity:
+                heapq.heappop(self._queue)
+                continue
+            if opportunity.action == TRANSMIT:
+                if opportunity.cost > (1 - self.p.reserve_electric_charge) * electric_charge_max:
+                    # Never fits, the data stays on board
+                    skipped.append(heapq.heappop(self._queue))
+                    continue
+                if opportunity.cost > budget:
+                    # Later ones are worth less per charge, so wait for this one instead of sending those first
+                    self.waiting = opportunity
+                    break
+                budget -= opportunity.cost
+                start = max(now, self.transmitting_until)
+                self.transmitting_until = start + opportunity.cost / self.p.transmit_cost / self.p.transmit_rate
+            elif opportunity.part_name in names:
+                # Experiments of parts with the same name share their subjects, run the others once that one is done
+                skipped.append(heapq.heappop(self._queue))
+                continue
+            else:
+                names.add(opportunity.part_name)
+            heapq.heappop(self._queue)
+            del self._current[opportunity.key]
+            batch.append(opportunity)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return batch
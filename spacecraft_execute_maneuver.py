@@ -2,7 +2,13 @@ import time
 import math
 import krpc
 from loguru import logger
+from burn_planner import plan_burn, stage_table
+from handles import handles_for
 from helper import stage_if_low_on_fuel
+from streams import registry_for
+from telemetry import Telemetry
+from tick_timing import TickTimer
+from recorder import Recorder
 
 conn = krpc.connect(name="Create orbit")
 vessel = conn.space_center.active_vessel
@@ -28,20 +34,25 @@ while not vessel.specific_impulse or not vessel.available_thrust:
     time.sleep(0.5)
 
 
-vessel.auto_pilot.reference_frame = n.reference_frame
+handles = handles_for(conn)
+node_frame = handles.reference_frame(n)
+vessel.auto_pilot.reference_frame = node_frame
 vessel.auto_pilot.target_direction = (0, 1, 0)
 vessel.auto_pilot.engage()
 
-# TODO what to do when remaining fuel is not enough? burn time is wrongly calculated then
-delta_v = n.delta_v
-F = vessel.available_thrust
-Isp = vessel.specific_impulse * 9.82
-m0 = vessel.mass
-m1 = m0 / math.exp(delta_v / Isp)
-flow_rate = F / Isp
-burn_time = (m0 - m1) / flow_rate
+# Burn time over as many stages as the maneuver takes, from a table of the stages read once
+plan = plan_burn(stage_table(vessel, conn), n.delta_v)
+logger.info(
+    f"Burning {plan.delta_v:.1f} m/s for {plan.burn_time:.1f} s over stage(s) {', '.join(str(b.stage) for b in plan.stages)}, starting {plan.start_offset:.1f} s before the node"
+)
+if plan.missing_delta_v > 0:
+    logger.warning(f"Not enough fuel for the maneuver, {plan.missing_delta_v:.1f} m/s of delta v will be missing")
 
-burn_start_time = lambda: n.time_to - burn_time / 2
+# The waiting loops below read streams instead of making calls
+streams = registry_for(conn)
+time_to = streams.acquire(getattr, n, "time_to", rate=20)
+direction = streams.acquire(getattr, handles.flight(vessel, node_frame), "direction", rate=20)
+burn_start_time = lambda: time_to() - plan.start_offset
 
 # Warp to 20 seconds before burn
 logger.info(f"Warping to node ({warp_to_buffer_seconds} seconds before maneuver starts)")
@@ -50,7 +61,7 @@ conn.space_center.warp_to(warp_time)
 
 # Waiting till burn start time
 while burn_start_time() > 1.2:
-    d = vessel.flight(n.reference_frame).direction
+    d = direction()
     a = (0, 1, 0)
     spacecraft_facing_direction: bool = all(abs(d[i] - a[i]) < tolerance_tuple[i] for i in range(3))
     # burn_start_time = n.time_to - burn_time/2
@@ -60,35 +71,39 @@ while burn_start_time() > 1.2:
 while burn_start_time() > 0.1:
     time.sleep(0.05)
 
-node_remaining_delta_v = conn.add_stream(getattr, n, "remaining_delta_v")
+telemetry = Telemetry(conn, {"remaining_delta_v": (n, "remaining_delta_v")}, rate=100)
+recorder = Recorder("recordings/spacecraft_execute_maneuver", telemetry)
 
-flight = vessel.flight(n.reference_frame)
-d = flight.direction
+d = direction()
 a = (0, 1, 0)
 spacecraft_facing_direction: bool = all(abs(d[i] - a[i]) < tolerance_tuple[i] for i in range(3))
 
 last_node_remaining_delta_v = math.inf
 fine_tuning = False
-tolerance_timer = 1
-step_time = 0.01
+# Seconds after the burn start during which remaining delta v may still go up
+tolerance_time = 1
 
 if spacecraft_facing_direction:
     logger.info(f"Starting maneuver burn.")
+    burn_start = time.perf_counter()
 
-    while 1:
-        remaining_delta_v = node_remaining_delta_v()
-        tolerance_timer -= step_time
+    # Run once per fresh telemetry frame, at most 100 times per second
+    timing = TickTimer("maneuver burn", interval=1 / 100, conn=conn)
+    for t in timing.track(telemetry.frames(max_rate=100)):
+        remaining_delta_v = t.remaining_delta_v
 
-        if remaining_delta_v > last_node_remaining_delta_v and tolerance_timer < 0:
+        if remaining_delta_v > last_node_remaining_delta_v and time.perf_counter() - burn_start > tolerance_time:
             logger.warning(f"Something went wrong: remaining burn delta v went up! Ending program. Remaining delta v: {remaining_delta_v}")
             n.remove()
             break
 
         elif remaining_delta_v > burn_till_remaining_delta_v:
             vessel.control.throttle = 1
+            recorder.command("throttle", 1)
 
         elif remaining_delta_v > 0.0001:
             vessel.control.throttle = remaining_delta_v / burn_till_remaining_delta_v
+            recorder.command("throttle", remaining_delta_v / burn_till_remaining_delta_v)
             if not fine_tuning:
                 logger.info(f"Maneuver almost done. Fine tuning.")
                 fine_tuning = True
@@ -100,12 +115,16 @@ if spacecraft_facing_direction:
 
         stage_if_low_on_fuel()
         last_node_remaining_delta_v = remaining_delta_v
-        time.sleep(step_time)
+    logger.info(f"Tick timing:\n{timing.report()}")
 else:
     logger.info(
         f"Spacecraft was not facing in the correct direction. Direction: {d}, tolerance tuple: {tolerance_tuple}"
     )
 
+recorder.close()
+telemetry.close()
+time_to.release()
+direction.release()
 
 vessel.control.throttle = 0
 vessel.auto_pilot.disengage()
@@ -1,7 +1,14 @@
 import time
 import krpc
 from loguru import logger
+from ascent import AscentParameters, ascent_control, ascent_done
 from helper import stage_if_low_on_fuel
+from control_buffer import ControlBuffer
+from telemetry import Telemetry
+from tick_timing import TickTimer
+from recorder import Recorder
+from flight_log import FlightLog
+from handles import handles_for
 
 conn = krpc.connect(name="Sub-orbital flight")
 vessel = conn.space_center.active_vessel
@@ -14,11 +21,31 @@ min_altitude_before_program_stops = 35_000
 # Throttle to full until the current stage is out of fuel
 boost_until_out_of_fuel = True
 
+# Throttle change per frame while facing the target attitude and while not
+throttle_up_step = 0.05
+throttle_down_step = 0.10
+
 # Degree tolerance
 pitch_tolerance = 20
 heading_tolerance = 10
+
+# Seconds between the ascent diagnostics in the log, every frame's are kept in recordings/spacecraft_lift_off/log.bin
+log_interval = 1
 # END OF CONFIG
 
+# The controller is shared with ascent_sim.py, parameters tuned there can be copied to the config above
+ascent = AscentParameters(
+    target_apoapsis_altitude=target_apoapasis_altitude,
+    gravity_turn_start_altitude=gravity_turn_start_altitude,
+    gravity_turn_end_altitude=gravity_turn_end_altitude,
+    min_altitude_before_program_stops=min_altitude_before_program_stops,
+    boost_until_out_of_fuel=boost_until_out_of_fuel,
+    throttle_up_step=throttle_up_step,
+    throttle_down_step=throttle_down_step,
+    pitch_tolerance=pitch_tolerance,
+    heading_tolerance=heading_tolerance,
+)
+
 # while vessel.situation.name not in {"pre_launch"}:
 #     logger.info(f"Vessel not in 'pre_launch' phase!")
 #     time.sleep(3)
@@ -34,75 +61,81 @@ vessel.auto_pilot.target_roll = 0
 vessel.auto_pilot.engage()
 
 # Create connection streams, about 20 times faster than just calling them directly
-vessel_surface_altitude = conn.add_stream(getattr, vessel.flight(), "surface_altitude")
-vessel_apoapsis_altitude = conn.add_stream(getattr, vessel.orbit, "apoapsis_altitude")
-vessel_pitch = conn.add_stream(getattr, vessel.flight(), "pitch")
-vessel_heading = conn.add_stream(getattr, vessel.flight(), "heading")
-
-if vessel_surface_altitude() < 1_000:
+handles = handles_for(conn)
+flight = handles.flight(vessel)
+telemetry = Telemetry(
+    conn,
+    {
+        "surface_altitude": (flight, "surface_altitude"),
+        "apoapsis_altitude": (handles.orbit(vessel), "apoapsis_altitude"),
+        "pitch": (flight, "pitch"),
+        "heading": (flight, "heading"),
+        "throttle": (vessel.control, "throttle"),
+    },
+    # The ascent loop runs up to 100 times per second
+    rate=100,
+)
+recorder = Recorder("recordings/spacecraft_lift_off", telemetry)
+log = FlightLog("recordings/spacecraft_lift_off", every=log_interval)
+# Control and autopilot writes of a frame, sent together and only if they changed
+commands = ControlBuffer(conn, vessel)
+
+if telemetry.snapshot().surface_altitude < 1_000:
     vessel.control.throttle = 1
 
 time.sleep(1)
 apoapsis_reached_once = False
 
-while 1:
-    time.sleep(0.01)
-
-    apoapsis_altitude = vessel_apoapsis_altitude()
+# Run once per fresh telemetry frame, at most 100 times per second
+timing = TickTimer("ascent", interval=1 / 100, conn=conn)
+for t in timing.track(telemetry.frames(max_rate=100)):
+    apoapsis_altitude = t.apoapsis_altitude
     if apoapsis_altitude < target_apoapasis_altitude:
         stage_if_low_on_fuel()
 
-    # Start Gravity turn
-    surface_altitude = vessel_surface_altitude()
-
-    target_pitch, target_heading = vessel.auto_pilot.target_pitch, vessel.auto_pilot.target_heading
-
-    pitch_tolerance_temp = pitch_tolerance
-    if boost_until_out_of_fuel and (
-        surface_altitude > 20_000 and apoapsis_altitude > target_apoapasis_altitude or apoapsis_reached_once
-    ):
-        # logger.info(f"Going for 0 pitch, altitude {surface_altitude}, apoapsis {apoapsis_altitude}")
-        apoapsis_reached_once = True
-        target_pitch = 0
-        if apoapsis_altitude < target_apoapasis_altitude:
-            pitch_tolerance_temp = 30
-
-    elif surface_altitude > gravity_turn_start_altitude:
-        frac = (surface_altitude - gravity_turn_start_altitude) / (
-            gravity_turn_end_altitude - gravity_turn_start_altitude
-        )
-        target_pitch = 90 - min(90, frac * 90)
-        # logger.info(f"Altitude {mean_altitude}, aiming for pitch: {target_pitch}")
-
-    # If spacecraft is not facing the target pitch and heading: throttle down
-    current_pitch = vessel_pitch()
-    current_heading = vessel_heading()
-    vessel_facing_target = (
-        abs(target_pitch - current_pitch) < pitch_tolerance_temp
-        and abs(target_heading - current_heading) < heading_tolerance
+    # Gravity turn, pitch down once the apoapsis is high enough, throttle down while not facing the target
+    surface_altitude = t.surface_altitude
+    old_throttle = commands.control.throttle
+    target_pitch, throttle, reached = ascent_control(
+        ascent,
+        surface_altitude,
+        apoapsis_altitude,
+        t.pitch,
+        t.heading,
+        commands.auto_pilot.target_pitch,
+        commands.auto_pilot.target_heading,
+        old_throttle,
+        apoapsis_reached_once,
     )
-    # Only if pitch is <90 can the heading be facing the correct way
-    if not vessel_facing_target and target_pitch < 90:
-        vessel.control.throttle -= 0.10
-        # logger.info(
-        #     f"Vessel not facing the right way, lowering throttle:\nPitch: {current_pitch} / {target_pitch}, Heading: {current_heading} / {target_heading}"
-        # )
-    else:
-        vessel.control.throttle += 0.05
-
-    vessel.auto_pilot.target_pitch = target_pitch
-
-    if boost_until_out_of_fuel and stage_if_low_on_fuel(do_stage=False) > 0.1:
-        pass
+    target_pitch, throttle = float(target_pitch), float(throttle)
+    if reached and not apoapsis_reached_once:
+        logger.info(f"Going for 0 pitch, altitude {surface_altitude:.0f}, apoapsis {apoapsis_altitude:.0f}")
+    apoapsis_reached_once = bool(reached)
+    log.info("Altitude {:.0f}, apoapsis {:.0f}, aiming for pitch {:.1f}", surface_altitude, apoapsis_altitude, target_pitch)
+    if throttle < old_throttle:
+        log.info(
+            "Vessel not facing the right way, lowering throttle: pitch {:.1f} / {:.1f}, heading {:.1f} / {:.1f}",
+            t.pitch,
+            target_pitch,
+            t.heading,
+            commands.auto_pilot.target_heading,
+        )
+    commands.control.throttle = throttle
+    commands.auto_pilot.target_pitch = target_pitch
+    commands.flush()
+    recorder.command("target_pitch", target_pitch)
+
     # If apoapsis reached, end program
-    elif (
-        min_altitude_before_program_stops < vessel_surface_altitude() and target_apoapasis_altitude < apoapsis_altitude
-    ):
+    if ascent_done(ascent, surface_altitude, apoapsis_altitude, stage_if_low_on_fuel(do_stage=False)):
         logger.info(
-            f"Apoapsis of {apoapsis_altitude:.01f} and min altitude of {vessel_surface_altitude():.01f} reached. Ending program."
+            f"Apoapsis of {apoapsis_altitude:.01f} and min altitude of {surface_altitude:.01f} reached. Ending program."
         )
         break
 
+log.close()
+recorder.close()
+telemetry.close()
+logger.info(f"Tick timing:\n{timing.report()}")
 vessel.control.throttle = 0
 vessel.auto_pilot.disengage()
 vessel.control.sas = True
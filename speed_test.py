@@ -1,22 +1,150 @@
+"""
+RPC latency benchmark
+
+python speed_test.py --output results.json
+python speed_test.py --stand-in rocket --baseline results.json
+
+Every benchmark runs a number of iterations and reports latency percentiles in microseconds and throughput in calls
+per second. With --baseline, p50 and p95 are compared against an earlier run and the exit code is 1 if any of them
+got slower by more than --threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
 import time
+from typing import Callable, Dict, List, Tuple
+
 import krpc
+import numpy as np
 from loguru import logger
 
-conn = krpc.connect(name="Sub-orbital flight")
-vessel = conn.space_center.active_vessel
 
-altitude = conn.add_stream(getattr, vessel.flight(), "mean_altitude")
-vessel_current_stage = conn.add_stream(getattr, vessel.control, "current_stage")
+def benchmarks(conn) -> List[Tuple[str, Callable[[], object]]]:
+    vessel = conn.space_center.active_vessel
+    control = vessel.control
+    flight = vessel.flight()
+    current_stage = conn.add_stream(getattr, control, "current_stage")
+    # Write back the current value, so running the benchmark against the game does not change anything
+    throttle = control.throttle
+
+    def direct_call():
+        return control.current_stage
+
+    def stream_read():
+        return current_stage()
+
+    def stream_add_remove():
+        # No other stream of this call may exist, or removing it would also remove that one
+        conn.add_stream(getattr, flight, "mean_altitude").remove()
+
+    def control_write():
+        control.throttle = throttle
+
+    def flight_call():
+        return vessel.flight()
+
+    def experiments_call():
+        return vessel.parts.experiments
+
+    return [
+        ("direct_call", direct_call),
+        ("stream_read", stream_read),
+        ("stream_add_remove", stream_add_remove),
+        ("control_write", control_write),
+        ("flight_call", flight_call),
+        ("experiments_call", experiments_call),
+    ]
+
+
+def measure(fn: Callable[[], object], iterations: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(iterations, dtype=np.int64)
+    start = time.perf_counter_ns()
+    for i in range(iterations):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples[i] = time.perf_counter_ns() - t0
+    total = time.perf_counter_ns() - start
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99)) / 1_000
+    return {
+        "iterations": iterations,
+        "p50_us": float(p50),
+        "p95_us": float(p95),
+        "p99_us": float(p99),
+        "mean_us": float(samples.mean() / 1_000),
+        "max_us": float(samples.max() / 1_000),
+        "throughput_per_s": iterations / (total / 1e9),
+    }
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], threshold: float, min_difference_us: float = 5.0
+) -> List[str]:
+    # Benchmarks whose p50 or p95 got slower than the baseline by more than 'threshold' (0.2 is 20 %).
+    # Differences below 'min_difference_us' are noise, e.g. for stream reads that take well under a microsecond.
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ("p50_us", "p95_us"):
+            ratio = result[key] / baseline[name][key]
+            if ratio > 1 + threshold and result[key] - baseline[name][key] > min_difference_us:
+                regressions.append(f"{name} {key}: {baseline[name][key]:.1f} -> {result[key]:.1f} ({ratio:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark kRPC call latency")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--rpc-port", type=int, default=50000)
+    parser.add_argument("--stream-port", type=int, default=50001)
+    parser.add_argument("--stand-in", metavar="SCENARIO", help="Benchmark against an in-process stand-in server")
+    parser.add_argument("--iterations", type=int, default=1_000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--output", metavar="FILE", help="Write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    server = None
+    if args.stand_in:
+        from stand_in_server import StandInServer
 
-t0 = time.perf_counter_ns()
-# mean_altitude = altitude()
-stage = vessel_current_stage()
-t1 = time.perf_counter_ns()
+        server = StandInServer(args.stand_in, address=args.address, rpc_port=0, stream_port=0).start()
+        args.rpc_port, args.stream_port = server.rpc_port, server.stream_port
 
-logger.info(f"Time for Altitude from stream: {t1-t0}")
+    conn = krpc.connect(
+        name="Speed test", address=args.address, rpc_port=args.rpc_port, stream_port=args.stream_port
+    )
+    results = {}
+    for name, fn in benchmarks(conn):
+        results[name] = measure(fn, args.iterations, args.warmup)
+        r = results[name]
+        logger.info(
+            f"{name:<18} p50 {r['p50_us']:8.1f} us  p95 {r['p95_us']:8.1f} us  p99 {r['p99_us']:8.1f} us  {r['throughput_per_s']:8.0f}/s"
+        )
+    report = {
+        "server": "stand-in" if server else f"{args.address}:{args.rpc_port}",
+        "server_version": conn.krpc.get_status().version,
+        "python": platform.python_version(),
+        "time": time.time(),
+        "results": results,
+    }
+    conn.close()
+    if server:
+        server.stop()
 
-t0 = time.perf_counter_ns()
-# mean_altitude = vessel.flight().mean_altitude
-stage = vessel.control.current_stage
-t1 = time.perf_counter_ns()
-logger.info(f"Time for Altitude from idk: {t1-t0}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regressions against {args.baseline}")
@@ -0,0 +1,1720 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+import krpc.schema.KRPC_pb2 as KRPC
+from krpc.decoder import Decoder
+from krpc.encoder import Encoder
+from krpc.types import Types, ClassType, EnumerationType
+from krpc.utils import snake_case
+from loguru import logger
+
+from protocol import receive_message, send_message
+
+# Offline stand-in for the kRPC server running inside KSP.
+# It speaks the kRPC protobuf RPC and stream protocols and serves a simulated vessel, so the scripts in this
+# repository can be run unmodified (krpc.connect() with the default address and ports) without the game:
+#   python stand_in_server.py rocket      # then: python spacecraft_lift_off.py
+#   python stand_in_server.py aircraft    # then: python airplane_fly_to_waypoint.py
+#   python stand_in_server.py orbit       # then: python spacecraft_execute_maneuver.py
+
+# CONFIG
+address = "127.0.0.1"
+rpc_port = 50000
+stream_port = 50001
+# Game seconds that pass per wall clock second, > 1 runs the game faster than real time
+time_scale = 1.0
+# Physics updates per wall clock second, stream updates are sent after each one
+physics_rate = 50
+# Largest game time step of the integrator in seconds
+max_step = 0.02
+# Seed for the generated contract waypoints
+waypoint_seed = 0
+waypoint_count = 40
+
+# Kerbin
+KERBIN_RADIUS = 600_000
+KERBIN_GRAVITATIONAL_PARAMETER = 3.5316e12
+KERBIN_ROTATIONAL_SPEED = 2 * math.pi / 21_549.425
+KERBIN_SPHERE_OF_INFLUENCE = 84_159_286
+KERBIN_ATMOSPHERE_DEPTH = 70_000
+KERBIN_SCALE_HEIGHT = 5_600
+SEA_LEVEL_DENSITY = 1.225
+G0 = 9.81
+
+# Launchpad and runway of the space center
+LAUNCHPAD_POSITION = (-0.0972, -74.5577)
+RUNWAY_POSITION = (-0.0486, -74.7243)
+
+# Resource densities in kg per unit
+RESOURCE_DENSITY = {"LiquidFuel": 5.0, "Oxidizer": 5.0, "SolidFuel": 7.5, "MonoPropellant": 4.0, "ElectricCharge": 0.0}
+
+
+def atmospheric_density(altitude: float) -> float:
+    if altitude >= KERBIN_ATMOSPHERE_DEPTH:
+        return 0.0
+    return SEA_LEVEL_DENSITY * math.exp(-max(0.0, altitude) / KERBIN_SCALE_HEIGHT)
+
+
+def angle_difference(target: float, current: float) -> float:
+    # Signed shortest difference between two angles in degrees, in range [-180, 180)
+    return (target - current + 180) % 360 - 180
+
+
+class VesselSituation(Enum):
+    pre_launch = 0
+    orbiting = 1
+    sub_orbital = 2
+    escaping = 3
+    flying = 4
+    landed = 5
+    splashed = 6
+    docked = 7
+
+
+class SASMode(Enum):
+    stability_assist = 0
+    maneuver = 1
+    prograde = 2
+    retrograde = 3
+    normal = 4
+    anti_normal = 5
+    radial = 6
+    anti_radial = 7
+    target = 8
+
+
+ENUMERATIONS = {"VesselSituation": VesselSituation, "SASMode": SASMode}
+
+
+class RemoteObject:
+    # Base class of everything a client can hold a handle to. Subclasses are named after the kRPC class they stand
+    # in for and declare the procedures they serve:
+    #   rpc_properties: property name -> type, served as Class_get_Name
+    #   rpc_writable: property name -> type, served as Class_set_Name
+    #   rpc_methods: method name -> ([(parameter name, type, default), ...], return type), served as Class_Name
+    # Types are written as "double", "float", "int32", "bool", "string", "list(T)", "tuple(T, ...)", or the name of
+    # a class or enumeration.
+    rpc_properties: Dict[str, str] = {}
+    rpc_writable: Dict[str, str] = {}
+    rpc_methods: Dict[str, Tuple[list, Optional[str]]] = {}
+
+    def __init__(self, sim: "Simulation"):
+        self.sim = sim
+        self._object_id = sim.register(self)
+
+
+class ReferenceFrame(RemoteObject):
+    # kind is one of "body" (rotates with the body), "non_rotating", "vessel_surface" or "node"
+    def __init__(self, sim: "Simulation", kind: str, owner: object = None):
+        super().__init__(sim)
+        self.kind = kind
+        self.owner = owner
+
+
+class CelestialBody(RemoteObject):
+    rpc_properties = {
+        "Name": "string",
+        "EquatorialRadius": "double",
+        "GravitationalParameter": "double",
+        "SurfaceGravity": "double",
+        "RotationalSpeed": "double",
+        "SphereOfInfluence": "double",
+        "HasAtmosphere": "bool",
+        "AtmosphereDepth": "double",
+        "ReferenceFrame": "ReferenceFrame",
+        "NonRotatingReferenceFrame": "ReferenceFrame",
+    }
+    rpc_methods = {
+        "SurfaceHeight": ([("latitude", "double"), ("longitude", "double")], "double"),
+    }
+
+    def __init__(self, sim: "Simulation"):
+        super().__init__(sim)
+        self.name = "Kerbin"
+        self.equatorial_radius = KERBIN_RADIUS
+        self.gravitational_parameter = KERBIN_GRAVITATIONAL_PARAMETER
+        self.surface_gravity = KERBIN_GRAVITATIONAL_PARAMETER / KERBIN_RADIUS ** 2
+        self.rotational_speed = KERBIN_ROTATIONAL_SPEED
+        self.sphere_of_influence = KERBIN_SPHERE_OF_INFLUENCE
+        self.has_atmosphere = True
+        self.atmosphere_depth = KERBIN_ATMOSPHERE_DEPTH
+        self.reference_frame = ReferenceFrame(sim, "body", self)
+        self.non_rotating_reference_frame = ReferenceFrame(sim, "non_rotating", self)
+
+    def surface_height(self, latitude: float, longitude: float) -> float:
+        return 0.0
+
+
+class Flight(RemoteObject):
+    rpc_properties = {
+        "MeanAltitude": "double",
+        "SurfaceAltitude": "double",
+        "Latitude": "double",
+        "Longitude": "double",
+        "Speed": "double",
+        "VerticalSpeed": "double",
+        "HorizontalSpeed": "double",
+        "Pitch": "float",
+        "Heading": "float",
+        "Roll": "float",
+        "GForce": "float",
+        "AtmosphereDensity": "float",
+        "DynamicPressure": "float",
+        "Direction": "tuple(double, double, double)",
+        "AerodynamicForce": "tuple(double, double, double)",
+    }
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel", reference_frame: ReferenceFrame):
+        super().__init__(sim)
+        self.vessel = vessel
+        self.frame = reference_frame
+
+    def _velocity(self) -> Tuple[float, float, float]:
+        # Velocity (north, east, up) in this reference frame
+        if self.frame.kind == "non_rotating":
+            return self.vessel.v_north, self.vessel.v_east, self.vessel.v_up
+        if self.frame.kind == "body":
+            return self.vessel.surface_velocity()
+        # The frame moves with the vessel
+        return 0.0, 0.0, 0.0
+
+    @property
+    def mean_altitude(self) -> float:
+        return self.vessel.altitude
+
+    @property
+    def surface_altitude(self) -> float:
+        return self.vessel.altitude - self.vessel.body.surface_height(self.vessel.latitude, self.vessel.longitude)
+
+    @property
+    def latitude(self) -> float:
+        return self.vessel.latitude
+
+    @property
+    def longitude(self) -> float:
+        return self.vessel.longitude
+
+    @property
+    def speed(self) -> float:
+        return math.sqrt(sum(v * v for v in self._velocity()))
+
+    @property
+    def vertical_speed(self) -> float:
+        return self._velocity()[2]
+
+    @property
+    def horizontal_speed(self) -> float:
+        v_north, v_east, _ = self._velocity()
+        return math.hypot(v_north, v_east)
+
+    @property
+    def pitch(self) -> float:
+        return self.vessel.pitch
+
+    @property
+    def heading(self) -> float:
+        return self.vessel.heading
+
+    @property
+    def roll(self) -> float:
+        return self.vessel.roll
+
+    @property
+    def g_force(self) -> float:
+        return self.vessel.g_force
+
+    @property
+    def atmosphere_density(self) -> float:
+        return atmospheric_density(self.vessel.altitude)
+
+    @property
+    def dynamic_pressure(self) -> float:
+        return 0.5 * atmospheric_density(self.vessel.altitude) * sum(v * v for v in self.vessel.surface_velocity())
+
+    @property
+    def direction(self) -> Tuple[float, float, float]:
+        if self.frame.kind == "node":
+            # The node frame points its y axis along the burn vector
+            error = math.radians(self.vessel.attitude_error(*self.vessel.prograde_attitude()))
+            return math.sin(error), math.cos(error), 0.0
+        return self.vessel.nose()
+
+    @property
+    def aerodynamic_force(self) -> Tuple[float, float, float]:
+        return self.vessel.aerodynamic_force
+
+
+class Orbit(RemoteObject):
+    rpc_properties = {
+        "Body": "CelestialBody",
+        "ApoapsisAltitude": "double",
+        "PeriapsisAltitude": "double",
+        "Apoapsis": "double",
+        "Periapsis": "double",
+        "SemiMajorAxis": "double",
+        "Eccentricity": "double",
+        "Radius": "double",
+        "Speed": "double",
+        "Period": "double",
+    }
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel"):
+        super().__init__(sim)
+        self.vessel = vessel
+        self.body = vessel.body
+
+    @property
+    def radius(self) -> float:
+        return self.body.equatorial_radius + self.vessel.altitude
+
+    @property
+    def speed(self) -> float:
+        v = self.vessel
+        return math.sqrt(v.v_north ** 2 + v.v_east ** 2 + v.v_up ** 2)
+
+    @property
+    def semi_major_axis(self) -> float:
+        energy = self.speed ** 2 / 2 - self.body.gravitational_parameter / self.radius
+        if energy >= 0:
+            return math.inf
+        return -self.body.gravitational_parameter / (2 * energy)
+
+    @property
+    def eccentricity(self) -> float:
+        v = self.vessel
+        mu = self.body.gravitational_parameter
+        energy = self.speed ** 2 / 2 - mu / self.radius
+        angular_momentum = self.radius * math.hypot(v.v_north, v.v_east)
+        return math.sqrt(max(0.0, 1 + 2 * energy * angular_momentum ** 2 / mu ** 2))
+
+    @property
+    def apoapsis(self) -> float:
+        a = self.semi_major_axis
+        if math.isinf(a):
+            return math.inf
+        return a * (1 + self.eccentricity)
+
+    @property
+    def periapsis(self) -> float:
+        a = self.semi_major_axis
+        if math.isinf(a):
+            return self.radius
+        return a * (1 - self.eccentricity)
+
+    @property
+    def apoapsis_altitude(self) -> float:
+        return self.apoapsis - self.body.equatorial_radius
+
+    @property
+    def periapsis_altitude(self) -> float:
+        return self.periapsis - self.body.equatorial_radius
+
+    @property
+    def period(self) -> float:
+        a = self.semi_major_axis
+        if math.isinf(a):
+            return math.inf
+        return 2 * math.pi * math.sqrt(a ** 3 / self.body.gravitational_parameter)
+
+
+class Node(RemoteObject):
+    rpc_properties = {
+        "DeltaV": "double",
+        "Prograde": "double",
+        "UT": "double",
+        "TimeTo": "double",
+        "RemainingDeltaV": "double",
+        "ReferenceFrame": "ReferenceFrame",
+    }
+    rpc_methods = {"Remove": ([], None)}
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel", ut: float, prograde: float):
+        super().__init__(sim)
+        self.vessel = vessel
+        self.ut = ut
+        self.prograde = prograde
+        self.reference_frame = ReferenceFrame(sim, "node", self)
+        # Delta-v applied so far, along and perpendicular to the burn vector
+        self.applied_along = 0.0
+        self.applied_across = 0.0
+
+    @property
+    def delta_v(self) -> float:
+        return abs(self.prograde)
+
+    @property
+    def time_to(self) -> float:
+        return self.ut - self.sim.ut
+
+    @property
+    def remaining_delta_v(self) -> float:
+        return math.hypot(self.prograde - self.applied_along, self.applied_across)
+
+    def remove(self):
+        if self in self.vessel.control.nodes:
+            self.vessel.control.nodes.remove(self)
+
+
+class Control(RemoteObject):
+    rpc_properties = {
+        "Throttle": "float",
+        "Brakes": "bool",
+        "SAS": "bool",
+        "SASMode": "SASMode",
+        "RCS": "bool",
+        "Gear": "bool",
+        "CurrentStage": "int32",
+        "Nodes": "list(Node)",
+    }
+    rpc_writable = {"Throttle": "float", "Brakes": "bool", "SAS": "bool", "SASMode": "SASMode", "RCS": "bool", "Gear": "bool"}
+    rpc_methods = {"ActivateNextStage": ([], "list(Vessel)")}
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel"):
+        super().__init__(sim)
+        self.vessel = vessel
+        self._throttle = 0.0
+        self.brakes = False
+        self.sas = False
+        self.sas_mode = SASMode.stability_assist
+        self.rcs = False
+        self.gear = True
+        self.current_stage = 0
+        self.nodes: List[Node] = []
+
+    @property
+    def throttle(self) -> float:
+        return self._throttle
+
+    @throttle.setter
+    def throttle(self, value: float):
+        self._throttle = min(1.0, max(0.0, value))
+
+    def activate_next_stage(self) -> list:
+        if self.current_stage > 0:
+            self.current_stage -= 1
+            self.vessel.decouple(self.current_stage)
+        return []
+
+
+class AutoPilot(RemoteObject):
+    rpc_properties = {
+        "Engaged": "bool",
+        "TargetPitch": "float",
+        "TargetHeading": "float",
+        "TargetRoll": "float",
+        "TargetDirection": "tuple(double, double, double)",
+        "ReferenceFrame": "ReferenceFrame",
+        "RollThreshold": "double",
+        "DecelerationTime": "tuple(double, double, double)",
+        "AttenuationAngle": "tuple(double, double, double)",
+        "PitchError": "float",
+        "HeadingError": "float",
+        "Error": "float",
+    }
+    rpc_writable = {
+        "Engaged": "bool",
+        "TargetPitch": "float",
+        "TargetHeading": "float",
+        "TargetRoll": "float",
+        "TargetDirection": "tuple(double, double, double)",
+        "ReferenceFrame": "ReferenceFrame",
+        "RollThreshold": "double",
+        "DecelerationTime": "tuple(double, double, double)",
+        "AttenuationAngle": "tuple(double, double, double)",
+    }
+    rpc_methods = {
+        "Engage": ([], None),
+        "Disengage": ([], None),
+        "TargetPitchAndHeading": ([("pitch", "float"), ("heading", "float")], None),
+    }
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel"):
+        super().__init__(sim)
+        self.vessel = vessel
+        self.engaged = False
+        self.target_pitch = 0.0
+        self.target_heading = 0.0
+        self.target_roll = math.nan
+        self.target_direction = (0.0, 1.0, 0.0)
+        self.reference_frame = vessel.surface_reference_frame
+        self.roll_threshold = 5.0
+        self.deceleration_time = (5.0, 5.0, 5.0)
+        self.attenuation_angle = (1.0, 1.0, 1.0)
+
+    def engage(self):
+        self.engaged = True
+
+    def disengage(self):
+        self.engaged = False
+
+    def target_pitch_and_heading(self, pitch: float, heading: float):
+        self.target_pitch = pitch
+        self.target_heading = heading
+
+    def target_attitude(self) -> Tuple[float, float]:
+        if self.reference_frame.kind == "node":
+            return self.vessel.prograde_attitude()
+        return self.target_pitch, self.target_heading
+
+    @property
+    def pitch_error(self) -> float:
+        return abs(self.target_attitude()[0] - self.vessel.pitch)
+
+    @property
+    def heading_error(self) -> float:
+        return abs(angle_difference(self.target_attitude()[1], self.vessel.heading))
+
+    @property
+    def error(self) -> float:
+        return self.vessel.attitude_error(*self.target_attitude())
+
+
+class ScienceSubject(RemoteObject):
+    rpc_properties = {
+        "Title": "string",
+        "ScienceCap": "float",
+        "Science": "float",
+        "ScientificValue": "float",
+        "DataScale": "float",
+        "IsComplete": "bool",
+    }
+
+    def __init__(self, sim: "Simulation", title: str, science_cap: float):
+        super().__init__(sim)
+        self.title = title
+        self.science_cap = science_cap
+        self.science = 0.0
+        self.data_scale = 1.0
+
+    @property
+    def scientific_value(self) -> float:
+        return max(0.0, 1 - self.science / self.science_cap)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.scientific_value < 0.01
+
+
+class ScienceData(RemoteObject):
+    rpc_properties = {"DataAmount": "float", "ScienceValue": "float", "TransmitValue": "float"}
+
+    def __init__(self, sim: "Simulation", subject: ScienceSubject, data_amount: float, transmit_value: float):
+        super().__init__(sim)
+        self.subject = subject
+        self.data_amount = data_amount
+        self.science_value = subject.scientific_value * subject.science_cap
+        self.transmit_value = transmit_value
+
+
+class Experiment(RemoteObject):
+    rpc_properties = {
+        "Part": "Part",
+        "Name": "string",
+        "Title": "string",
+        "Inoperable": "bool",
+        "Deployed": "bool",
+        "Rerunnable": "bool",
+        "HasData": "bool",
+        "Data": "list(ScienceData)",
+        "Available": "bool",
+        "Biome": "string",
+        "ScienceSubject": "ScienceSubject",
+    }
+    rpc_methods = {"Run": ([], None), "Transmit": ([], None), "Dump": ([], None), "Reset": ([], None)}
+
+    # Electric charge needed to transmit one Mit of data
+    transmit_cost = 6.0
+
+    def __init__(
+        self,
+        sim: "Simulation",
+        part: "Part",
+        name: str,
+        title: str,
+        rerunnable: bool,
+        science_cap: float,
+        data_amount: float,
+        transmit_value: float,
+    ):
+        super().__init__(sim)
+        self.part = part
+        self.name = name
+        self.title = title
+        self.rerunnable = rerunnable
+        self.inoperable = False
+        self.deployed = False
+        self.available = True
+        self.data: List[ScienceData] = []
+        self.science_cap = science_cap
+        self.data_amount = data_amount
+        self.transmit_value = transmit_value
+
+    @property
+    def has_data(self) -> bool:
+        return bool(self.data)
+
+    @property
+    def biome(self) -> str:
+        return self.part.vessel.biome()
+
+    @property
+    def science_subject(self) -> ScienceSubject:
+        vessel = self.part.vessel
+        return self.sim.science_subject(f"{self.title} while {vessel.science_situation()} at {self.biome}", self.science_cap)
+
+    def run(self):
+        if self.inoperable or self.has_data:
+            raise RuntimeError(f"Experiment {self.name} cannot be run")
+        self.deployed = True
+        self.data = [ScienceData(self.sim, self.science_subject, self.data_amount, self.transmit_value)]
+        self.part.vessel.experiment_run(self)
+
+    def transmit(self):
+        if not self.data:
+            raise RuntimeError(f"Experiment {self.name} has no data to transmit")
+        resources = self.part.vessel.resources
+        cost = sum(data.data_amount for data in self.data) * self.transmit_cost
+        if resources.amount("ElectricCharge") < cost:
+            raise RuntimeError("Not enough electric charge to transmit")
+        resources.consume("ElectricCharge", cost)
+        for data in self.data:
+            data.subject.science += data.science_value * data.transmit_value
+        self.reset()
+
+    def dump(self):
+        self.reset()
+
+    def reset(self):
+        self.data = []
+        self.deployed = False
+        if not self.rerunnable:
+            self.inoperable = True
+
+
+class Engine(RemoteObject):
+    rpc_properties = {
+        "Part": "Part",
+        "Active": "bool",
+        "HasFuel": "bool",
+        "Thrust": "float",
+        "MaxThrust": "float",
+        "MaxVacuumThrust": "float",
+        "SpecificImpulse": "float",
+        "VacuumSpecificImpulse": "float",
+        "Propellants": "list(string)",
+    }
+
+    def __init__(
+        self,
+        sim: "Simulation",
+        max_thrust: float,
+        isp_vacuum: float,
+        isp_sea_level: float,
+        propellant: str,
+        air_breathing=False,
+    ):
+        super().__init__(sim)
+        # Set by the part the engine is added to
+        self.part: Optional["Part"] = None
+        self.max_thrust = max_thrust
+        self.isp_vacuum = isp_vacuum
+        self.isp_sea_level = isp_sea_level
+        self.propellant = propellant
+        self.air_breathing = air_breathing
+
+    def isp(self, altitude: float) -> float:
+        pressure = atmospheric_density(altitude) / SEA_LEVEL_DENSITY
+        if self.air_breathing:
+            return self.isp_sea_level
+        return self.isp_vacuum - (self.isp_vacuum - self.isp_sea_level) * pressure
+
+    def thrust_limit(self, altitude: float) -> float:
+        if self.air_breathing:
+            # Jet engines lose thrust with air density
+            return self.max_thrust * (atmospheric_density(altitude) / SEA_LEVEL_DENSITY) ** 0.7
+        return self.max_thrust * self.isp(altitude) / self.isp_vacuum
+
+    @property
+    def active(self) -> bool:
+        return self.part.engine_active()
+
+    @property
+    def has_fuel(self) -> bool:
+        return self.part.vessel.resources_in_decouple_stage(self.part.decouple_stage, False).amount(self.propellant) > 0
+
+    @property
+    def thrust(self) -> float:
+        if not self.active or not self.has_fuel:
+            return 0.0
+        return self.thrust_limit(self.part.vessel.altitude) * self.part.vessel.control.throttle
+
+    @property
+    def max_vacuum_thrust(self) -> float:
+        return self.max_thrust if not self.air_breathing else self.thrust_limit(0.0)
+
+    @property
+    def specific_impulse(self) -> float:
+        return self.isp(self.part.vessel.altitude)
+
+    @property
+    def vacuum_specific_impulse(self) -> float:
+        return self.isp_vacuum
+
+    @property
+    def propellants(self) -> List[str]:
+        return [self.propellant]
+
+
+class Part(RemoteObject):
+    rpc_properties = {
+        "Name": "string",
+        "Title": "string",
+        "Stage": "int32",
+        "DecoupleStage": "int32",
+        "Mass": "double",
+        "DryMass": "double",
+        "Resources": "Resources",
+        "Experiments": "list(Experiment)",
+        "Engine": "Engine",
+    }
+
+    def __init__(
+        self,
+        sim: "Simulation",
+        vessel: "Vessel",
+        name: str,
+        dry_mass: float,
+        stage: int = -1,
+        decouple_stage: int = -1,
+        resources: Optional[Dict[str, float]] = None,
+        engine: Optional[Engine] = None,
+    ):
+        super().__init__(sim)
+        self.vessel = vessel
+        self.name = self.title = name
+        self.dry_mass = dry_mass
+        self.stage = stage
+        self.decouple_stage = decouple_stage
+        # Resource name -> [amount, max]
+        self.resource_amounts = {name: [amount, amount] for name, amount in (resources or {}).items()}
+        self.engine = engine
+        if engine is not None:
+            engine.part = self
+        self.experiments: List[Experiment] = []
+        self.resources = Resources(sim, [self])
+
+    @property
+    def mass(self) -> float:
+        return self.dry_mass + sum(
+            amount * RESOURCE_DENSITY.get(name, 0) for name, (amount, _) in self.resource_amounts.items()
+        )
+
+    def engine_active(self) -> bool:
+        return self.engine is not None and self.stage >= self.vessel.control.current_stage
+
+
+class Parts(RemoteObject):
+    rpc_properties = {"All": "list(Part)", "Experiments": "list(Experiment)", "Engines": "list(Engine)"}
+    rpc_methods = {
+        "InStage": ([("stage", "int32")], "list(Part)"),
+        "InDecoupleStage": ([("stage", "int32")], "list(Part)"),
+    }
+
+    def __init__(self, sim: "Simulation", vessel: "Vessel"):
+        super().__init__(sim)
+        self.vessel = vessel
+
+    @property
+    def all(self) -> List[Part]:
+        return list(self.vessel.part_list)
+
+    @property
+    def experiments(self) -> List[Experiment]:
+        return [experiment for part in self.vessel.part_list for experiment in part.experiments]
+
+    @property
+    def engines(self) -> List[Engine]:
+        return [part.engine for part in self.vessel.part_list if part.engine is not None]
+
+    def in_stage(self, stage: int) -> List[Part]:
+        return [part for part in self.vessel.part_list if part.stage == stage]
+
+    def in_decouple_stage(self, stage: int) -> List[Part]:
+        return [part for part in self.vessel.part_list if part.decouple_stage == stage]
+
+
+class Resources(RemoteObject):
+    rpc_properties = {"Names": "list(string)", "Enabled": "bool"}
+    rpc_methods = {
+        "Amount": ([("name", "string")], "float"),
+        "Max": ([("name", "string")], "float"),
+        "HasResource": ([("name", "string")], "bool"),
+    }
+
+    def __init__(self, sim: "Simulation", parts: List[Part]):
+        super().__init__(sim)
+        self.parts = parts
+        self.enabled = True
+
+    @property
+    def names(self) -> List[str]:
+        return sorted({name for part in self.parts for name in part.resource_amounts})
+
+    def has_resource(self, name: str) -> bool:
+        return name in self.names
+
+    def amount(self, name: str) -> float:
+        return sum(part.resource_amounts[name][0] for part in self.parts if name in part.resource_amounts)
+
+    def max(self, name: str) -> float:
+        return sum(part.resource_amounts[name][1] for part in self.parts if name in part.resource_amounts)
+
+    def consume(self, name: str, amount: float) -> float:
+        # Removes up to 'amount' from the parts, returns how much was actually removed
+        removed = 0.0
+        for part in self.parts:
+            if name in part.resource_amounts and removed < amount:
+                entry = part.resource_amounts[name]
+                taken = min(entry[0], amount - removed)
+                entry[0] -= taken
+                removed += taken
+        return removed
+
+    def fill(self, name: str, amount: float):
+        for part in self.parts:
+            if name in part.resource_amounts and amount > 0:
+                entry = part.resource_amounts[name]
+                added = min(entry[1] - entry[0], amount)
+                entry[0] += added
+                amount -= added
+
+
+class Vessel(RemoteObject):
+    rpc_properties = {
+        "Name": "string",
+        "Situation": "VesselSituation",
+        "MET": "double",
+        "Mass": "float",
+        "DryMass": "float",
+        "Thrust": "float",
+        "AvailableThrust": "float",
+        "MaxThrust": "float",
+        "SpecificImpulse": "float",
+        "VacuumSpecificImpulse": "float",
+        "Control": "Control",
+        "AutoPilot": "AutoPilot",
+        "Orbit": "Orbit",
+        "Parts": "Parts",
+        "Resources": "Resources",
+        "ReferenceFrame": "ReferenceFrame",
+        "SurfaceReferenceFrame": "ReferenceFrame",
+    }
+    rpc_methods = {
+        "Flight": ([("reference_frame", "ReferenceFrame", None)], "Flight"),
+        "ResourcesInDecoupleStage": ([("stage", "int32"), ("cumulative", "bool", True)], "Resources"),
+    }
+
+    def __init__(self, sim: "Simulation", name: str, body: CelestialBody):
+        super().__init__(sim)
+        self.name = name
+        self.body = body
+        self.launch_ut = sim.ut
+        self.launched = False
+        # Position in degrees and meters above sea level
+        self.latitude = 0.0
+        self.longitude = 0.0
+        self.altitude = 0.0
+        # Velocity in m/s relative to the non rotating frame of the body, in local north, east and up components
+        self.v_north = 0.0
+        self.v_east = 0.0
+        self.v_up = 0.0
+        # Attitude in degrees
+        self.pitch = 0.0
+        self.heading = 90.0
+        self.roll = 0.0
+        # Largest attitude change per second in degrees
+        self.rotation_rate = 10.0
+        # Drag coefficient times reference area in m^2
+        self.drag_area = 1.0
+        # How fast lift turns the velocity towards the nose, per kg/m^3 of air and m/s of speed. Zero for rockets
+        self.lift_coefficient = 0.0
+        self.g_force = 1.0
+        self.aerodynamic_force = (0.0, 0.0, 0.0)
+        self.part_list: List[Part] = []
+        self.reference_frame = ReferenceFrame(sim, "vessel", self)
+        self.surface_reference_frame = ReferenceFrame(sim, "vessel_surface", self)
+        self.control = Control(sim, self)
+        self.auto_pilot = AutoPilot(sim, self)
+        self.orbit = Orbit(sim, self)
+        self.parts = Parts(sim, self)
+        self.resources = Resources(sim, self.part_list)
+        self._flights: Dict[int, Flight] = {}
+
+    def add_part(self, name: str, dry_mass: float, **kwargs) -> Part:
+        part = Part(self.sim, self, name, dry_mass, **kwargs)
+        self.part_list.append(part)
+        return part
+
+    def flight(self, reference_frame: Optional[ReferenceFrame] = None) -> Flight:
+        frame = reference_frame or self.surface_reference_frame
+        if frame._object_id not in self._flights:
+            self._flights[frame._object_id] = Flight(self.sim, self, frame)
+        return self._flights[frame._object_id]
+
+    def resources_in_decouple_stage(self, stage: int, cumulative: bool = True) -> Resources:
+        # Cumulative includes everything decoupled in this stage and the ones before it (higher stage numbers)
+        parts = [p for p in self.part_list if p.decouple_stage == stage or (cumulative and p.decouple_stage > stage)]
+        return Resources(self.sim, parts)
+
+    def decouple(self, stage: int):
+        self.part_list[:] = [part for part in self.part_list if part.decouple_stage != stage]
+        self.launched = True
+
+    @property
+    def met(self) -> float:
+        return self.sim.ut - self.launch_ut if self.launched else 0.0
+
+    @property
+    def mass(self) -> float:
+        return sum(part.mass for part in self.part_list)
+
+    @property
+    def dry_mass(self) -> float:
+        return sum(part.dry_mass for part in self.part_list)
+
+    def _burning_engines(self) -> List[Part]:
+        return [
+            part
+            for part in self.part_list
+            if part.engine_active() and self.resources_in_decouple_stage(part.decouple_stage, False).amount(part.engine.propellant) > 0
+        ]
+
+    @property
+    def available_thrust(self) -> float:
+        return sum(part.engine.thrust_limit(self.altitude) for part in self._burning_engines())
+
+    @property
+    def max_thrust(self) -> float:
+        return sum(part.engine.max_thrust for part in self._burning_engines())
+
+    @property
+    def thrust(self) -> float:
+        return self.available_thrust * self.control.throttle
+
+    @property
+    def specific_impulse(self) -> float:
+        engines = self._burning_engines()
+        thrust = sum(part.engine.thrust_limit(self.altitude) for part in engines)
+        if thrust <= 0:
+            return 0.0
+        flow = sum(part.engine.thrust_limit(self.altitude) / part.engine.isp(self.altitude) for part in engines)
+        return thrust / flow
+
+    @property
+    def vacuum_specific_impulse(self) -> float:
+        engines = self._burning_engines()
+        if not engines:
+            return 0.0
+        return sum(part.engine.max_thrust for part in engines) / sum(
+            part.engine.max_thrust / part.engine.isp_vacuum for part in engines
+        )
+
+    @property
+    def situation(self) -> VesselSituation:
+        on_ground = self.altitude <= 0.01
+        if on_ground and not self.launched:
+            return VesselSituation.pre_launch
+        if on_ground:
+            return VesselSituation.landed
+        if self.altitude < self.body.atmosphere_depth:
+            return VesselSituation.flying
+        if self.orbit.periapsis_altitude > self.body.atmosphere_depth:
+            return VesselSituation.orbiting
+        return VesselSituation.sub_orbital
+
+    def science_situation(self) -> str:
+        if self.altitude <= 0.01:
+            return "landed"
+        if self.altitude < 18_000:
+            return "flying low"
+        if self.altitude < self.body.atmosphere_depth:
+            return "flying high"
+        return "in space"
+
+    def biome(self) -> str:
+        biomes = ("Shores", "Grasslands", "Highlands", "Mountains", "Water", "Deserts", "Tundra")
+        cell = int((self.latitude + 90) // 3) * 131 + int((self.longitude + 180) // 3)
+        return biomes[cell % len(biomes)]
+
+    def surface_velocity(self) -> Tuple[float, float, float]:
+        rotation = self.body.rotational_speed * (self.body.equatorial_radius + self.altitude)
+        return self.v_north, self.v_east - rotation * math.cos(math.radians(self.latitude)), self.v_up
+
+    def nose(self) -> Tuple[float, float, float]:
+        # Unit vector the vessel points at, in (north, east, up) components
+        pitch = math.radians(self.pitch)
+        heading = math.radians(self.heading)
+        return math.cos(pitch) * math.cos(heading), math.cos(pitch) * math.sin(heading), math.sin(pitch)
+
+    def prograde_attitude(self) -> Tuple[float, float]:
+        speed = math.sqrt(self.v_north ** 2 + self.v_east ** 2 + self.v_up ** 2)
+        if speed < 1e-6:
+            return 90.0, self.heading
+        pitch = math.degrees(math.asin(self.v_up / speed))
+        heading = math.degrees(math.atan2(self.v_east, self.v_north)) % 360
+        return pitch, heading
+
+    def attitude_error(self, pitch: float, heading: float) -> float:
+        # Angle in degrees between the nose and the given attitude
+        p1, h1, p2, h2 = map(math.radians, (self.pitch, self.heading, pitch, heading))
+        cosine = math.sin(p1) * math.sin(p2) + math.cos(p1) * math.cos(p2) * math.cos(h1 - h2)
+        return math.degrees(math.acos(min(1.0, max(-1.0, cosine))))
+
+    def experiment_run(self, experiment: Experiment):
+        self.sim.complete_waypoints(self, experiment)
+
+    def step(self, dt: float):
+        body = self.body
+        control = self.control
+
+        # Attitude
+        if self.auto_pilot.engaged:
+            target_pitch, target_heading = self.auto_pilot.target_attitude()
+            max_change = self.rotation_rate * dt
+            self.pitch += min(max_change, max(-max_change, target_pitch - self.pitch))
+            self.heading = (self.heading + min(max_change, max(-max_change, angle_difference(target_heading, self.heading)))) % 360
+            if not math.isnan(self.auto_pilot.target_roll):
+                self.roll += min(max_change, max(-max_change, self.auto_pilot.target_roll - self.roll))
+        on_ground = self.altitude <= 0.01
+        if on_ground and self.lift_coefficient > 0:
+            # Aircraft can only lift the nose a little while rolling on the runway
+            self.pitch = min(15.0, max(0.0, self.pitch))
+
+        # Engines
+        mass = self.mass
+        thrust = 0.0
+        for part in self._burning_engines():
+            engine = part.engine
+            engine_thrust = engine.thrust_limit(self.altitude) * control.throttle
+            flow = engine_thrust / (engine.isp(self.altitude) * G0) * dt
+            density = RESOURCE_DENSITY.get(engine.propellant, 1.0) or 1.0
+            removed = self.resources_in_decouple_stage(part.decouple_stage, False).consume(engine.propellant, flow / density)
+            thrust += engine_thrust * min(1.0, removed * density / flow) if flow > 0 else 0.0
+        if thrust > 0:
+            self.launched = True
+        # Electric charge from alternators and solar panels
+        self.resources.fill("ElectricCharge", (2.0 if thrust > 0 else 0.5) * dt)
+
+        nose = self.nose()
+        radius = body.equatorial_radius + self.altitude
+        acceleration = [thrust / mass * n for n in nose]
+
+        # Drag against the surface velocity
+        surface_velocity = self.surface_velocity()
+        surface_speed = math.sqrt(sum(v * v for v in surface_velocity))
+        density = atmospheric_density(self.altitude)
+        drag = 0.5 * density * surface_speed ** 2 * self.drag_area
+        if surface_speed > 1e-6:
+            self.aerodynamic_force = tuple(-drag * v / surface_speed for v in surface_velocity)
+            for i in range(3):
+                acceleration[i] += self.aerodynamic_force[i] / mass
+        self.g_force = math.sqrt(sum(a * a for a in acceleration)) / G0
+
+        # Gravity and the apparent forces of the local north, east, up frame
+        latitude = math.radians(self.latitude)
+        acceleration[2] += -body.gravitational_parameter / radius ** 2 + (self.v_north ** 2 + self.v_east ** 2) / radius
+        acceleration[0] += (-self.v_north * self.v_up - self.v_east ** 2 * math.tan(latitude)) / radius
+        acceleration[1] += (-self.v_east * self.v_up + self.v_east * self.v_north * math.tan(latitude)) / radius
+
+        self.v_north += acceleration[0] * dt
+        self.v_east += acceleration[1] * dt
+        self.v_up += acceleration[2] * dt
+
+        # Lift turns the surface velocity towards the nose without changing its magnitude
+        if self.lift_coefficient > 0 and surface_speed > 1:
+            self._apply_lift(self.lift_coefficient * density * surface_speed * dt)
+
+        # Ground contact
+        if self.altitude + self.v_up * dt <= 0:
+            self.v_up = max(0.0, self.v_up)
+            north, east, _ = self.surface_velocity()
+            ground_speed = math.hypot(north, east)
+            if ground_speed > 1e-6:
+                friction = (5.0 if control.brakes else 0.2) * dt
+                factor = max(0.0, ground_speed - friction) / ground_speed
+                rotation = self.v_east - east
+                self.v_north = north * factor
+                self.v_east = rotation + east * factor
+
+        self.altitude = max(0.0, self.altitude + self.v_up * dt)
+        self.latitude += math.degrees(self.v_north * dt / radius)
+        # Longitude is stored relative to the rotating surface
+        surface_east = self.surface_velocity()[1]
+        self.longitude += math.degrees(surface_east * dt / (radius * max(1e-6, math.cos(latitude))))
+        self.longitude = (self.longitude + 180) % 360 - 180
+
+        # Progress of a burn on the next maneuver node
+        if control.nodes and thrust > 0:
+            node = control.nodes[0]
+            error = math.radians(self.attitude_error(*self.prograde_attitude()))
+            burn = thrust / mass * dt
+            node.applied_along += burn * math.cos(error)
+            node.applied_across += burn * math.sin(error)
+
+    def _apply_lift(self, max_turn: float):
+        north, east, up = self.surface_velocity()
+        speed = math.sqrt(north ** 2 + east ** 2 + up ** 2)
+        velocity = (north / speed, east / speed, up / speed)
+        nose = self.nose()
+        cosine = min(1.0, max(-1.0, sum(v * n for v, n in zip(velocity, nose))))
+        angle = math.acos(cosine)
+        if angle < 1e-6:
+            return
+        fraction = min(1.0, max_turn / angle)
+        # Rotate the velocity towards the nose by linear interpolation of the directions
+        direction = [v + (n - v) * fraction for v, n in zip(velocity, nose)]
+        length = math.sqrt(sum(d * d for d in direction))
+        rotation = self.v_east - east
+        self.v_north, east, self.v_up = (speed * d / length for d in direction)
+        self.v_east = rotation + east
+
+
+class Waypoint(RemoteObject):
+    rpc_properties = {
+        "Name": "string",
+        "Body": "CelestialBody",
+        "Latitude": "double",
+        "Longitude": "double",
+        "MeanAltitude": "double",
+        "SurfaceAltitude": "double",
+        "NearSurface": "bool",
+        "Grounded": "bool",
+        "HasContract": "bool",
+        "Icon": "string",
+        "Index": "int32",
+    }
+
+    def __init__(self, sim: "Simulation", name: str, body: CelestialBody, latitude: float, longitude: float):
+        super().__init__(sim)
+        self.name = name
+        self.body = body
+        self.latitude = latitude
+        self.longitude = longitude
+        self.surface_altitude = 0.0
+        self.near_surface = True
+        self.grounded = False
+        self.has_contract = True
+        self.icon = "report"
+        self.index = 0
+
+    @property
+    def mean_altitude(self) -> float:
+        return self.surface_altitude
+
+
+class WaypointManager(RemoteObject):
+    rpc_properties = {"Waypoints": "list(Waypoint)"}
+
+    def __init__(self, sim: "Simulation"):
+        super().__init__(sim)
+        self.waypoints: List[Waypoint] = []
+
+
+class SpaceCenter(RemoteObject):
+    rpc_properties = {
+        "ActiveVessel": "Vessel",
+        "Vessels": "list(Vessel)",
+        "UT": "double",
+        "WaypointManager": "WaypointManager",
+    }
+    rpc_writable = {"ActiveVessel": "Vessel"}
+    rpc_methods = {
+        "WarpTo": ([("ut", "double"), ("max_rails_rate", "float", 100_000.0), ("max_physics_rate", "float", 2.0)], None),
+    }
+
+    def __init__(self, sim: "Simulation"):
+        super().__init__(sim)
+        self.active_vessel: Optional[Vessel] = None
+        self.vessels: List[Vessel] = []
+        self.waypoint_manager = WaypointManager(sim)
+
+    @property
+    def ut(self) -> float:
+        return self.sim.ut
+
+    def warp_to(self, ut: float, max_rails_rate: float = 100_000.0, max_physics_rate: float = 2.0):
+        self.sim.advance(ut - self.sim.ut, step=0.1)
+
+
+class Simulation:
+    # Holds the state of the simulated game. Everything is guarded by 'lock', which the server holds while it runs
+    # a procedure call, advances the physics or evaluates streams, so every read sees one consistent game state.
+    def __init__(self, scenario: str = "rocket", seed: int = waypoint_seed, waypoints: int = waypoint_count):
+        self.lock = threading.RLock()
+        self.ut = 0.0
+        self._objects: Dict[int, RemoteObject] = {}
+        self._object_ids = itertools.count(1)
+        self._subjects: Dict[str, ScienceSubject] = {}
+        self.kerbin = CelestialBody(self)
+        self.space_center = SpaceCenter(self)
+        vessel = SCENARIOS[scenario](self)
+        self.space_center.vessels.append(vessel)
+        self.space_center.active_vessel = vessel
+        self.generate_waypoints(seed, waypoints)
+
+    def register(self, obj: RemoteObject) -> int:
+        object_id = next(self._object_ids)
+        self._objects[object_id] = obj
+        return object_id
+
+    def get_object(self, object_id: int) -> Optional[RemoteObject]:
+        if object_id == 0:
+            return None
+        if object_id not in self._objects:
+            raise ValueError(f"No object with id {object_id}")
+        return self._objects[object_id]
+
+    def science_subject(self, title: str, science_cap: float) -> ScienceSubject:
+        if title not in self._subjects:
+            self._subjects[title] = ScienceSubject(self, title, science_cap)
+        return self._subjects[title]
+
+    def advance(self, duration: float, step: float = max_step):
+        with self.lock:
+            while duration > 1e-9:
+                dt = min(step, duration)
+                for vessel in self.space_center.vessels:
+                    vessel.step(dt)
+                self.ut += dt
+                duration -= dt
+
+    def generate_waypoints(self, seed: int, count: int):
+        rng = random.Random(seed)
+        manager = self.space_center.waypoint_manager
+        for i in range(count):
+            latitude = LAUNCHPAD_POSITION[0] + rng.uniform(-4, 4)
+            longitude = LAUNCHPAD_POSITION[1] + rng.uniform(-6, 6)
+            waypoint = Waypoint(self, f"Site {i}", self.kerbin, latitude, longitude)
+            waypoint.index = i
+            waypoint.icon = rng.choice(("report", "thermometer"))
+            waypoint.has_contract = rng.random() < 0.7
+            waypoint.near_surface = rng.random() < 0.8
+            waypoint.surface_altitude = rng.uniform(500, 12_000) if waypoint.near_surface else rng.uniform(20_000, 60_000)
+            manager.waypoints.append(waypoint)
+
+    def complete_waypoints(self, vessel: Vessel, experiment: Experiment):
+        # Contracts to gather science at a waypoint complete when the matching experiment runs close enough to it
+        parts = {"report": "Cockpit", "thermometer": "sensorThermometer"}
+        manager = self.space_center.waypoint_manager
+        radius = vessel.body.equatorial_radius
+        for waypoint in list(manager.waypoints):
+            if not waypoint.has_contract or parts.get(waypoint.icon, "") not in experiment.part.name:
+                continue
+            lat1, lon1, lat2, lon2 = map(math.radians, (vessel.latitude, vessel.longitude, waypoint.latitude, waypoint.longitude))
+            a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            if radius * 2 * math.asin(math.sqrt(min(1.0, a))) < 2_000:
+                logger.info(f"Contract at waypoint {waypoint.name} completed")
+                manager.waypoints.remove(waypoint)
+
+
+def _rocket(sim: Simulation) -> Vessel:
+    vessel = Vessel(sim, "Stand-in Rocket", sim.kerbin)
+    vessel.latitude, vessel.longitude = LAUNCHPAD_POSITION
+    vessel.pitch = 90.0
+    vessel.drag_area = 0.8
+    vessel.control.current_stage = 3
+    pod = vessel.add_part("mk1pod.v2", 840, resources={"ElectricCharge": 50, "MonoPropellant": 10})
+    pod.experiments.append(Experiment(sim, pod, "crewReport", "Crew Report", True, 5, 5, 1.0))
+    vessel.add_part("liquidEngine3.v2", 500, stage=1, decouple_stage=0, resources={"LiquidFuel": 180},
+                    engine=Engine(sim, 60_000, 345, 85, "LiquidFuel"))
+    vessel.add_part("liquidEngine2", 1_500, stage=2, decouple_stage=1, resources={"LiquidFuel": 720},
+                    engine=Engine(sim, 215_000, 320, 250, "LiquidFuel"))
+    _rest_on_surface(vessel)
+    return vessel
+
+
+def _aircraft(sim: Simulation) -> Vessel:
+    vessel = Vessel(sim, "Stand-in Aircraft", sim.kerbin)
+    vessel.latitude, vessel.longitude = RUNWAY_POSITION
+    vessel.heading = 90.0
+    vessel.rotation_rate = 12.0
+    vessel.drag_area = 1.6
+    vessel.lift_coefficient = 0.002
+    vessel.control.current_stage = 0
+    vessel.launched = True
+    cockpit = vessel.add_part("Mark1Cockpit", 1_250, resources={"ElectricCharge": 150})
+    cockpit.experiments.append(Experiment(sim, cockpit, "crewReport", "Crew Report", True, 5, 5, 1.0))
+    vessel.add_part("JetEngine", 1_200, stage=0, resources={"LiquidFuel": 400},
+                    engine=Engine(sim, 90_000, 6_400, 6_400, "LiquidFuel", air_breathing=True))
+    for name, title, rerunnable, cap, amount, transmit in (
+        ("sensorThermometer", "Temperature Scan", True, 8, 8, 0.5),
+        ("sensorBarometer", "Atmospheric Pressure Scan", True, 12, 12, 0.5),
+        ("GooExperiment", "Mystery Goo Observation", False, 13, 10, 0.3),
+        ("science.module", "Materials Study", False, 25, 25, 0.3),
+    ):
+        part = vessel.add_part(name, 50)
+        part.experiments.append(Experiment(sim, part, name, title, rerunnable, cap, amount, transmit))
+    vessel.add_part("MK1Fuselage", 900)
+    _rest_on_surface(vessel)
+    return vessel
+
+
+def _orbit(sim: Simulation) -> Vessel:
+    vessel = _rocket(sim)
+    vessel.name = "Stand-in Spacecraft"
+    vessel.control.current_stage = 1
+    vessel.decouple(1)
+    vessel.launched = True
+    vessel.altitude = 80_000
+    vessel.latitude, vessel.longitude = 0.0, 0.0
+    vessel.v_north, vessel.v_up = 0.0, 0.0
+    vessel.v_east = math.sqrt(vessel.body.gravitational_parameter / (vessel.body.equatorial_radius + vessel.altitude))
+    vessel.pitch, vessel.heading = 0.0, 90.0
+    vessel.control.nodes.append(Node(sim, vessel, sim.ut + 120, 150.0))
+    return vessel
+
+
+def _rest_on_surface(vessel: Vessel):
+    # Stationary on the ground means moving with the rotating surface
+    body = vessel.body
+    vessel.v_east = body.rotational_speed * body.equatorial_radius * math.cos(math.radians(vessel.latitude))
+
+
+SCENARIOS = {"rocket": _rocket, "aircraft": _aircraft, "orbit": _orbit}
+
+
+class _Procedure:
+    def __init__(self, name: str, target: str, kind: str, attribute: str, parameters: list, return_type: Optional[str]):
+        self.name = name
+        # target is "service" for procedures of the service itself, otherwise the class name
+        self.target = target
+        # kind is one of "get", "set" or "call"
+        self.kind = kind
+        self.attribute = attribute
+        self.parameters = parameters
+        self.return_type = return_type
+        # krpc type objects used to decode the arguments and encode the result
+        self.types: list = []
+        self.return_typ = None
+
+
+_VALUE_TYPES = {
+    "double": KRPC.Type.DOUBLE,
+    "float": KRPC.Type.FLOAT,
+    "int32": KRPC.Type.SINT32,
+    "int64": KRPC.Type.SINT64,
+    "uint32": KRPC.Type.UINT32,
+    "uint64": KRPC.Type.UINT64,
+    "bool": KRPC.Type.BOOL,
+    "string": KRPC.Type.STRING,
+    "bytes": KRPC.Type.BYTES,
+    "ProcedureCall": KRPC.Type.PROCEDURE_CALL,
+    "Stream": KRPC.Type.STREAM,
+    "Status": KRPC.Type.STATUS,
+    "Services": KRPC.Type.SERVICES,
+}
+
+
+def _split_types(spec: str) -> List[str]:
+    parts, level, current = [], 0, ""
+    for char in spec:
+        if char == "," and level == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        level += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _protobuf_type(spec: Optional[str], service: str) -> KRPC.Type:
+    typ = KRPC.Type()
+    if spec is None:
+        typ.code = KRPC.Type.NONE
+    elif spec in _VALUE_TYPES:
+        typ.code = _VALUE_TYPES[spec]
+    elif spec.startswith("list("):
+        typ.code = KRPC.Type.LIST
+        typ.types.extend([_protobuf_type(spec[5:-1], service)])
+    elif spec.startswith("tuple("):
+        typ.code = KRPC.Type.TUPLE
+        typ.types.extend(_protobuf_type(part, service) for part in _split_types(spec[6:-1]))
+    else:
+        typ.code = KRPC.Type.ENUMERATION if spec in ENUMERATIONS else KRPC.Type.CLASS
+        typ.service = service
+        typ.name = spec
+    return typ
+
+
+class _Service:
+    # Procedure table of one service, built from the rpc_* declarations of the service class and its classes
+    def __init__(self, name: str, service_class: type, classes: List[type]):
+        self.name = name
+        self.types = Types()
+        self.procedures: Dict[str, _Procedure] = {}
+        self.classes = [cls.__name__ for cls in classes]
+        self._add(service_class, "service", "")
+        for cls in classes:
+            self._add(cls, cls.__name__, cls.__name__ + "_")
+
+    def _add(self, cls: type, target: str, prefix: str):
+        this = [] if target == "service" else [("this", target)]
+        for prop, typ in cls.rpc_properties.items():
+            self._add_procedure(_Procedure(f"{prefix}get_{prop}", target, "get", snake_case(prop), this, typ))
+        for prop, typ in cls.rpc_writable.items():
+            self._add_procedure(_Procedure(f"{prefix}set_{prop}", target, "set", snake_case(prop), this + [("value", typ)], None))
+        for method, (parameters, return_type) in cls.rpc_methods.items():
+            self._add_procedure(_Procedure(f"{prefix}{method}", target, "call", snake_case(method), this + parameters, return_type))
+
+    def _add_procedure(self, procedure: _Procedure):
+        procedure.types = [self.types.as_type(_protobuf_type(p[1], self.name)) for p in procedure.parameters]
+        procedure.return_typ = (
+            None if procedure.return_type is None else self.types.as_type(_protobuf_type(procedure.return_type, self.name))
+        )
+        self.procedures[procedure.name] = procedure
+
+    def describe(self) -> KRPC.Service:
+        service = KRPC.Service(name=self.name)
+        for procedure in self.procedures.values():
+            message = service.procedures.add(name=procedure.name)
+            for parameter, typ in zip(procedure.parameters, procedure.types):
+                message_parameter = message.parameters.add(name=parameter[0])
+                message_parameter.type.CopyFrom(_protobuf_type(parameter[1], self.name))
+                if len(parameter) > 2:
+                    message_parameter.default_value = Encoder.encode(parameter[2], typ)
+                    message_parameter.nullable = parameter[2] is None
+            if procedure.return_type is not None:
+                message.return_type.CopyFrom(_protobuf_type(procedure.return_type, self.name))
+                message.return_is_nullable = isinstance(procedure.return_typ, ClassType)
+        for name in self.classes:
+            service.classes.add(name=name)
+        for name, enumeration in ENUMERATIONS.items():
+            if self.name == "SpaceCenter":
+                message = service.enumerations.add(name=name)
+                for value in enumeration:
+                    message.values.add(name="".join(word.title() for word in value.name.split("_")), value=value.value)
+        return service
+
+
+class _KRPCService:
+    # Procedures of the KRPC service, answered for one client connection
+    rpc_properties = {"Clients": "list(tuple(bytes, string, string))"}
+    rpc_writable: Dict[str, str] = {}
+    rpc_methods = {
+        "GetServices": ([], "Services"),
+        "GetStatus": ([], "Status"),
+        "GetClientID": ([], "bytes"),
+        "GetClientName": ([], "string"),
+        "AddStream": ([("call", "ProcedureCall"), ("start", "bool", True)], "Stream"),
+        "StartStream": ([("id", "uint64")], None),
+        "SetStreamRate": ([("id", "uint64"), ("rate", "float")], None),
+        "RemoveStream": ([("id", "uint64")], None),
+    }
+
+
+class _Stream:
+    def __init__(self, stream_id: int, call: KRPC.ProcedureCall):
+        self.id = stream_id
+        self.call = call
+        self.started = False
+        self.rate = 0.0
+        self.last_sent = 0.0
+        self.last_value: Optional[bytes] = None
+
+
+class _ClientSession:
+    def __init__(self, server: "StandInServer", rpc_socket: socket.socket, name: str):
+        self.server = server
+        self.rpc_socket = rpc_socket
+        self.stream_socket: Optional[socket.socket] = None
+        self.identifier = os.urandom(16)
+        self.name = name
+        self.streams: Dict[int, _Stream] = {}
+        self._streams_by_call: Dict[bytes, int] = {}
+
+    # KRPC service procedures
+    def get_services(self) -> KRPC.Services:
+        return self.server.services_message
+
+    def get_status(self) -> KRPC.Status:
+        return KRPC.Status(
+            version="0.4.8",
+            rpcs_executed=self.server.rpcs_executed,
+            stream_rpcs=len(self.streams),
+            stream_rpcs_executed=self.server.stream_rpcs_executed,
+        )
+
+    def get_client_id(self) -> bytes:
+        return self.identifier
+
+    def get_client_name(self) -> str:
+        return self.name
+
+    @property
+    def clients(self) -> list:
+        return [(session.identifier, session.name, "127.0.0.1") for session in self.server.sessions]
+
+    def add_stream(self, call: KRPC.ProcedureCall, start: bool = True) -> KRPC.Stream:
+        # Identical calls share one stream, like on the real server
+        key = call.SerializeToString()
+        if key not in self._streams_by_call:
+            stream = _Stream(self.server.next_stream_id(), call)
+            self.streams[stream.id] = stream
+            self._streams_by_call[key] = stream.id
+        stream = self.streams[self._streams_by_call[key]]
+        if start:
+            stream.started = True
+        return KRPC.Stream(id=stream.id)
+
+    def start_stream(self, id: int):
+        self._stream(id).started = True
+
+    def set_stream_rate(self, id: int, rate: float):
+        self._stream(id).rate = rate
+
+    def remove_stream(self, id: int):
+        stream = self.streams.pop(id, None)
+        if stream is not None:
+            del self._streams_by_call[stream.call.SerializeToString()]
+
+    def _stream(self, stream_id: int) -> _Stream:
+        if stream_id not in self.streams:
+            raise ValueError(f"No stream with id {stream_id}")
+        return self.streams[stream_id]
+
+    def stream_update(self, now: float) -> Optional[KRPC.StreamUpdate]:
+        # Results of the streams that are due and whose value changed since they were last sent
+        update = KRPC.StreamUpdate()
+        for stream in list(self.streams.values()):
+            if not stream.started or (stream.rate > 0 and now - stream.last_sent < 1 / stream.rate):
+                continue
+            result = self.server.execute(self, stream.call)
+            self.server.stream_rpcs_executed += 1
+            value = result.SerializeToString()
+            if value == stream.last_value:
+                continue
+            stream.last_value = value
+            stream.last_sent = now
+            update.results.add(id=stream.id, result=result)
+        return update if update.results else None
+
+
+class StandInServer:
+    def __init__(
+        self,
+        scenario: str = "rocket",
+        address: str = address,
+        rpc_port: int = rpc_port,
+        stream_port: int = stream_port,
+        time_scale: float = time_scale,
+        physics_rate: float = physics_rate,
+    ):
+        self.sim = Simulation(scenario)
+        self.address = address
+        self.time_scale = time_scale
+        self.physics_rate = physics_rate
+        self.sessions: List[_ClientSession] = []
+        self.rpcs_executed = 0
+        self.stream_rpcs_executed = 0
+        self._stream_ids = itertools.count(1)
+        self._running = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.services = {
+            "KRPC": _Service("KRPC", _KRPCService, []),
+            "SpaceCenter": _Service(
+                "SpaceCenter",
+                SpaceCenter,
+                [
+                    Vessel, Flight, Orbit, CelestialBody, ReferenceFrame, Control, AutoPilot, Node, Parts, Part, Engine,
+                    Experiment, ScienceSubject, ScienceData, Resources, WaypointManager, Waypoint,
+                ],
+            ),
+        }
+        self.services_message = KRPC.Services(services=[service.describe() for service in self.services.values()])
+        self._rpc_listener = self._listen(rpc_port)
+        self._stream_listener = self._listen(stream_port)
+        # Actual ports, when 0 was passed to pick free ones
+        self.rpc_port = self._rpc_listener.getsockname()[1]
+        self.stream_port = self._stream_listener.getsockname()[1]
+
+    def _listen(self, port: int) -> socket.socket:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.address, port))
+        listener.listen()
+        return listener
+
+    def next_stream_id(self) -> int:
+        return next(self._stream_ids)
+
+    def start(self) -> "StandInServer":
+        self._running.set()
+        for target in (self._accept_rpc, self._accept_stream, self._physics_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Stand-in kRPC server listening on {self.address}:{self.rpc_port} (streams on {self.stream_port})")
+        return self
+
+    def stop(self):
+        self._running.clear()
+        for listener in (self._rpc_listener, self._stream_listener):
+            listener.close()
+        for session in list(self.sessions):
+            for sock in (session.rpc_socket, session.stream_socket):
+                if sock is not None:
+                    sock.close()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self._running.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _accept_rpc(self):
+        while self._running.is_set():
+            try:
+                sock, _ = self._rpc_listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve_client, args=(sock,), daemon=True).start()
+
+    def _accept_stream(self):
+        while self._running.is_set():
+            try:
+                sock, _ = self._stream_listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            request = receive_message(sock, KRPC.ConnectionRequest)
+            session = next((s for s in self.sessions if s.identifier == request.client_identifier), None)
+            if request.type != KRPC.ConnectionRequest.STREAM or session is None:
+                send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.WRONG_TYPE, message="Unknown client"))
+                sock.close()
+                continue
+            session.stream_socket = sock
+            send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.OK))
+
+    def _serve_client(self, sock: socket.socket):
+        request = receive_message(sock, KRPC.ConnectionRequest)
+        if request.type != KRPC.ConnectionRequest.RPC:
+            send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.WRONG_TYPE, message="Expected an RPC connection"))
+            sock.close()
+            return
+        session = _ClientSession(self, sock, request.client_name)
+        with self.sim.lock:
+            self.sessions.append(session)
+        send_message(sock, KRPC.ConnectionResponse(status=KRPC.ConnectionResponse.OK, client_identifier=session.identifier))
+        logger.info(f"Client connected: '{session.name}'")
+        try:
+            while True:
+                request = receive_message(sock, KRPC.Request)
+                self.rpcs_executed += len(request.calls)
+                response = KRPC.Response()
+                response.results.extend(self.execute(session, call) for call in request.calls)
+                send_message(sock, response)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.sim.lock:
+                self.sessions.remove(session)
+            if session.stream_socket is not None:
+                session.stream_socket.close()
+            logger.info(f"Client disconnected: '{session.name}'")
+
+    def execute(self, session: _ClientSession, call: KRPC.ProcedureCall) -> KRPC.ProcedureResult:
+        result = KRPC.ProcedureResult()
+        try:
+            service = self.services.get(call.service)
+            if service is None or call.procedure not in service.procedures:
+                raise ValueError(f"Procedure {call.service}.{call.procedure} not found")
+            procedure = service.procedures[call.procedure]
+            with self.sim.lock:
+                value = self._invoke(session, service, procedure, call)
+                if procedure.return_typ is not None:
+                    result.value = Encoder.encode(value, procedure.return_typ)
+        except Exception as e:
+            result.error.CopyFrom(KRPC.Error(description=f"{type(e).__name__}: {e}", stack_trace=traceback.format_exc()))
+        return result
+
+    def _invoke(self, session: _ClientSession, service: _Service, procedure: _Procedure, call: KRPC.ProcedureCall):
+        args = [parameter[2] if len(parameter) > 2 else None for parameter in procedure.parameters]
+        given = set()
+        for argument in call.arguments:
+            typ = procedure.types[argument.position]
+            if isinstance(typ, ClassType):
+                args[argument.position] = self.sim.get_object(Decoder.decode(None, argument.value, self._uint64))
+            elif isinstance(typ, EnumerationType):
+                value = Decoder.decode(None, argument.value, self._sint32)
+                args[argument.position] = ENUMERATIONS[procedure.parameters[argument.position][1]](value)
+            else:
+                args[argument.position] = Decoder.decode(None, argument.value, typ)
+            given.add(argument.position)
+        missing = [p[0] for i, p in enumerate(procedure.parameters) if len(p) < 3 and i not in given]
+        if missing:
+            raise ValueError(f"Missing arguments {missing} for {procedure.name}")
+
+        if procedure.target == "service":
+            target = session if service.name == "KRPC" else self.sim.space_center
+        else:
+            target = args.pop(0)
+            if target is None:
+                raise ValueError(f"{procedure.name} called on a null object")
+        if procedure.kind == "get":
+            return getattr(target, procedure.attribute)
+        if procedure.kind == "set":
+            setattr(target, procedure.attribute, args[0])
+            return None
+        return getattr(target, procedure.attribute)(*args)
+
+    _uint64 = Types().uint64_type
+    _sint32 = Types().sint32_type
+
+    def _physics_loop(self):
+        period = 1 / self.physics_rate
+        next_tick = time.perf_counter()
+        while self._running.is_set():
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running behind, skip the missed ticks instead of trying to catch up
+                next_tick = time.perf_counter()
+            with self.sim.lock:
+                self.sim.advance(period * self.time_scale)
+                now = time.perf_counter()
+                updates = [(session, session.stream_update(now)) for session in self.sessions if session.stream_socket]
+            for session, update in updates:
+                if update is None:
+                    continue
+                try:
+                    send_message(session.stream_socket, update)
+                except OSError:
+                    session.stream_socket = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for the kRPC server of KSP")
+    parser.add_argument("scenario", nargs="?", default="rocket", choices=sorted(SCENARIOS))
+    parser.add_argument("--time-scale", type=float, default=time_scale, help="Game seconds per wall clock second")
+    parser.add_argument("--rpc-port", type=int, default=rpc_port)
+    parser.add_argument("--stream-port", type=int, default=stream_port)
+    args = parser.parse_args()
+
+    StandInServer(args.scenario, rpc_port=args.rpc_port, stream_port=args.stream_port, time_scale=args.time_scale).serve_forever()
@@ -0,0 +1,196 @@
+import threading
+import weakref
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def object_key(obj) -> Tuple[str, int]:
+    # Proxies of the same remote object share a key, services (e.g. space_center) have no object id
+    return type(obj).__name__, getattr(obj, "_object_id", 0)
+
+
+def stream_key(func, *args) -> Hashable:
+    # Key of a conn.add_stream(func, *args) call, equal for every call that streams the same value
+    if func is getattr:
+        obj, attribute = args
+        return object_key(obj) + (attribute,)
+    arguments = tuple(object_key(a) if hasattr(a, "_object_id") else a for a in args)
+    owner = getattr(func, "__self__", None)
+    if owner is None:
+        # Not a method of a remote object, only calls of the same function share a stream
+        return (func,) + arguments
+    return object_key(owner) + (func.__name__,) + arguments
+
+
+class Demand:
+    # How often a consumer needs the values of some streams, in Hz. Holds until end() is called or the with block
+    # it is used in is left, e.g. for one phase of flight:
+    #   with registry.demand(100, pitch, heading):
+    #       ascend()
+    def __init__(self, registry: "StreamRegistry", keys: Tuple[Hashable, ...], rate: float):
+        self._registry = registry
+        self.keys = keys
+        self.rate = rate
+        self.ended = False
+
+    def end(self):
+        if not self.ended:
+            self.ended = True
+            self._registry._end_demand(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end()
+
+
+class StreamHandle:
+    # One user's reference to a shared stream. Call it like a stream, release it when done.
+    def __init__(self, registry: "StreamRegistry", key: Hashable, stream, demand: Optional[Demand] = None):
+        self._registry = registry
+        self.key = key
+        self.stream = stream
+        self._demand = demand
+        self.released = False
+
+    def __call__(self):
+        return self.stream()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            if self._demand is not None:
+                self._demand.end()
+            self._registry._release(self.key)
+
+
+class StreamRegistry:
+    # Shares streams between everything that reads the same value over one connection. Each acquire() adds a
+    # reference, and the stream is removed from the server when the last one is released, so the server only
+    # sends values somebody still reads.
+    # Consumers declare how often they need a value, either for as long as they hold the stream (acquire(rate=...))
+    # or for a phase of flight (demand()). Each stream runs at the highest rate currently declared for it and slows
+    # down again when that demand ends. Streams without any declared demand run as fast as the server sends them.
+    # Declare about twice the rate a value is read at, a stream running at exactly that rate can be a whole period
+    # behind when it is read.
+    # Usage:
+    #   registry = StreamRegistry(conn)
+    #   thrust = registry.acquire(getattr, vessel, "thrust", rate=10)
+    #   thrust()
+    #   thrust.release()
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        # key -> [stream, references, rate set on the server]
+        self._streams: Dict[Hashable, list] = {}
+        self._demands: Dict[Hashable, List[Demand]] = {}
+
+    def __len__(self):
+        return len(self._streams)
+
+    def acquire(self, func, *args, rate: Optional[float] = None) -> StreamHandle:
+        # 'rate' is how often the caller needs the value in Hz, until the handle is released
+        key = stream_key(func, *args)
+        with self._lock:
+            entry = self._streams.get(key)
+            if entry is None:
+                entry = self._streams[key] = [self.conn.add_stream(func, *args), 0, 0.0]
+                self._tune(key)
+            entry[1] += 1
+        demand = None if rate is None else self.demand(rate, key)
+        return StreamHandle(self, key, entry[0], demand)
+
+    def demand(self, rate: float, *streams) -> Demand:
+        # Declare that 'streams' (handles, LazyStreams or keys) are needed at 'rate' Hz until the demand ends
+        keys = tuple(getattr(stream, "key", stream) for stream in streams)
+        demand = Demand(self, keys, rate)
+        with self._lock:
+            for key in keys:
+                self._demands.setdefault(key, []).append(demand)
+                self._tune(key)
+        return demand
+
+    def rate(self, key: Hashable) -> float:
+        # Rate the stream runs at, 0 is as fast as possible
+        demands = self._demands.get(key)
+        return max(demand.rate for demand in demands) if demands else 0.0
+
+    def _end_demand(self, demand: Demand):
+        with self._lock:
+            for key in demand.keys:
+                demands = self._demands[key]
+                demands.remove(demand)
+                if not demands:
+                    del self._demands[key]
+                self._tune(key)
+
+    def _tune(self, key: Hashable):
+        # Called with the lock held. Only sends the rate to the server when it changes.
+        entry = self._streams.get(key)
+        rate = self.rate(key)
+        if entry is not None and entry[2] != rate:
+            entry[0].rate = rate
+            entry[2] = rate
+
+    def _release(self, key: Hashable):
+        # Removed with the lock held like acquire() adds, the client hands out the same stream object for the same
+        # call, so a removal after the lock was released could remove a stream another thread just acquired again
+        with self._lock:
+            entry = self._streams[key]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._streams[key]
+            entry[0].remove()
+
+
+_registries: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_registries_lock = threading.Lock()
+
+
+def registry_for(conn) -> StreamRegistry:
+    # The registry of a connection. The client shares one stream per call between everything that adds it, so all
+    # users of a connection must go through the same registry.
+    with _registries_lock:
+        registry = _registries.get(conn)
+        if registry is None:
+            registry = _registries[conn] = StreamRegistry(conn)
+        return registry
+
+
+class LazyStream:
+    # Callable like a stream, but only acquires it on the first call, so defining one costs nothing.
+    # The stream is released by release() or once the LazyStream is garbage collected.
+    # Usage:
+    #   vessel_thrust = LazyStream(lambda: registry.acquire(getattr, vessel, "thrust"))
+    def __init__(self, acquire: Callable[[], StreamHandle]):
+        self._acquire = acquire
+        self._lock = threading.Lock()
+        self._handle: Optional[StreamHandle] = None
+        self._finalizer = None
+
+    @property
+    def handle(self) -> StreamHandle:
+        handle = self._handle
+        if handle is None:
+            with self._lock:
+                if self._handle is None:
+                    self._handle = self._acquire()
+                    self._finalizer = weakref.finalize(self, self._handle.release)
+                handle = self._handle
+        return handle
+
+    @property
+    def key(self) -> Hashable:
+        return self.handle.key
+
+    def __call__(self):
+        return self.handle()
+
+    def release(self):
+        # The next call acquires the stream again
+        with self._lock:
+            if self._handle is not None:
+                self._finalizer.detach()
+                self._handle.release()
+                self._handle = None
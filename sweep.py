@@ -0,0 +1,88 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from stand_in_server import KERBIN_ATMOSPHERE_DEPTH, KERBIN_SCALE_HEIGHT, SEA_LEVEL_DENSITY
+
+# A NamedTuple of parameters, every field a scalar or an array with one value per candidate
+P = TypeVar("P", bound=NamedTuple)
+
+
+def atmospheric_densities(altitude: np.ndarray) -> np.ndarray:
+    # atmospheric_density of the stand-in server for an array of altitudes
+    density = SEA_LEVEL_DENSITY * np.exp(-np.maximum(0.0, altitude) / KERBIN_SCALE_HEIGHT)
+    return np.where(altitude >= KERBIN_ATMOSPHERE_DEPTH, 0.0, density)
+
+
+def candidate_count(p: NamedTuple) -> int:
+    return max(np.size(value) for value in p)
+
+
+def broadcast(p: P) -> P:
+    # Every field as an array of one value per candidate
+    n = candidate_count(p)
+    return type(p)(*(np.broadcast_to(np.asarray(value), (n,)) for value in p))
+
+
+def sample_parameters(n: int, ranges: Dict[str, Tuple[float, float]], base: P, seed: int = 0) -> P:
+    # 'n' candidates with the fields in 'ranges' drawn uniformly, the first candidate is 'base' itself
+    rng = np.random.default_rng(seed)
+    values = {}
+    for name, value in base._asdict().items():
+        if name in ranges:
+            low, high = ranges[name]
+            values[name] = np.concatenate([[value], rng.uniform(low, high, n - 1)])
+        else:
+            values[name] = np.full(n, value)
+    return type(base)(**values)
+
+
+def grid_parameters(ranges: Dict[str, Tuple[float, float]], points: int, base: P) -> P:
+    # Every combination of 'points' evenly spaced values of each field in 'ranges', after 'base' itself
+    axes = [np.linspace(low, high, points) for low, high in ranges.values()]
+    grid = np.array(list(itertools.product(*axes))).reshape(-1, len(axes))
+    values = {}
+    for name, value in base._asdict().items():
+        if name in ranges:
+            values[name] = np.concatenate([[value], grid[:, list(ranges).index(name)]])
+        else:
+            values[name] = np.full(len(grid) + 1, value)
+    return type(base)(**values)
+
+
+def parse_ranges(assignments: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+    # NAME=LOW:HIGH assignments from the command line
+    ranges = {}
+    for assignment in assignments:
+        name, span = assignment.split("=", 1)
+        low, high = span.split(":")
+        ranges[name] = (float(low), float(high))
+    return ranges
+
+
+def _simulate_chunk(arguments) -> Dict[str, np.ndarray]:
+    simulate, model, p, kwargs = arguments
+    return simulate(model, p, **kwargs)
+
+
+def simulate_parallel(
+    simulate: Callable[..., Dict[str, np.ndarray]],
+    model,
+    p: NamedTuple,
+    workers: Optional[int] = None,
+    chunk_size: int = 256,
+    **kwargs,
+) -> Dict[str, np.ndarray]:
+    # simulate(model, p, **kwargs) with the candidates split in chunks over a process pool, each chunk is still
+    # vectorized. 'simulate' must be a module level function so the workers can import it.
+    p = broadcast(p)
+    n = candidate_count(p)
+    chunks = [
+        (simulate, model, type(p)(*(value[start : start + chunk_size] for value in p)), kwargs)
+        for start in range(0, n, chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_simulate_chunk, chunks))
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
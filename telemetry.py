@@ -0,0 +1,135 @@
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from streams import registry_for
+
+
+class TelemetrySnapshot:
+    # Immutable set of telemetry values that all arrived in the same stream update message.
+    # Subclasses created by Telemetry add one slot per field.
+    __slots__ = ("frame",)
+
+    def __init__(self, frame: int, values: Dict[str, object]):
+        object.__setattr__(self, "frame", frame)
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Telemetry snapshots are read only, cannot set '{name}'")
+
+    def as_dict(self) -> Dict[str, object]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"TelemetrySnapshot(frame={self.frame}, {fields})"
+
+
+class Telemetry:
+    # Streams a declared set of fields and publishes them together, once per stream update message.
+    # Usage:
+    #   telemetry = Telemetry(conn, {"pitch": (vessel.flight(), "pitch"), "apoapsis": (vessel.orbit, "apoapsis_altitude")})
+    #   t = telemetry.snapshot()
+    #   t.pitch, t.apoapsis
+    # Control loops iterate over frames() instead of sleeping and polling:
+    #   for t in telemetry.frames(max_rate=100):
+    #       ...
+    # 'rate' is how often the fields are needed in Hz, lower it with set_rate() when a phase of flight ends.
+    def __init__(self, conn, fields: Dict[str, Tuple[object, str]], rate: Optional[float] = None):
+        self.conn = conn
+        self.fields = fields
+        self.rate = rate
+        self.condition = threading.Condition()
+        self._snapshot_class = type("TelemetrySnapshot", (TelemetrySnapshot,), {"__slots__": tuple(fields)})
+        self._frame = 0
+        self._dirty = False
+        self._closed = False
+        self._listeners = []
+
+        self._registry = registry_for(conn)
+        self._streams = {}
+        self._callbacks = {}
+        for name, (obj, attribute) in fields.items():
+            self._streams[name] = self._registry.acquire(getattr, obj, attribute)
+            self._callbacks[name] = self._make_callback(name)
+        self._demand = None if rate is None else self._registry.demand(rate, *self._streams.values())
+        # Latest value of each field, only written from the stream update thread after the initial read
+        self._values: Dict[str, object] = {name: stream() for name, stream in self._streams.items()}
+        for name, handle in self._streams.items():
+            handle.stream.add_callback(self._callbacks[name])
+        conn.add_stream_update_callback(self._on_update)
+        self._snapshot = self._snapshot_class(self._frame, self._values)
+
+    def _make_callback(self, name: str):
+        def callback(value):
+            self._values[name] = value
+            self._dirty = True
+
+        return callback
+
+    def _on_update(self):
+        # Called once after all streams of an update message have been processed
+        if not self._dirty:
+            return
+        self._dirty = False
+        snapshot = self._snapshot_class(self._frame + 1, self._values)
+        with self.condition:
+            self._frame += 1
+            self._snapshot = snapshot
+            self.condition.notify_all()
+        for listener in self._listeners:
+            listener(snapshot)
+
+    def set_rate(self, rate: Optional[float]):
+        # None drops the demand, the streams then run at the rate other users need or as fast as possible
+        if self._demand is not None:
+            self._demand.end()
+        self.rate = rate
+        self._demand = None if rate is None else self._registry.demand(rate, *self._streams.values())
+
+    def add_listener(self, listener):
+        # Called with every published snapshot, from the stream update thread
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def snapshot(self) -> TelemetrySnapshot:
+        with self.condition:
+            return self._snapshot
+
+    def wait(self, after_frame: int, timeout: Optional[float] = None) -> TelemetrySnapshot:
+        # Block until a snapshot newer than 'after_frame' is published or the timeout passes, returns the latest one
+        with self.condition:
+            self.condition.wait_for(lambda: self._frame > after_frame or self._closed, timeout)
+            return self._snapshot
+
+    def frames(self, max_rate: Optional[float] = None, timeout: Optional[float] = 1.0) -> Iterator[TelemetrySnapshot]:
+        # Yields every fresh snapshot once, woken by stream updates instead of a fixed sleep.
+        # Snapshots published while the loop body runs are skipped in favour of the newest one.
+        # max_rate caps how often the loop runs in Hz. The server only sends values that changed, so if nothing
+        # arrives for 'timeout' seconds the latest snapshot is yielded again to keep the controller running.
+        min_period = 1 / max_rate if max_rate else 0
+        frame = -1
+        last_yield = 0.0
+        while not self._closed:
+            if min_period:
+                delay = last_yield + min_period - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            snapshot = self.wait(frame, timeout)
+            frame = snapshot.frame
+            last_yield = time.perf_counter()
+            yield snapshot
+
+    def close(self):
+        self.conn.remove_stream_update_callback(self._on_update)
+        if self._demand is not None:
+            self._demand.end()
+        for name, handle in self._streams.items():
+            handle.stream.remove_callback(self._callbacks[name])
+            handle.release()
+        with self.condition:
+            self._closed = True
+            self.condition.notify_all()
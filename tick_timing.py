@@ -0,0 +1,279 @@
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, List, Optional, TypeVar
+
+from loguru import logger
+
+# CONFIG
+# Serve the timings of every loop as plain text on this local port, e.g. 8787 for http://127.0.0.1:8787/
+# None to not serve them
+serve_port: Optional[int] = None
+serve_address = "127.0.0.1"
+
+T = TypeVar("T")
+
+_local = threading.local()
+
+
+def _rpc_seconds() -> float:
+    # Seconds the current thread spent on RPCs of instrumented connections so far
+    return getattr(_local, "rpc_seconds", 0.0)
+
+
+class _TimedLock:
+    # Stands in for the client's RPC lock. The lock is held for the whole request and response, so the time from
+    # asking for it to releasing it is the time the thread spent on the RPC, including waiting for other threads'.
+    def __init__(self, lock):
+        self._lock = lock
+
+    def __enter__(self):
+        _local.rpc_start = time.perf_counter()
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+        _local.rpc_seconds = _rpc_seconds() + time.perf_counter() - _local.rpc_start
+
+
+def instrument(conn):
+    # Count the time spent on the connection's RPCs towards the loops that make them. Safe to call more than once.
+    # Connections without an RPC lock, like the one replay.py runs scripts with, are left alone.
+    lock = getattr(conn, "_rpc_connection_lock", None)
+    if lock is not None and not isinstance(lock, _TimedLock):
+        conn._rpc_connection_lock = _TimedLock(lock)
+    return conn
+
+
+class Histogram:
+    # Counts durations in log-linear buckets like an HdrHistogram: exact up to 'sub_buckets' microseconds, then
+    # within 2 / sub_buckets of the value, about 1.6% by default, from a microsecond to hours in under 2000 counters.
+    # Recording is a couple of integer operations, so it can run in every tick of a 100 Hz loop.
+    def __init__(self, sub_buckets: int = 128):
+        assert sub_buckets & (sub_buckets - 1) == 0, "sub_buckets must be a power of two"
+        self.sub_buckets = sub_buckets
+        self._bits = sub_buckets.bit_length() - 1
+        self._half = sub_buckets // 2
+        self.counts: List[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, microseconds: int) -> int:
+        if microseconds < self.sub_buckets:
+            return microseconds
+        shift = microseconds.bit_length() - self._bits
+        return self.sub_buckets + (shift - 1) * self._half + (microseconds >> shift) - self._half
+
+    def _upper(self, index: int) -> int:
+        # Largest value counted in bucket 'index', in microseconds
+        if index < self.sub_buckets:
+            return index
+        shift, offset = divmod(index - self.sub_buckets, self._half)
+        return ((offset + self._half + 1) << (shift + 1)) - 1
+
+    def record(self, seconds: float):
+        index = self._index(max(0, int(seconds * 1e6)))
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        # Seconds that 'percent' of the recorded values are at or below, 0 if there are none
+        if not self.count:
+            return 0.0
+        rank = max(1, round(percent / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper(index) / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f} ms"
+
+
+class _Window:
+    # Histograms of one reporting window, or of the whole run
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.period = Histogram()
+        self.busy = Histogram()
+        self.rpc = Histogram()
+        self.compute = Histogram()
+        self.ticks = 0
+        self.overruns = 0
+
+    @property
+    def rate(self) -> float:
+        # Ticks per second, from the time between the ticks of the window
+        return self.period.count / self.period.total if self.period.total > 0 else 0.0
+
+    def describe(self, name: str, interval: Optional[float]) -> str:
+        target = f" of {1 / interval:.0f} Hz" if interval else ""
+        return (
+            f"{name}: {self.rate:.1f} Hz{target}, tick p50 {_ms(self.period.percentile(50))}"
+            f" p99 {_ms(self.period.percentile(99))} max {_ms(self.period.max)}, busy p99 {_ms(self.busy.percentile(99))}"
+            f" (rpc {_ms(self.rpc.percentile(99))}, compute {_ms(self.compute.percentile(99))}), {self.overruns} overruns"
+        )
+
+
+_timers: "weakref.WeakSet[TickTimer]" = weakref.WeakSet()
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+class TickTimer:
+    # Measures how well a loop keeps its rate: the time between ticks, the time the body of a tick takes and how
+    # much of that is spent on RPCs and how much computing. A tick whose body takes longer than 'interval' is an
+    # overrun. Every 'report_interval' seconds a summary line is logged, as a warning if the loop ran slower than
+    # 'min_rate_fraction' of its target rate or overran.
+    # Usage:
+    #   timing = TickTimer("ascent", interval=0.01, conn=conn)
+    #   for t in timing.track(telemetry.frames(max_rate=100)):
+    #       ...
+    # or for any other loop:
+    #   while 1:
+    #       with timing.tick():
+    #           ...
+    # 'conn' is instrumented so RPC time can be told apart from compute time, see instrument(). The helper's
+    # connection always is.
+    def __init__(
+        self,
+        name: str,
+        interval: Optional[float] = None,
+        conn=None,
+        report_interval: Optional[float] = 10.0,
+        min_rate_fraction: float = 0.9,
+    ):
+        self.name = name
+        self.interval = interval
+        self.report_interval = report_interval
+        self.min_rate_fraction = min_rate_fraction
+        if conn is not None:
+            instrument(conn)
+        self.total = _Window()
+        self.window = _Window()
+        self._lock = threading.Lock()
+        self._last_start: Optional[float] = None
+        _timers.add(self)
+        if serve_port is not None:
+            serve(serve_port, serve_address)
+
+    def begin(self):
+        # Start of a tick
+        now = time.perf_counter()
+        if self._last_start is not None:
+            period = now - self._last_start
+            with self._lock:
+                self.total.period.record(period)
+                self.window.period.record(period)
+        self._last_start = now
+        self._rpc_start = _rpc_seconds()
+
+    def end(self):
+        # End of the body of the tick started by begin()
+        now = time.perf_counter()
+        busy = now - self._last_start
+        rpc = _rpc_seconds() - self._rpc_start
+        overrun = self.interval is not None and busy > self.interval
+        with self._lock:
+            for window in (self.total, self.window):
+                window.busy.record(busy)
+                window.rpc.record(rpc)
+                window.compute.record(max(0.0, busy - rpc))
+                window.ticks += 1
+                window.overruns += overrun
+        if self.report_interval is not None and now - self.window.start >= self.report_interval:
+            self._report_window()
+
+    @contextmanager
+    def tick(self):
+        self.begin()
+        try:
+            yield
+        finally:
+            self.end()
+
+    def track(self, iterable: Iterable[T]) -> Iterator[T]:
+        # Yields the items of 'iterable', timing the loop body between them as a tick
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                self.begin()
+                try:
+                    yield item
+                finally:
+                    self.end()
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _report_window(self):
+        with self._lock:
+            window, self.window = self.window, _Window()
+        line = window.describe(self.name, self.interval)
+        too_slow = self.interval is not None and window.rate < self.min_rate_fraction / self.interval
+        if too_slow or window.overruns:
+            logger.warning(line)
+        else:
+            logger.info(line)
+
+    def report(self) -> str:
+        # Percentiles over the whole run
+        with self._lock:
+            total = self.total
+            lines = [total.describe(self.name, self.interval)]
+            lines.append(f"{'':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'p99.9':>10}{'max':>10}  ms, {total.ticks} ticks")
+            for label, histogram in (
+                ("tick", total.period),
+                ("busy", total.busy),
+                ("rpc", total.rpc),
+                ("compute", total.compute),
+            ):
+                values = [histogram.percentile(p) for p in (50, 90, 99, 99.9)] + [histogram.max]
+                lines.append(f"{label:>10}" + "".join(f"{value * 1000:>10.2f}" for value in values))
+        return "\n".join(lines)
+
+
+def report() -> str:
+    # Timings of every loop of this process
+    return "\n\n".join(timer.report() for timer in sorted(_timers, key=lambda timer: timer.name)) + "\n"
+
+
+class _ReportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = report().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, address: str = serve_address) -> ThreadingHTTPServer:
+    # Serve report() at http://address:port/ from a background thread, once per process
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((address, port), _ReportHandler)
+            threading.Thread(target=_server.serve_forever, name="tick timing", daemon=True).start()
+            logger.info(f"Serving tick timings at http://{address}:{port}/")
+    return _server
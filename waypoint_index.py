@@ -0,0 +1,251 @@
+import math
+import threading
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from handles import handles_for
+from helper import RankedWaypoint, rank_by_distance, read_waypoints, waypoint_mask
+from streams import registry_for
+
+Cell = Tuple[int, int, int]
+
+
+def unit_vector(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+class SphereGrid:
+    # Points on a sphere, bucketed by their unit vector into cubic cells of 'cell_size' (a chord length on the unit
+    # sphere, 0.02 is about 12 km on Kerbin). A query only visits the cells around its position, so it costs the
+    # number of points near it instead of the number of points in the grid. Works the same at the poles and across
+    # the antimeridian, unlike latitude/longitude buckets.
+    def __init__(self, cell_size: float = 0.02):
+        self.cell_size = cell_size
+        self._cells: Dict[Cell, Set[object]] = {}
+        self._points: Dict[object, Tuple[Tuple[float, float, float], Cell]] = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, vector: Tuple[float, float, float]) -> Cell:
+        return tuple(math.floor(c / self.cell_size) for c in vector)
+
+    def add(self, key, latitude: float, longitude: float):
+        self.remove(key)
+        vector = unit_vector(latitude, longitude)
+        cell = self._cell(vector)
+        self._points[key] = (vector, cell)
+        self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = point[1]
+        self._cells[cell].discard(key)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def _shell(self, center: Cell, r: int) -> Iterator[Cell]:
+        # Cells at exactly Chebyshev distance r from the center cell
+        x, y, z = center
+        if r == 0:
+            yield center
+            return
+        for dx in range(-r, r + 1):
+            for dy in range(-r, r + 1):
+                if abs(dx) == r or abs(dy) == r:
+                    for dz in range(-r, r + 1):
+                        yield x + dx, y + dy, z + dz
+                else:
+                    yield x + dx, y + dy, z - r
+                    yield x + dx, y + dy, z + r
+
+    def _chord(self, vector, key) -> float:
+        other = self._points[key][0]
+        return math.sqrt(sum((a - b) ** 2 for a, b in zip(vector, other)))
+
+    def nearest(
+        self, latitude: float, longitude: float, k: int = 1, accept: Optional[Callable[[object], bool]] = None
+    ) -> List[Tuple[float, object]]:
+        # Up to k (angle in radians, key) pairs closest to the position, nearest first, only keys 'accept' allows
+        vector = unit_vector(latitude, longitude)
+        center = self._cell(vector)
+        found: List[Tuple[float, object]] = []
+        visited: Set[Cell] = set()
+        r = 0
+        while len(visited) < len(self._cells):
+            # Once a shell holds more cells than there are occupied ones, scanning the occupied cells is cheaper
+            shell = self._shell(center, r) if 24 * r * r + 2 <= len(self._cells) - len(visited) else list(self._cells)
+            for cell in shell:
+                if cell in visited or cell not in self._cells:
+                    continue
+                visited.add(cell)
+                found.extend(
+                    (self._chord(vector, key), key) for key in self._cells[cell] if accept is None or accept(key)
+                )
+            found.sort(key=lambda f: f[0])
+            # Points in cells further out than shell r are at least r cells away
+            if len(found) >= k and found[k - 1][0] <= r * self.cell_size:
+                break
+            r += 1
+        return [(2 * math.asin(min(1.0, chord / 2)), key) for chord, key in found[:k]]
+
+    def within(
+        self, latitude: float, longitude: float, angle: float, accept: Optional[Callable[[object], bool]] = None
+    ) -> List[Tuple[float, object]]:
+        # All (angle in radians, key) pairs within 'angle' radians of the position, nearest first
+        vector = unit_vector(latitude, longitude)
+        center = self._cell(vector)
+        max_chord = 2 * math.sin(min(angle, math.pi) / 2)
+        reach = math.ceil(max_chord / self.cell_size)
+        if (2 * reach + 1) ** 3 > len(self._cells):
+            cells = [cell for cell in self._cells if max(abs(a - b) for a, b in zip(cell, center)) <= reach]
+        else:
+            cells = [cell for r in range(reach + 1) for cell in self._shell(center, r) if cell in self._cells]
+        found = []
+        for cell in cells:
+            for key in self._cells[cell]:
+                chord = self._chord(vector, key)
+                if chord <= max_chord and (accept is None or accept(key)):
+                    found.append((chord, key))
+        found.sort(key=lambda f: f[0])
+        return [(2 * math.asin(min(1.0, chord / 2)), key) for chord, key in found]
+
+
+class WaypointEntry(NamedTuple):
+    waypoint: object
+    body_id: int
+    latitude: float
+    longitude: float
+    surface_altitude: float
+    has_contract: bool
+    near_surface: bool
+
+
+class WaypointIndex:
+    # Spatial index over the game's waypoints, one SphereGrid per celestial body.
+    # The waypoint list is streamed, so contracts that appear or complete update the index incrementally: only new
+    # waypoints are read (in one request), and a query while nothing changed makes no RPCs at all.
+    # Usage:
+    #   index = WaypointIndex(conn)
+    #   body = vessel.orbit.body
+    #   index.nearest(body, latitude, longitude, k=3, max_surface_altitude=15_000)
+    #   index.within(body, latitude, longitude, 20_000)
+    def __init__(self, conn, cell_size: float = 0.02):
+        self.conn = conn
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._entries: Dict[int, WaypointEntry] = {}
+        self._grids: Dict[int, SphereGrid] = {}
+        self._radii: Dict[int, float] = {}
+        self._stream = registry_for(conn).acquire(getattr, conn.space_center.waypoint_manager, "waypoints")
+        self._pending: Optional[list] = self._stream()
+        self._stream.stream.add_callback(self._on_waypoints)
+
+    def _on_waypoints(self, waypoints):
+        with self._lock:
+            self._pending = waypoints
+
+    def refresh(self):
+        # Apply the latest waypoint list, if it changed since the last query
+        with self._lock:
+            waypoints, self._pending = self._pending, None
+        if waypoints is None:
+            return
+        current = {w._object_id: w for w in waypoints}
+        for object_id in set(self._entries) - set(current):
+            entry = self._entries.pop(object_id)
+            self._grids[entry.body_id].remove(object_id)
+
+        added = [w for object_id, w in current.items() if object_id not in self._entries]
+        for waypoint, row in zip(added, read_waypoints(added, client=self.conn)):
+            body, latitude, longitude, altitude, has_contract, near_surface = row
+            body_id = body._object_id
+            if body_id not in self._grids:
+                self._grids[body_id] = SphereGrid(self.cell_size)
+                self._radii[body_id] = handles_for(self.conn).constants(body).equatorial_radius
+            entry = WaypointEntry(waypoint, body_id, latitude, longitude, altitude, has_contract, near_surface)
+            self._entries[waypoint._object_id] = entry
+            self._grids[body_id].add(waypoint._object_id, latitude, longitude)
+
+    def _query(self, body, latitude, longitude, search, max_surface_altitude, has_contract, near_surface):
+        self.refresh()
+        body_id = body._object_id
+        grid = self._grids.get(body_id)
+        if grid is None:
+            return []
+
+        def accept(object_id) -> bool:
+            entry = self._entries[object_id]
+            return bool(
+                waypoint_mask(
+                    entry.surface_altitude,
+                    entry.has_contract,
+                    entry.near_surface,
+                    max_surface_altitude,
+                    has_contract,
+                    near_surface,
+                )
+            )
+
+        # The grid finds the candidates, they are ranked like helper.rank_waypoints ranks all waypoints
+        entries = [self._entries[object_id] for _, object_id in search(grid, accept)]
+        return rank_by_distance(
+            [e.waypoint for e in entries],
+            latitude,
+            longitude,
+            [e.latitude for e in entries],
+            [e.longitude for e in entries],
+            [e.surface_altitude for e in entries],
+            self._radii[body_id],
+        )
+
+    def nearest(
+        self,
+        body,
+        latitude: float,
+        longitude: float,
+        k: int = 1,
+        max_surface_altitude: float = math.inf,
+        has_contract: bool = True,
+        near_surface: bool = True,
+    ) -> List[RankedWaypoint]:
+        # Up to k waypoints on 'body' matching the filters, nearest to the position first
+        return self._query(
+            body,
+            latitude,
+            longitude,
+            lambda grid, accept: grid.nearest(latitude, longitude, k, accept),
+            max_surface_altitude,
+            has_contract,
+            near_surface,
+        )
+
+    def within(
+        self,
+        body,
+        latitude: float,
+        longitude: float,
+        distance: float,
+        max_surface_altitude: float = math.inf,
+        has_contract: bool = True,
+        near_surface: bool = True,
+    ) -> List[RankedWaypoint]:
+        # All waypoints on 'body' matching the filters within 'distance' meters of the position, nearest first
+        self.refresh()
+        radius = self._radii.get(body._object_id, 1)
+        return self._query(
+            body,
+            latitude,
+            longitude,
+            lambda grid, accept: grid.within(latitude, longitude, distance / radius, accept),
+            max_surface_altitude,
+            has_contract,
+            near_surface,
+        )
+
+    def close(self):
+        self._stream.stream.remove_callback(self._on_waypoints)
+        self._stream.release()